@@ -0,0 +1,211 @@
+import json
+import math
+import os
+import time
+from urllib.parse import urlparse
+
+import redis
+from celery.signals import task_failure, task_postrun, task_revoked
+
+import redis_cache
+
+# Admission control of the OCR endpoints. Every enqueued OCR job is registered in a Redis hash (task id ->
+# strategy, PDF bytes, enqueue time) until the worker finishes it, so the API knows the per-strategy number
+# of jobs and the bytes in flight. The job limits are checked and the job registered in one Lua script, so
+# concurrent requests can't all pass the check before any of them is counted. A new job is rejected with
+# `429 Too Many Requests` + `Retry-After` when:
+#
+#   - the strategy has ADMISSION_MAX_JOBS_<STRATEGY> (or ADMISSION_MAX_JOBS) jobs in flight,
+#   - the PDFs in flight would exceed ADMISSION_MAX_INFLIGHT_BYTES,
+#   - the Celery broker queue holds ADMISSION_MAX_QUEUE_DEPTH messages,
+#   - the client ran out of its token bucket (CLIENT_RATE_LIMIT requests per minute, CLIENT_RATE_BURST burst).
+#
+# All limits default to 0 - disabled. `/ocr/load` reports the current load and the limits.
+
+INFLIGHT_KEY = 'ocr_admission:inflight'
+BUCKET_KEY_PREFIX = 'ocr_admission:bucket:'
+
+# tasks registered by the API and released on the worker (ocr_merge_task finishes split documents under the same id)
+TRACKED_TASKS = ('tasks.ocr_task', 'tasks.ocr_merge_task')
+# a failed page range of a split document - the chord callback (ocr_merge_task) never runs, the slot of the job
+# (the parent id, argument 5) is released when the page range fails
+PAGE_RANGE_TASK = 'tasks.ocr_pages_task'
+
+ADMISSION_MAX_JOBS = int(os.getenv('ADMISSION_MAX_JOBS', '0'))
+ADMISSION_MAX_INFLIGHT_BYTES = int(os.getenv('ADMISSION_MAX_INFLIGHT_BYTES', '0'))
+ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv('ADMISSION_MAX_QUEUE_DEPTH', '0'))
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', '10'))
+# jobs not released for this long (eg. a killed worker) no longer count
+ADMISSION_INFLIGHT_TTL = int(os.getenv('ADMISSION_INFLIGHT_TTL', str(6 * 3600)))
+
+CLIENT_RATE_LIMIT = float(os.getenv('CLIENT_RATE_LIMIT', '0'))  # requests per minute
+CLIENT_RATE_BURST = int(os.getenv('CLIENT_RATE_BURST', '0')) or max(1, int(CLIENT_RATE_LIMIT))
+# header identifying the client (eg. X-Api-Key set by the gateway) - the peer address is used when not set
+CLIENT_ID_HEADER = os.getenv('CLIENT_ID_HEADER')
+
+BROKER_QUEUE = os.getenv('ADMISSION_QUEUE', 'celery')
+
+# atomic token bucket - returns [allowed (0/1), tokens left]
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+# atomic check and registration of a job in flight - drops the stale entries, returns ['ok', 0] when the job
+# was registered or [limit, current value] when it was rejected
+RESERVE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local strategy = ARGV[3]
+local num_bytes = tonumber(ARGV[4])
+local max_jobs = tonumber(ARGV[5])
+local max_bytes = tonumber(ARGV[6])
+local entries = redis.call('HGETALL', KEYS[1])
+local jobs = 0
+local bytes = 0
+for i = 1, #entries, 2 do
+    local entry = cjson.decode(entries[i + 1])
+    if now - entry['enqueued_at'] > ttl then
+        redis.call('HDEL', KEYS[1], entries[i])
+    else
+        if entry['strategy'] == strategy then
+            jobs = jobs + 1
+        end
+        bytes = bytes + entry['bytes']
+    end
+end
+if max_jobs > 0 and jobs >= max_jobs then
+    return {'max_jobs', jobs}
+end
+if max_bytes > 0 and bytes + num_bytes > max_bytes then
+    return {'max_inflight_bytes', bytes}
+end
+redis.call('HSET', KEYS[1], ARGV[7], ARGV[8])
+return {'ok', 0}
+"""
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, message, retry_after):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def max_jobs(strategy):
+    return int(os.getenv(f'ADMISSION_MAX_JOBS_{strategy.upper()}', str(ADMISSION_MAX_JOBS)))
+
+
+def limits(strategies):
+    return {
+        'max_jobs': {strategy: max_jobs(strategy) for strategy in strategies},
+        'max_inflight_bytes': ADMISSION_MAX_INFLIGHT_BYTES,
+        'max_queue_depth': ADMISSION_MAX_QUEUE_DEPTH,
+        'client_rate_limit_per_minute': CLIENT_RATE_LIMIT,
+        'client_rate_burst': CLIENT_RATE_BURST if CLIENT_RATE_LIMIT > 0 else 0
+    }
+
+
+async def inflight(redis_client):
+    """Jobs and bytes in flight per strategy - drops the entries older than ADMISSION_INFLIGHT_TTL."""
+    entries = await redis_client.hgetall(INFLIGHT_KEY)
+    load = {}
+    stale = []
+    now = time.time()
+    for task_id, entry in entries.items():
+        entry = json.loads(entry)
+        if now - entry['enqueued_at'] > ADMISSION_INFLIGHT_TTL:
+            stale.append(task_id)
+            continue
+        strategy_load = load.setdefault(entry['strategy'], {'jobs': 0, 'bytes': 0})
+        strategy_load['jobs'] += 1
+        strategy_load['bytes'] += entry['bytes']
+    if stale:
+        await redis_client.hdel(INFLIGHT_KEY, *stale)
+    return load
+
+
+async def queue_depth(broker_client):
+    if broker_client is None:
+        return None
+    return await broker_client.llen(BROKER_QUEUE)
+
+
+async def admit(redis_client, broker_client, task_id, strategy, num_bytes, client_id):
+    """Register the job as in flight - raise AdmissionRejected (nothing registered) when it doesn't fit in the limits."""
+    if CLIENT_RATE_LIMIT > 0:
+        rate = CLIENT_RATE_LIMIT / 60
+        allowed, tokens = await redis_client.eval(TOKEN_BUCKET_SCRIPT, 1, BUCKET_KEY_PREFIX + client_id, rate, CLIENT_RATE_BURST, time.time())
+        if not int(allowed):
+            raise AdmissionRejected('client_quota', f"Request quota of {CLIENT_RATE_LIMIT:g} per minute exceeded", max(1, math.ceil((1 - float(tokens)) / rate)))
+
+    if ADMISSION_MAX_QUEUE_DEPTH > 0:
+        depth = await queue_depth(broker_client)
+        if depth is not None and depth >= ADMISSION_MAX_QUEUE_DEPTH:
+            raise AdmissionRejected('max_queue_depth', f"Task queue is full ({depth} waiting)", ADMISSION_RETRY_AFTER)
+
+    now = time.time()
+    entry = json.dumps({'strategy': strategy, 'bytes': num_bytes, 'enqueued_at': now})
+    strategy_max_jobs = max_jobs(strategy)
+    if strategy_max_jobs <= 0 and ADMISSION_MAX_INFLIGHT_BYTES <= 0:
+        await redis_client.hset(INFLIGHT_KEY, task_id, entry)  # no limits to check
+        return
+    limit, value = await redis_client.eval(RESERVE_SCRIPT, 1, INFLIGHT_KEY, now, ADMISSION_INFLIGHT_TTL, strategy, num_bytes,
+                                           strategy_max_jobs, ADMISSION_MAX_INFLIGHT_BYTES, task_id, entry)
+    limit = limit.decode() if isinstance(limit, bytes) else limit
+    if limit == 'max_jobs':
+        raise AdmissionRejected('max_jobs', f"Too many '{strategy}' jobs in flight ({value})", ADMISSION_RETRY_AFTER)
+    if limit == 'max_inflight_bytes':
+        raise AdmissionRejected('max_inflight_bytes', f"Too many bytes in flight ({value})", ADMISSION_RETRY_AFTER)
+
+
+async def unregister(redis_client, task_id):
+    await redis_client.hdel(INFLIGHT_KEY, task_id)
+
+
+def broker_supports_queue_depth(broker_url):
+    return urlparse(broker_url).scheme in ('redis', 'rediss')
+
+
+# the worker side - releases the job once the task has finished
+
+def release(task_id):
+    try:
+        redis_cache.redis_client().hdel(INFLIGHT_KEY, task_id)
+    except redis.RedisError as e:
+        print('Error releasing the admission slot:', e)
+
+
+@task_postrun.connect
+def release_finished_task(task_id=None, task=None, state=None, **kwargs):
+    # IGNORED - ocr_task replaced by the split document chord, ocr_merge_task releases the slot later
+    if task is not None and task.name in TRACKED_TASKS and state != 'IGNORED':
+        release(task_id)
+
+
+@task_failure.connect
+def release_failed_page_range(sender=None, args=None, kwargs=None, **other):
+    if sender is None or sender.name != PAGE_RANGE_TASK:
+        return
+    parent_task_id = (kwargs or {}).get('parent_task_id') or (args[5] if args and len(args) > 5 else None)
+    if parent_task_id:
+        release(parent_task_id)
+
+
+@task_revoked.connect
+def release_revoked_task(request=None, **kwargs):
+    if request is not None and request.task in TRACKED_TASKS:
+        release(request.id)
@@ -14,7 +14,8 @@ def make_celery():
         backend=os.getenv('CELERY_RESULT_BACKEND', 'redis://redis:6379/0')
     )
     celery.config_from_object({
-        "worker_max_memory_per_child": 8200000
+        "worker_max_memory_per_child": 8200000,
+        "result_expires": int(os.getenv('RESULT_EXPIRES', '86400'))  # seconds; spooled results (result_store.py) expire alike
     })
     return celery
 
@@ -0,0 +1,133 @@
+import base64
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zlib is used instead
+    zstandard = None
+
+# Transparent compression of the large values kept in Redis - the OCR cache entries and the task results
+# (plus the extracted text repeated in the PROGRESS meta). Values of at least COMPRESSION_MIN_BYTES are
+# compressed with COMPRESSION_CODEC (`auto` - zstd when the `zstandard` package is installed, zlib otherwise -
+# `zstd`, `zlib` or `none`) and get a header with the codec, so entries written before (plain UTF-8 text,
+# never starting with a NUL byte) stay readable and the codec can be changed at any time.
+#
+# The cache stores raw bytes: HEADER + codec id + payload. The result backend serializes to JSON, so the
+# results are strings: RESULT_PREFIX + base64(HEADER + codec id + payload).
+
+HEADER = b'\x00PXC'
+RESULT_PREFIX = '\x00PXC:b64:'
+CODEC_IDS = {'zlib': b'z', 'zstd': b's'}
+
+# Redis hash with the compression counters (see `record_stats` / `read_stats`)
+STATS_KEY = 'ocr_compression:stats'
+STATS_KINDS = ('cache', 'result', 'page_result')  # page_result - the page range results of a split document
+
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '4096'))
+
+
+def codec_name():
+    codec = os.getenv('COMPRESSION_CODEC', 'auto')
+    if codec == 'auto':
+        return 'zstd' if zstandard is not None else 'zlib'
+    if codec not in ('zstd', 'zlib', 'none'):
+        raise ValueError(f"Unknown COMPRESSION_CODEC '{codec}'. Available: auto, zstd, zlib, none")
+    if codec == 'zstd' and zstandard is None:
+        raise ValueError("COMPRESSION_CODEC=zstd requires the zstandard package")
+    return codec
+
+
+def compress_bytes(data):
+    """Compress `data` (with the header) when it is large enough and compression actually pays off."""
+    codec = codec_name()
+    if codec == 'none' or len(data) < COMPRESSION_MIN_BYTES:
+        return data
+    if codec == 'zstd':
+        payload = zstandard.ZstdCompressor(level=3).compress(data)
+    else:
+        payload = zlib.compress(data, 6)
+    packed = HEADER + CODEC_IDS[codec] + payload
+    return packed if len(packed) < len(data) else data
+
+
+def decompress_bytes(value):
+    """Inverse of `compress_bytes` - values without the header are returned unchanged."""
+    if not value.startswith(HEADER):
+        return value
+    codec_id, payload = value[len(HEADER):len(HEADER) + 1], value[len(HEADER) + 1:]
+    if codec_id == CODEC_IDS['zlib']:
+        return zlib.decompress(payload)
+    if codec_id == CODEC_IDS['zstd']:
+        if zstandard is None:
+            raise ValueError("The value is zstd compressed - install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"Unknown compression codec id {codec_id!r}")
+
+
+def pack_text(text):
+    """OCR cache value (bytes) of `text`."""
+    return compress_bytes(text.encode('utf-8'))
+
+
+def unpack_text(value):
+    """Text of an OCR cache value - written by `pack_text` or a plain UTF-8 entry of an older version."""
+    if value is None:
+        return None
+    return decompress_bytes(value).decode('utf-8')
+
+
+def pack_result(text):
+    """JSON serializable task result / progress value of `text`."""
+    if text is None:
+        return None
+    data = text.encode('utf-8')
+    packed = compress_bytes(data)
+    if packed is data:
+        return text
+    return RESULT_PREFIX + base64.b64encode(packed).decode('ascii')
+
+
+def unpack_result(value):
+    """Text of a task result written by `pack_result` - any other value is returned unchanged."""
+    if isinstance(value, str) and value.startswith(RESULT_PREFIX):
+        return unpack_text(base64.b64decode(value[len(RESULT_PREFIX):]))
+    return value
+
+
+def stored_size(value):
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    return len(value)
+
+
+def record_stats(redis_client, kind, raw_bytes, stored_bytes):
+    """Add one stored value to the compression counters - stats must never fail the task."""
+    try:
+        pipeline = redis_client.pipeline()
+        pipeline.hincrby(STATS_KEY, f"{kind}:values", 1)
+        if stored_bytes < raw_bytes:
+            pipeline.hincrby(STATS_KEY, f"{kind}:compressed_values", 1)
+        pipeline.hincrby(STATS_KEY, f"{kind}:raw_bytes", raw_bytes)
+        pipeline.hincrby(STATS_KEY, f"{kind}:stored_bytes", stored_bytes)
+        pipeline.execute()
+    except Exception as e:
+        print(f"Failed to record the compression stats: {e}")
+
+
+def format_stats(counters):
+    """Compression ratio and memory saved per kind out of the raw `STATS_KEY` hash."""
+    counters = {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in (counters or {}).items()}
+    stats = {'codec': codec_name(), 'min_bytes': COMPRESSION_MIN_BYTES}
+    for kind in STATS_KINDS:
+        raw_bytes = counters.get(f"{kind}:raw_bytes", 0)
+        stored_bytes = counters.get(f"{kind}:stored_bytes", 0)
+        stats[kind] = {
+            'values': counters.get(f"{kind}:values", 0),
+            'compressed_values': counters.get(f"{kind}:compressed_values", 0),
+            'raw_bytes': raw_bytes,
+            'stored_bytes': stored_bytes,
+            'saved_bytes': raw_bytes - stored_bytes,
+            'compression_ratio': round(raw_bytes / stored_bytes, 2) if stored_bytes else None
+        }
+    return stats
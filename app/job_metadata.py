@@ -0,0 +1,45 @@
+import json
+
+from result_store import RESULT_EXPIRES
+
+# Metadata of an OCR job reported by the strategy next to the text (eg. the per-page routing decisions of the
+# `auto` strategy). Kept in a Redis hash per task - one field per page range, so the chunks of a split document
+# write their parts independently - and returned as `metadata` by /ocr/result/{task_id}. Expires with the results.
+
+KEY_PREFIX = 'ocr_job_meta:'
+METADATA_EXPIRES = RESULT_EXPIRES
+# field of the metadata of the LLM step - merged after the pages
+LLM_FIELD = 'llm'
+
+
+def key(task_id):
+    return KEY_PREFIX + task_id
+
+
+def save(redis_client, task_id, first_page, metadata):
+    """Store the metadata of the page range starting at `first_page` (sync client - the worker side)."""
+    if not metadata:
+        return
+    pipeline = redis_client.pipeline()
+    pipeline.hset(key(task_id), str(first_page), json.dumps(metadata))
+    pipeline.expire(key(task_id), METADATA_EXPIRES)
+    pipeline.execute()
+
+
+def merge(entries):
+    """
+    Merge the page range entries of `HGETALL` in page order (then the LLM_FIELD entry) - list values (eg.
+    `routing`) are concatenated, numbers summed. Returns None when there is no metadata.
+    """
+    if not entries:
+        return None
+    merged = {}
+    for first_page in sorted(entries, key=lambda field: (0, int(field)) if field.isdigit() else (1, 0)):
+        for name, value in json.loads(entries[first_page]).items():
+            if name not in merged:
+                merged[name] = value
+            elif isinstance(value, list):
+                merged[name] = merged[name] + value
+            elif isinstance(value, (int, float)):
+                merged[name] = merged[name] + value
+    return merged
@@ -4,16 +4,34 @@ import requests
 from fastapi import FastAPI, Form, Request, UploadFile, File, HTTPException, Body
 from celery.result import AsyncResult
 from storage_manager import StorageManager
+from storage_strategies import remote_cache
 from celery_config import celery
-from tasks import ocr_task, OCR_STRATEGIES
-from hashlib import md5
-import redis
+from tasks import ocr_task, reindex_storage_task, OCR_STRATEGIES, OUTPUT_FORMATS
+from ocr_strategies.preprocessing import resolve_pipeline
+import metrics
+import tracing
+import compression
+import result_store
+import job_metadata
+import page_index
+import search_index
+import admission
+import ollama_pool
+import model_residency
+import profiling
+from ocr_cache import HASH_ALGORITHMS, pdf_hash as content_hash, normalize_hash, cache_key, job_key, is_cache_key
+import redis.asyncio as aioredis
 import os
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pydantic import BaseModel, Field, field_validator
 import ollama
 import base64
 from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 import torch
 
 
@@ -21,7 +39,33 @@ def storage_profile_exists(profile_name: str) -> bool:
     profile_path = os.path.abspath(os.path.join(os.getenv('STORAGE_PROFILE_PATH', '/storage_profiles'), f'{profile_name}.yaml'))
     return os.path.isfile(profile_path)
 
+def validate_output_format(strategy: str, output_format: str):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}'. Available: {', '.join(OUTPUT_FORMATS)}")
+    if output_format == 'json' and strategy in OCR_STRATEGIES and not OCR_STRATEGIES[strategy].supports_structured_output:
+        raise ValueError(f"Strategy '{strategy}' does not support the 'json' output format.")
+
+def validate_preprocessing(preprocessing: Optional[str]):
+    if preprocessing:
+        resolve_pipeline(preprocessing)  # raises ValueError on unknown presets/steps
+
+def validate_hash_algorithm(hash_algorithm: str):
+    if hash_algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unknown hash algorithm '{hash_algorithm}'. Available: {', '.join(HASH_ALGORITHMS)}")
+
 app = FastAPI()
+app.mount("/metrics", metrics.make_metrics_app())
+metrics.install_stage_hook()
+tracing.setup_tracing()
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    if not tracing.tracing_enabled():
+        return await call_next(request)
+    with tracing.http_server_span(request.method, request.url.path, request.headers) as span:
+        response = await call_next(request)
+        span.set_attribute('http.response.status_code', response.status_code)
+        return response
 
 # Add CORS middleware configuration
 app.add_middleware(
@@ -32,19 +76,81 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Connect to Redis
+# Connect to Redis - one connection pool shared by all requests of this process
 redis_url = os.getenv('REDIS_CACHE_URL', 'redis://redis:6379/1')
-redis_client = redis.StrictRedis.from_url(redis_url)
+redis_pool = aioredis.BlockingConnectionPool.from_url(redis_url, max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', '50')), timeout=10)
+redis_client = aioredis.Redis(connection_pool=redis_pool)
+
+# Celery broker - read for the queue depth limit of the admission control
+broker_url = os.getenv('CELERY_BROKER_URL', 'redis://redis:6379/0')
+broker_client = aioredis.Redis.from_url(broker_url) if admission.broker_supports_queue_depth(broker_url) else None
+
+# Non-blocking Ollama clients of the hosts in OLLAMA_HOSTS (OLLAMA_HOST when not set) - see ollama_pool.py
+ollama_hosts = ollama_pool.get_pool()
+
+# Calls without an asyncio API (Celery result backend and broker, storage strategies, torch) run in this
+# bounded thread pool so they never block the event loop serving the other requests
+blocking_executor = ThreadPoolExecutor(max_workers=int(os.getenv('API_BLOCKING_THREADS', '16')), thread_name_prefix='api-blocking')
+
+async def run_blocking(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(blocking_executor, partial(fn, *args, **kwargs))
+
+# How long `/ocr/lookup` hands out the id of an enqueued job - keep it at most the Celery result expiry
+OCR_JOB_INDEX_TTL = int(os.getenv('OCR_JOB_INDEX_TTL', str(result_store.RESULT_EXPIRES)))
+
+def client_id(request: Request):
+    if admission.CLIENT_ID_HEADER and request.headers.get(admission.CLIENT_ID_HEADER):
+        return request.headers.get(admission.CLIENT_ID_HEADER)
+    return request.client.host if request.client else 'unknown'
+
+def check_profile_allowed(request: Request, profile):
+    """Profiling (see profiling.py) is for admins only - the request has to carry the PROFILE_ADMIN_TOKEN."""
+    if profile and not profiling.is_admin(request.headers.get(profiling.PROFILE_ADMIN_HEADER)):
+        raise HTTPException(status_code=403, detail="Profiling is restricted to admins.")
+
+async def admit(request: Request, strategy, num_bytes):
+    """
+    Admission control (see admission.py) - returns the id of the job, registered as in flight, or responds
+    with 429 and Retry-After when over the limits.
+    """
+    # registered before it's sent, so a fast worker can't release it before it's registered
+    task_id = str(uuid.uuid4())
+    try:
+        await admission.admit(redis_client, broker_client, task_id, strategy, num_bytes, client_id(request))
+    except admission.AdmissionRejected as e:
+        metrics.record_rejection(strategy, e.reason)
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
+    return task_id
+
+async def enqueue_ocr(task_id, pdf_bytes, strategy, pdf_filename, pdf_hash, ocr_cache, prompt, model, storage_profile, storage_filename, output_format, preprocessing, profile=False):
+    """
+    Start `ocr_task` admitted under `task_id` (see `admit`) and remember its id in the job index (see
+    `ocr_cache.job_key`). `pdf_bytes` is None when the job only post-processes a cached OCR result.
+    """
+    try:
+        task = await run_blocking(ocr_task.apply_async, args=[pdf_bytes, strategy, pdf_filename, pdf_hash, ocr_cache, prompt, model, storage_profile, storage_filename, output_format, preprocessing, profile], headers={'enqueued_at': time.time(), **tracing.inject_headers()}, task_id=task_id)
+    except Exception:
+        await admission.unregister(redis_client, task_id)
+        raise
+    tracing.set_attributes(task_id=task.id)
+    if ocr_cache:
+        await redis_client.set(job_key(cache_key(pdf_hash, output_format, preprocessing), strategy, prompt, model, storage_profile, storage_filename), task.id, ex=OCR_JOB_INDEX_TTL)
+    return task.id
 
 @app.post("/ocr")
 async def ocr_endpoint(
+    request: Request,
     strategy: str = Form(...),
     model: str = Form(...),
     file: UploadFile = File(...),
     ocr_cache: bool = Form(...),
     prompt: str = Form(None),
     storage_profile: str = Form('default'),
-    storage_filename: str = Form(None)
+    storage_filename: str = Form(None),
+    output_format: str = Form('text'),
+    preprocessing: str = Form(None),
+    hash_algorithm: str = Form('md5'),
+    profile: bool = Form(False)
 ):
     """
     Endpoint to extract text from an uploaded PDF file using different OCR strategies.
@@ -57,40 +163,62 @@ async def ocr_endpoint(
     if file.content_type not in ['application/pdf', 'application/octet-stream']:
         raise HTTPException(status_code=400, detail="Invalid file type. Only PDFs are supported.")
 
+    try:
+        validate_output_format(strategy, output_format)
+        validate_preprocessing(preprocessing)
+        validate_hash_algorithm(hash_algorithm)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    check_profile_allowed(request, profile)
+
     pdf_bytes = await file.read()
 
     # Generate a hash of the PDF content for caching
-    pdf_hash = md5(pdf_bytes).hexdigest()
+    pdf_hash = await run_blocking(content_hash, pdf_bytes, hash_algorithm)
+
+    print(f"Processing PDF {file.filename} with strategy: {strategy}, ocr_cache: {ocr_cache}, model: {model}, storage_profile: {storage_profile}, storage_filename: {storage_filename}, output_format: {output_format}, preprocessing: {preprocessing}")
 
-    print(f"Processing PDF {file.filename} with strategy: {strategy}, ocr_cache: {ocr_cache}, model: {model}, storage_profile: {storage_profile}, storage_filename: {storage_filename}")
+    task_id = await admit(request, strategy, len(pdf_bytes))
+    metrics.record_ingest('/ocr/upload', strategy, len(pdf_bytes))
+    tracing.set_attributes(strategy=strategy, bytes=len(pdf_bytes))
 
     # Asynchronous processing using Celery
-    task = ocr_task.apply_async(args=[pdf_bytes, strategy, file.filename, pdf_hash, ocr_cache, prompt, model, storage_profile, storage_filename])
-    return {"task_id": task.id}
+    task_id = await enqueue_ocr(task_id, pdf_bytes, strategy, file.filename, pdf_hash, ocr_cache, prompt, model, storage_profile, storage_filename, output_format, preprocessing, profile)
+    return {"task_id": task_id}
 
 # this is an alias for /ocr - to keep the backward compatibility
 @app.post("/ocr/upload")
 async def ocr_upload_endpoint(
+    request: Request,
     strategy: str = Form(...),
     model: str = Form(...),
     file: UploadFile = File(...),
     ocr_cache: bool = Form(...),
     prompt: str = Form(None),
     storage_profile: str = Form('default'),
-    storage_filename: str = Form(None)
+    storage_filename: str = Form(None),
+    output_format: str = Form('text'),
+    preprocessing: str = Form(None),
+    hash_algorithm: str = Form('md5'),
+    profile: bool = Form(False)
 ):
     """
     Alias endpoint to extract text from an uploaded PDF file using different OCR strategies.
     Supports both synchronous and asynchronous processing.
     """
     return await ocr_endpoint(
+        request=request,
         strategy=strategy,
         model=model,
         file=file,
         ocr_cache=ocr_cache,
         prompt=prompt,
         storage_profile=storage_profile,
-        storage_filename=storage_filename
+        storage_filename=storage_filename,
+        output_format=output_format,
+        preprocessing=preprocessing,
+        hash_algorithm=hash_algorithm,
+        profile=profile
     )
 
 class OllamaGenerateRequest(BaseModel):
@@ -108,11 +236,20 @@ class OcrRequest(BaseModel):
     ocr_cache: bool = Field(..., description="Enable OCR result caching")
     storage_profile: Optional[str] = Field('default', description="Storage profile to use")
     storage_filename: Optional[str] = Field(None, description="Storage filename to use")
+    output_format: Optional[str] = Field('text', description="Output format: text or json (per-page words, boxes and confidences)")
+    preprocessing: Optional[str] = Field(None, description="Tesseract image preprocessing preset (eg. scan, fax) or comma separated steps")
+    hash_algorithm: Optional[str] = Field('md5', description="Content hash used for the OCR cache: md5 or sha256")
+    profile: Optional[bool] = Field(False, description="Capture a CPU and memory profile of the job (admins only)")
 
     @field_validator('strategy')
     def validate_strategy(cls, v):
         if v not in OCR_STRATEGIES:
-            raise ValueError(f"Unknown strategy '{v}'. Available: marker, tesseract")
+            raise ValueError(f"Unknown strategy '{v}'. Available: {', '.join(OCR_STRATEGIES)}")
+        return v
+
+    @field_validator('hash_algorithm')
+    def check_hash_algorithm(cls, v):
+        validate_hash_algorithm(v)
         return v
 
     @field_validator('file')
@@ -131,6 +268,16 @@ class OcrRequest(BaseModel):
             raise ValueError(f"Storage profile '{v}' does not exist.")
         return v
 
+    @field_validator('output_format')
+    def check_output_format(cls, v, info):
+        validate_output_format(info.data.get('strategy'), v)
+        return v
+
+    @field_validator('preprocessing')
+    def check_preprocessing(cls, v):
+        validate_preprocessing(v)
+        return v
+
 class OcrFormRequest(BaseModel):
     strategy: str = Field(..., description="OCR strategy to use")
     prompt: Optional[str] = Field(None, description="Prompt for the Ollama model")
@@ -138,11 +285,13 @@ class OcrFormRequest(BaseModel):
     ocr_cache: bool = Field(..., description="Enable OCR result caching")
     storage_profile: Optional[str] = Field('default', description="Storage profile to use")
     storage_filename: Optional[str] = Field(None, description="Storage filename to use")
+    output_format: Optional[str] = Field('text', description="Output format: text or json (per-page words, boxes and confidences)")
+    preprocessing: Optional[str] = Field(None, description="Tesseract image preprocessing preset (eg. scan, fax) or comma separated steps")
 
     @field_validator('strategy')
     def validate_strategy(cls, v):
         if v not in OCR_STRATEGIES:
-            raise ValueError(f"Unknown strategy '{v}'. Available: marker, tesseract")
+            raise ValueError(f"Unknown strategy '{v}'. Available: {', '.join(OCR_STRATEGIES)}")
         return v
 
     @field_validator('storage_profile')
@@ -151,8 +300,18 @@ class OcrFormRequest(BaseModel):
             raise ValueError(f"Storage profile '{v}' does not exist.")
         return v
 
+    @field_validator('output_format')
+    def check_output_format(cls, v, info):
+        validate_output_format(info.data.get('strategy'), v)
+        return v
+
+    @field_validator('preprocessing')
+    def check_preprocessing(cls, v):
+        validate_preprocessing(v)
+        return v
+
 @app.post("/ocr/request")
-async def ocr_request_endpoint(request: OcrRequest):
+async def ocr_request_endpoint(request: OcrRequest, http_request: Request):
     """
     Endpoint to extract text from an uploaded PDF file using different OCR strategies.
     Supports both synchronous and asynchronous processing.
@@ -165,51 +324,275 @@ async def ocr_request_endpoint(request: OcrRequest):
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+    check_profile_allowed(http_request, request.profile)
     file_content = base64.b64decode(request.file)
 
     # Process the file content as needed
-    pdf_hash = md5(file_content).hexdigest()
+    pdf_hash = await run_blocking(content_hash, file_content, request.hash_algorithm)
+
+    print(f"Processing PDF with strategy: {request.strategy}, ocr_cache: {request.ocr_cache}, model: {request.model}, storage_profile: {request.storage_profile}, storage_filename: {request.storage_filename}, output_format: {request.output_format}, preprocessing: {request.preprocessing}")
 
-    print(f"Processing PDF with strategy: {request.strategy}, ocr_cache: {request.ocr_cache}, model: {request.model}, storage_profile: {request.storage_profile}, storage_filename: {request.storage_filename}")
+    task_id = await admit(http_request, request.strategy, len(file_content))
+    metrics.record_ingest('/ocr/request', request.strategy, len(file_content))
+    tracing.set_attributes(strategy=request.strategy, bytes=len(file_content))
 
     # Asynchronous processing using Celery
-    task = ocr_task.apply_async(args=[file_content, request.strategy, "uploaded_file.pdf", pdf_hash, request.ocr_cache, request.prompt, request.model, request.storage_profile, request.storage_filename])
-    return {"task_id": task.id}
+    task_id = await enqueue_ocr(task_id, file_content, request.strategy, "uploaded_file.pdf", pdf_hash, request.ocr_cache, request.prompt, request.model, request.storage_profile, request.storage_filename, request.output_format, request.preprocessing, request.profile)
+    return {"task_id": task_id}
 
-@app.get("/ocr/result/{task_id}")
-async def ocr_status(task_id: str):
+class OcrLookupRequest(BaseModel):
+    hash_algorithm: Optional[str] = Field('md5', description="Algorithm of the content hash: md5 or sha256")
+    hash: str = Field(..., description="Hex digest of the PDF content")
+    strategy: str = Field(..., description="OCR strategy to use")
+    prompt: Optional[str] = Field(None, description="Prompt for the Ollama model")
+    model: Optional[str] = Field('llama3.1', description="Model to use for the Ollama endpoint")
+    file_name: Optional[str] = Field('uploaded_file.pdf', description="Original file name - used for the default storage filename")
+    storage_profile: Optional[str] = Field('default', description="Storage profile to use")
+    storage_filename: Optional[str] = Field(None, description="Storage filename to use")
+    output_format: Optional[str] = Field('text', description="Output format: text or json (per-page words, boxes and confidences)")
+    preprocessing: Optional[str] = Field(None, description="Tesseract image preprocessing preset (eg. scan, fax) or comma separated steps")
+
+    @field_validator('hash_algorithm')
+    def check_hash_algorithm(cls, v):
+        validate_hash_algorithm(v)
+        return v
+
+    @field_validator('hash')
+    def check_hash(cls, v, info):
+        return normalize_hash(v, info.data.get('hash_algorithm') or 'md5')
+
+    @field_validator('strategy')
+    def validate_strategy(cls, v):
+        if v not in OCR_STRATEGIES:
+            raise ValueError(f"Unknown strategy '{v}'. Available: {', '.join(OCR_STRATEGIES)}")
+        return v
+
+    @field_validator('storage_profile')
+    def validate_storage_profile(cls, v):
+        if v and not storage_profile_exists(v):
+            raise ValueError(f"Storage profile '{v}' does not exist.")
+        return v
+
+    @field_validator('output_format')
+    def check_output_format(cls, v, info):
+        validate_output_format(info.data.get('strategy'), v)
+        return v
+
+    @field_validator('preprocessing')
+    def check_preprocessing(cls, v):
+        validate_preprocessing(v)
+        return v
+
+def get_task_state(task_id: str):
+    return AsyncResult(task_id, app=celery).state
+
+@app.post("/ocr/lookup")
+async def ocr_lookup_endpoint(request: OcrLookupRequest, http_request: Request):
     """
-    Endpoint to get the status of an OCR task using task_id.
+    Endpoint to check the OCR cache by the PDF content hash before uploading the file.
+    Returns a known job id (`job`), the cached result (`hit` - as `text`, or as `task_id` when the result
+    still goes through the LLM prompt and/or storage) or `miss` - then upload the file as usual.
     """
+    ocr_cache_key = cache_key(request.hash, request.output_format, request.preprocessing)
+
+    known_task_id = await redis_client.get(job_key(ocr_cache_key, request.strategy, request.prompt, request.model, request.storage_profile, request.storage_filename))
+    if known_task_id:
+        known_task_id = known_task_id.decode('utf-8')
+        if await run_blocking(get_task_state, known_task_id) not in ('FAILURE', 'REVOKED'):
+            return {"status": "job", "task_id": known_task_id}
+
+    cached_result = await redis_client.get(ocr_cache_key)
+    if not cached_result:
+        return {"status": "miss"}
+
+    if not request.prompt and not request.storage_profile:
+        return {"status": "hit", "text": await run_blocking(compression.unpack_text, cached_result)}
+
+    # the task picks the cached OCR result up and only runs the LLM prompt / storage steps
+    task_id = await admit(http_request, request.strategy, 0)
+    task_id = await enqueue_ocr(task_id, None, request.strategy, request.file_name, request.hash, True, request.prompt, request.model, request.storage_profile, request.storage_filename, request.output_format, request.preprocessing)
+    return {"status": "hit", "task_id": task_id}
+
+def get_task_status(task_id: str):
     task = AsyncResult(task_id, app=celery)
+    state = task.state
 
-    if task.state == 'PENDING':
-        return {"state": task.state, "status": "Task is pending..."}
-    elif task.state == 'PROGRESS':
+    if state == 'PENDING':
+        return {"state": state, "status": "Task is pending..."}
+    elif state == 'PROGRESS':
         task_info = task.info
+        if task_info.get('extracted_text'):
+            task_info['extracted_text'] = compression.unpack_result(task_info['extracted_text'])
         if task_info.get('start_time'):
             task_info['elapsed_time'] = time.time() - int(task_info.get('start_time'))
-        return {"state": task.state, "status": task.info.get("status"), "info": task_info } 
-    elif task.state == 'SUCCESS':
-        return {"state": task.state, "status": "Task completed successfully.", "result": task.result}
+        return {"state": state, "status": task_info.get("status"), "info": task_info }
+    elif state == 'SUCCESS':
+        if result_store.is_reference(task.result):
+            # large result kept in the spool - fetch it from the download endpoint
+            return {"state": state, "status": "Task completed successfully.", "result": None, "result_url": f"/ocr/result/{task_id}/download", "result_bytes": task.result['bytes']}
+        return {"state": state, "status": "Task completed successfully.", "result": compression.unpack_result(task.result)}
     else:
-        return {"state": task.state, "status": str(task.info)}
+        return {"state": state, "status": str(task.info)}
+
+@app.get("/ocr/result/{task_id}")
+async def ocr_status(task_id: str):
+    """
+    Endpoint to get the status of an OCR task using task_id.
+    """
+    status = await run_blocking(get_task_status, task_id)
+    if status['state'] == 'SUCCESS':
+        # eg. the per-page routing decisions of the `auto` strategy
+        metadata = job_metadata.merge(await redis_client.hgetall(job_metadata.key(task_id)))
+        if metadata:
+            status['metadata'] = metadata
+    return status
+
+def get_task_result(task_id: str):
+    task = AsyncResult(task_id, app=celery)
+    if task.state != 'SUCCESS':
+        return task.state, None
+    return task.state, task.result
+
+@app.get("/ocr/result/{task_id}/download")
+async def ocr_result_download(task_id: str, request: Request):
+    """
+    Endpoint to download the result of a finished OCR task as a stream. Supports `Range: bytes=...` requests
+    to fetch big results incrementally and gzip (`Accept-Encoding: gzip`) for whole downloads.
+    """
+    state, result = await run_blocking(get_task_result, task_id)
+    if state != 'SUCCESS':
+        raise HTTPException(status_code=404, detail=f"No result for the task (state: {state})")
+
+    if result_store.is_reference(result):
+        path = result_store.result_path(result)
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=410, detail="The result has expired")
+        size = os.path.getsize(path)
+        media_type = result['content_type']
+        file_name = os.path.basename(path)
+        read_range = lambda start, end: result_store.iter_file(path, start, end)
+    else:
+        text = compression.unpack_result(result)
+        if not isinstance(text, str):
+            # eg. the summary of a storage reindex - only OCR results can be downloaded
+            raise HTTPException(status_code=404, detail="The task has no downloadable OCR result")
+        data = text.encode('utf-8')
+        size = len(data)
+        extension = result_store.result_extension(text)
+        media_type = result_store.CONTENT_TYPES[extension]
+        file_name = task_id + extension
+        read_range = lambda start, end: iter([data[start:end + 1]])
+
+    headers = {'Accept-Ranges': 'bytes', 'Vary': 'Accept-Encoding', 'Content-Disposition': f'attachment; filename="{file_name}"'}
+    try:
+        byte_range = result_store.parse_range(request.headers.get('range'), size)
+    except ValueError:
+        return Response(status_code=416, headers={'Content-Range': f'bytes */{size}'})
+
+    if byte_range:
+        start, end = byte_range
+        headers.update({'Content-Range': f'bytes {start}-{end}/{size}', 'Content-Length': str(end - start + 1)})
+        return StreamingResponse(read_range(start, end), status_code=206, media_type=media_type, headers=headers)
+
+    if size and 'gzip' in request.headers.get('accept-encoding', ''):
+        headers['Content-Encoding'] = 'gzip'
+        return StreamingResponse(result_store.iter_gzip(read_range(0, size - 1)), media_type=media_type, headers=headers)
+
+    headers['Content-Length'] = str(size)
+    return StreamingResponse(read_range(0, size - 1) if size else iter([]), media_type=media_type, headers=headers)
+
+@app.get("/ocr/result/{task_id}/profile")
+async def ocr_result_profile(task_id: str, request: Request, part: Optional[str] = None, format: str = 'json'):
+    """
+    Endpoint to get the profiling reports of a task sent with `profile` (admins only) - the JSON reports of all the
+    parts, or with `format=pstats` the raw cProfile stats of one `part` (`task` by default) for snakeviz / pstats.
+    """
+    check_profile_allowed(request, True)
+    if format == 'pstats':
+        path = profiling.report_path(task_id, os.path.basename(part or 'task'), '.prof')
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail="No profile for the task")
+        return FileResponse(path, media_type='application/octet-stream', filename=os.path.basename(path))
+
+    reports = await run_blocking(profiling.load_reports, task_id)
+    if part:
+        reports = [report for report in reports if report['part'] == part]
+    if not reports:
+        raise HTTPException(status_code=404, detail="No profile for the task")
+    return {"task_id": task_id, "parts": reports}
+
+@app.get("/ocr/load")
+async def ocr_load():
+    """
+    Endpoint reporting the current load and the admission limits - for load balancers to shed traffic early.
+    Responds with 503 when no strategy accepts new jobs.
+    """
+    load = await admission.inflight(redis_client)
+    limits = admission.limits(OCR_STRATEGIES)
+    depth = await admission.queue_depth(broker_client)
+    inflight_bytes = sum(strategy_load['bytes'] for strategy_load in load.values())
+
+    saturated = (limits['max_inflight_bytes'] > 0 and inflight_bytes >= limits['max_inflight_bytes']) or \
+                (limits['max_queue_depth'] > 0 and depth is not None and depth >= limits['max_queue_depth'])
+    strategies = {}
+    for strategy in OCR_STRATEGIES:
+        strategy_load = load.get(strategy, {'jobs': 0, 'bytes': 0})
+        max_jobs = limits['max_jobs'][strategy]
+        strategies[strategy] = {**strategy_load, 'accepting': not saturated and (max_jobs <= 0 or strategy_load['jobs'] < max_jobs)}
+
+    accepting = any(strategy_load['accepting'] for strategy_load in strategies.values())
+    content = {
+        "accepting": accepting,
+        "queue_depth": depth,
+        "inflight_jobs": sum(strategy_load['jobs'] for strategy_load in load.values()),
+        "inflight_bytes": inflight_bytes,
+        "strategies": strategies,
+        "limits": limits
+    }
+    return JSONResponse(content, status_code=200 if accepting else 503)
 
 @app.post("/ocr/clear_cache")
 async def clear_ocr_cache():
     """
     Endpoint to clear the OCR result cache in Redis.
     """
-    redis_client.flushdb()
-    return {"status": "OCR cache cleared"}
+    # only the cached results and the page index - the DB also holds the admission slots, rate limit buckets,
+    # job index, metadata, split progress and stats
+    page_index_prefixes = (f"{page_index.KEY_PREFIX}band:".encode(), f"{page_index.KEY_PREFIX}entry:".encode())
+    deleted = 0
+    batch = []
+    async for key in redis_client.scan_iter(count=1000):
+        key_bytes = key.encode() if isinstance(key, str) else key
+        if is_cache_key(key_bytes) or key_bytes.startswith(page_index_prefixes):
+            batch.append(key)
+        if len(batch) >= 1000:
+            deleted += await redis_client.delete(*batch)
+            batch = []
+    if batch:
+        deleted += await redis_client.delete(*batch)
+    return {"status": "OCR cache cleared", "deleted_keys": deleted}
+
+@app.get("/ocr/compression_stats")
+async def compression_stats():
+    """
+    Endpoint to get the compression ratio and the Redis memory saved on the OCR cache entries and task results.
+    """
+    return compression.format_stats(await redis_client.hgetall(compression.STATS_KEY))
+
+@app.get("/ocr/page_index_stats")
+async def page_index_stats():
+    """
+    Endpoint to get the hit rate of the page fingerprint index and the candidates rejected by its false-match safeguard.
+    """
+    return page_index.format_stats(await redis_client.hgetall(page_index.STATS_KEY))
 
 @app.get("/storage/list")
 async def list_files(storage_profile: str = 'default'):
     """
     Endpoint to list files using the selected storage profile.
     """
-    storage_manager = StorageManager(storage_profile)
-    files = storage_manager.list()
+    storage_manager = await run_blocking(StorageManager, storage_profile)
+    files = await run_blocking(storage_manager.list)
     return {"files": files}
 
 @app.get("/storage/load")
@@ -217,8 +600,8 @@ async def load_file(file_name: str, storage_profile: str = 'default'):
     """
     Endpoint to load a file using the selected storage profile.
     """
-    storage_manager = StorageManager(storage_profile)
-    content = storage_manager.load(file_name)
+    storage_manager = await run_blocking(StorageManager, storage_profile)
+    content = await run_blocking(storage_manager.load, file_name)
     return {"content": content}
 
 @app.delete("/storage/delete")
@@ -226,23 +609,56 @@ async def delete_file(file_name: str, storage_profile: str = 'default'):
     """
     Endpoint to delete a file using the selected storage profile.
     """
-    storage_manager = StorageManager(storage_profile)
-    storage_manager.delete(file_name)
+    storage_manager = await run_blocking(StorageManager, storage_profile)
+    await run_blocking(storage_manager.delete, file_name)
     return {"status": f"File {file_name} deleted successfully"}
 
+@app.get("/storage/cache_stats")
+async def storage_cache_stats():
+    """
+    Endpoint to get the counters of the local read-through cache of the remote storage profiles (this API process).
+    """
+    return {**remote_cache.stats(), 'max_bytes': remote_cache.STORAGE_CACHE_MAX_BYTES, 'max_object_bytes': remote_cache.STORAGE_CACHE_MAX_OBJECT_BYTES}
+
+@app.get("/storage/search")
+async def search_files(query: str, storage_profile: Optional[str] = None, limit: int = 20, raw: bool = False):
+    """
+    Endpoint to search the stored results - files containing all the terms of the query (eg. an invoice number),
+    best matches first, with a snippet around the match. `raw=true` - the query uses the SQLite FTS5 syntax.
+    """
+    start = time.perf_counter()
+    try:
+        results = await run_blocking(search_index.search, query, storage_profile, max(1, min(limit, 200)), raw)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"results": results, "took_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+@app.post("/storage/reindex")
+async def reindex_files(storage_profile: str = 'default'):
+    """
+    Endpoint to add the files already stored with the storage profile to the search index - runs as a task.
+    """
+    if not storage_profile_exists(storage_profile):
+        raise HTTPException(status_code=400, detail=f"Storage profile '{storage_profile}' does not exist.")
+    task = await run_blocking(reindex_storage_task.apply_async, args=[storage_profile])
+    return {"task_id": task.id}
+
 @app.post("/llm/pull")
 async def pull_llama(request: OllamaPullRequest):
     """
     Endpoint to pull the latest Llama model from the Ollama API.
     """
     print("Pulling " + request.model)
-    try:
-        response = ollama.pull(request.model)
-    except ollama.ResponseError as e:
-        print('Error:', e.error)
+    # every host of the pool gets the model - any of them may be picked for a request
+    results = await ollama_hosts.abroadcast(lambda client: client.pull(request.model))
+    failed = {host: result for host, result in results.items() if isinstance(result, Exception)}
+    for host, error in failed.items():
+        print(f"Error pulling on {host}:", getattr(error, 'error', error))
+    if len(failed) == len(results):
         raise HTTPException(status_code=500, detail="Failed to pull Llama model from Ollama API")
 
-    return {"status": response.get("status", "Model pulled successfully")}
+    response = next(result for result in results.values() if not isinstance(result, Exception))
+    return {"status": response.get("status", "Model pulled successfully"), "failed_hosts": list(failed)}
 
 @app.post("/llm/generate")
 async def generate_llama(request: OllamaGenerateRequest):
@@ -254,12 +670,13 @@ async def generate_llama(request: OllamaGenerateRequest):
         raise HTTPException(status_code=400, detail="No prompt provided")
 
     try:
-        response = ollama.generate(request.model, request.prompt)
+        response = await ollama_hosts.acall(lambda client: client.generate(request.model, request.prompt, keep_alive=model_residency.keep_alive(request.model)),
+                                            operation='generate', model=request.model)
     except ollama.ResponseError as e:
         print('Error:', e.error)
         if e.status_code == 404:
             print("Error: ", e.error)
-            ollama.pull(request.model)
+            await ollama_hosts.abroadcast(lambda client: client.pull(request.model))
 
         raise HTTPException(status_code=500, detail="Failed to generate text with Ollama API")
 
@@ -272,7 +689,7 @@ async def list_models():
     Endpoint to list all available Ollama models.
     """
     try:
-        response = ollama.list()
+        response = await ollama_hosts.acall(lambda client: client.list(), operation='list')
         # Print response for debugging
         print("Ollama response:", response)
         # Extract model names from the Model objects
@@ -286,6 +703,50 @@ async def list_models():
         print('Error:', e.error)
         raise HTTPException(status_code=500, detail="Failed to get models from Ollama API")
 
+def get_gpu_info():
+    gpu_info = {
+        "cuda_available": torch.cuda.is_available(),
+        "device_count": torch.cuda.device_count() if torch.cuda.is_available() else 0,
+    }
+        
+    if gpu_info["cuda_available"]:
+        # Create a large tensor to test memory allocation
+        test_tensor = torch.zeros((1024, 1024, 32), device='cuda')  # Allocate ~128MB
+        # Force some computations
+        test_tensor = torch.rand_like(test_tensor)
+        torch.cuda.synchronize()  # Make sure the operation is complete
+            
+        gpu_info.update({
+            "current_device": torch.cuda.current_device(),
+            "device_name": torch.cuda.get_device_name(0),
+            "memory_allocated": f"{torch.cuda.memory_allocated(0)/1024**3:.2f} GB",
+            "memory_reserved": f"{torch.cuda.memory_reserved(0)/1024**3:.2f} GB",
+            "max_memory_allocated": f"{torch.cuda.max_memory_allocated(0)/1024**3:.2f} GB",
+            "total_memory": f"{torch.cuda.get_device_properties(0).total_memory/1024**3:.2f} GB",
+            "memory_allocated_bytes": torch.cuda.memory_allocated(0),
+            "memory_reserved_bytes": torch.cuda.memory_reserved(0),
+        })
+            
+        # Clean up test tensor
+        del test_tensor
+        torch.cuda.empty_cache()
+
+    return gpu_info
+
+@app.post("/llm/warm")
+async def warm_models(request: OllamaPullRequest):
+    """
+    Endpoint to load a model on all the Ollama hosts (with its keep_alive policy) - reports the cold load seconds per host.
+    """
+    return {"hosts": await run_blocking(model_residency.warm, ollama_hosts, [request.model])}
+
+@app.get("/llm/hosts")
+async def ollama_hosts_stats():
+    """
+    Endpoint to get the health, load, latency and throughput of the Ollama hosts (as seen by the API process).
+    """
+    return {"hosts": ollama_hosts.stats()}
+
 @app.get("/llm/system_info")
 async def get_system_info():
     """
@@ -293,35 +754,10 @@ async def get_system_info():
     """
     try:
         # Get list of models with their details
-        models_response = ollama.list()
-        
-        # Get GPU information using PyTorch
-        gpu_info = {
-            "cuda_available": torch.cuda.is_available(),
-            "device_count": torch.cuda.device_count() if torch.cuda.is_available() else 0,
-        }
+        models_response = await ollama_hosts.acall(lambda client: client.list(), operation='list')
         
-        if gpu_info["cuda_available"]:
-            # Create a large tensor to test memory allocation
-            test_tensor = torch.zeros((1024, 1024, 32), device='cuda')  # Allocate ~128MB
-            # Force some computations
-            test_tensor = torch.rand_like(test_tensor)
-            torch.cuda.synchronize()  # Make sure the operation is complete
-            
-            gpu_info.update({
-                "current_device": torch.cuda.current_device(),
-                "device_name": torch.cuda.get_device_name(0),
-                "memory_allocated": f"{torch.cuda.memory_allocated(0)/1024**3:.2f} GB",
-                "memory_reserved": f"{torch.cuda.memory_reserved(0)/1024**3:.2f} GB",
-                "max_memory_allocated": f"{torch.cuda.max_memory_allocated(0)/1024**3:.2f} GB",
-                "total_memory": f"{torch.cuda.get_device_properties(0).total_memory/1024**3:.2f} GB",
-                "memory_allocated_bytes": torch.cuda.memory_allocated(0),
-                "memory_reserved_bytes": torch.cuda.memory_reserved(0),
-            })
-            
-            # Clean up test tensor
-            del test_tensor
-            torch.cuda.empty_cache()
+        # Get GPU information using PyTorch (allocates and synchronizes on the GPU - off the event loop)
+        gpu_info = await run_blocking(get_gpu_info)
 
         # Get model details
         models_info = []
@@ -353,6 +789,23 @@ async def get_system_info():
         print('Error:', e.error)
         raise HTTPException(status_code=500, detail="Failed to get system information")
 
+def get_gpu_status():
+    gpu_status = {
+        "cuda_available": torch.cuda.is_available(),
+        "device_count": torch.cuda.device_count() if torch.cuda.is_available() else 0
+    }
+        
+    if gpu_status["cuda_available"]:
+        # Run a small tensor operation to verify GPU
+        test_tensor = torch.cuda.FloatTensor(2, 2).fill_(1.0)
+        gpu_status["test_operation"] = "successful"
+        gpu_status["current_device"] = torch.cuda.current_device()
+        gpu_status["device_name"] = torch.cuda.get_device_name(0)
+        gpu_status["memory_allocated"] = f"{torch.cuda.memory_allocated(0)/1024**3:.2f} GB"
+        gpu_status["memory_reserved"] = f"{torch.cuda.memory_reserved(0)/1024**3:.2f} GB"
+
+    return gpu_status
+
 @app.post("/llm/test_gpu")
 async def test_gpu_usage(request: OllamaGenerateRequest):
     """
@@ -360,20 +813,8 @@ async def test_gpu_usage(request: OllamaGenerateRequest):
     """
     try:
         # Check GPU status with PyTorch
-        gpu_status = {
-            "cuda_available": torch.cuda.is_available(),
-            "device_count": torch.cuda.device_count() if torch.cuda.is_available() else 0
-        }
-        
-        if gpu_status["cuda_available"]:
-            # Run a small tensor operation to verify GPU
-            test_tensor = torch.cuda.FloatTensor(2, 2).fill_(1.0)
-            gpu_status["test_operation"] = "successful"
-            gpu_status["current_device"] = torch.cuda.current_device()
-            gpu_status["device_name"] = torch.cuda.get_device_name(0)
-            gpu_status["memory_allocated"] = f"{torch.cuda.memory_allocated(0)/1024**3:.2f} GB"
-            gpu_status["memory_reserved"] = f"{torch.cuda.memory_reserved(0)/1024**3:.2f} GB"
-        
+        gpu_status = await run_blocking(get_gpu_status)
+
         # Use default prompt if none provided
         prompt = request.prompt or "This is a test prompt to verify GPU usage."
         
@@ -384,7 +825,8 @@ async def test_gpu_usage(request: OllamaGenerateRequest):
             "generation_time": 0
         }
         
-        response = ollama.generate(request.model, prompt)
+        response = await ollama_hosts.acall(lambda client: client.generate(request.model, prompt, keep_alive=model_residency.keep_alive(request.model)),
+                                            operation='generate', model=request.model)
         generation_result["generated_text"] = response.get("response", "")
         generation_result["generation_time"] = time.time() - generation_result["start_time"]
         
@@ -0,0 +1,131 @@
+import os
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import redis
+from celery.signals import worker_init, worker_process_init
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, make_asgi_app, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client import multiprocess
+
+from stages import add_stage_hook
+
+# Prometheus metrics of the API and the Celery workers. The API serves them on `/metrics`, each worker
+# on its own port (METRICS_WORKER_PORT, 9540 by default, 0 disables it). When the API or the worker runs several
+# processes, set PROMETHEUS_MULTIPROC_DIR to a shared, empty directory so the values are aggregated.
+
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram('pdf_extract_stage_seconds', 'Time spent in a processing stage', ['stage', 'strategy'], buckets=STAGE_BUCKETS)
+QUEUE_WAIT_SECONDS = Histogram('pdf_extract_queue_wait_seconds', 'Time between enqueueing an OCR task and a worker starting it', ['strategy'], buckets=STAGE_BUCKETS)
+PAGES_PROCESSED = Counter('pdf_extract_pages_processed_total', 'Pages processed by the OCR strategies', ['strategy'])
+CACHE_REQUESTS = Counter('pdf_extract_ocr_cache_requests_total', 'OCR cache lookups', ['strategy', 'result'])
+BYTES_INGESTED = Counter('pdf_extract_bytes_ingested_total', 'PDF bytes accepted by the API', ['endpoint', 'strategy'])
+OCR_REQUESTS = Counter('pdf_extract_ocr_requests_total', 'OCR tasks enqueued by the API', ['endpoint', 'strategy'])
+ADMISSION_REJECTIONS = Counter('pdf_extract_admission_rejections_total', 'OCR requests rejected by the admission control', ['strategy', 'reason'])
+OLLAMA_TOKENS = Counter('pdf_extract_ollama_tokens_total', 'Tokens generated by Ollama', ['model', 'stage'])
+OLLAMA_TOKENS_PER_SECOND = Histogram('pdf_extract_ollama_tokens_per_second', 'Ollama generation speed per call', ['model', 'stage'],
+                                     buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500))
+OLLAMA_REQUESTS = Counter('pdf_extract_ollama_requests_total', 'Requests sent to the Ollama hosts of the pool', ['host', 'operation', 'outcome'])
+OLLAMA_COLD_LOADS = Counter('pdf_extract_ollama_cold_loads_total', 'Ollama responses that had to load the model first', ['host', 'model'])
+OLLAMA_COLD_LOAD_SECONDS = Counter('pdf_extract_ollama_cold_load_seconds_total', 'Time Ollama spent loading models', ['host', 'model'])
+OLLAMA_REQUEST_SECONDS = Histogram('pdf_extract_ollama_request_seconds', 'Duration of the requests sent to the Ollama hosts', ['host', 'operation'], buckets=STAGE_BUCKETS)
+
+# stages reporting the number of pages of the document they processed
+PAGE_COUNTING_STAGES = ('rasterize', 'convert')
+
+
+@contextmanager
+def metrics_stage_hook(name, attributes):
+    """Stage hook (see stages.py) recording the stage duration and the counters derived from its attributes."""
+    start = time.perf_counter()
+    yield
+    strategy = attributes.get('strategy', '')
+    STAGE_SECONDS.labels(name, strategy).observe(time.perf_counter() - start)
+
+    if name in PAGE_COUNTING_STAGES and attributes.get('pages'):
+        PAGES_PROCESSED.labels(strategy).inc(attributes['pages'])
+    if name == 'cache_lookup':
+        CACHE_REQUESTS.labels(strategy, 'hit' if attributes.get('hit') else 'miss').inc()
+    if name == 'ollama_request':
+        OLLAMA_REQUESTS.labels(attributes.get('host', ''), attributes.get('operation', ''), attributes.get('outcome', 'failed')).inc()
+        OLLAMA_REQUEST_SECONDS.labels(attributes.get('host', ''), attributes.get('operation', '')).observe(time.perf_counter() - start)
+        if attributes.get('cold_load_seconds'):
+            OLLAMA_COLD_LOADS.labels(attributes.get('host', ''), attributes.get('model', '')).inc()
+            OLLAMA_COLD_LOAD_SECONDS.labels(attributes.get('host', ''), attributes.get('model', '')).inc(attributes['cold_load_seconds'])
+    if attributes.get('eval_count') and attributes.get('eval_duration'):
+        model = attributes.get('model', '')
+        OLLAMA_TOKENS.labels(model, name).inc(attributes['eval_count'])
+        OLLAMA_TOKENS_PER_SECOND.labels(model, name).observe(attributes['eval_count'] / (attributes['eval_duration'] / 1e9))
+
+
+def install_stage_hook():
+    add_stage_hook(metrics_stage_hook)
+
+
+def record_queue_wait(strategy, enqueued_at):
+    if enqueued_at:
+        QUEUE_WAIT_SECONDS.labels(strategy).observe(max(0.0, time.time() - float(enqueued_at)))
+
+
+def record_ingest(endpoint, strategy, num_bytes):
+    BYTES_INGESTED.labels(endpoint, strategy).inc(num_bytes)
+    OCR_REQUESTS.labels(endpoint, strategy).inc()
+
+
+def record_rejection(strategy, reason):
+    ADMISSION_REJECTIONS.labels(strategy, reason).inc()
+
+
+class QueueDepthCollector:
+    """Reports the length of the Celery queues on the Redis broker at scrape time."""
+
+    def __init__(self, broker_url, queues):
+        self.broker_url = broker_url
+        self.queues = queues
+        self.client = None
+
+    def collect(self):
+        gauge = GaugeMetricFamily('pdf_extract_queue_depth', 'Messages waiting in the Celery broker queue', labels=['queue'])
+        if urlparse(self.broker_url).scheme in ('redis', 'rediss'):
+            try:
+                if self.client is None:
+                    self.client = redis.StrictRedis.from_url(self.broker_url)
+                for queue in self.queues:
+                    gauge.add_metric([queue], self.client.llen(queue))
+            except redis.RedisError as e:
+                print('Error reading queue depth:', e)
+        yield gauge
+
+
+def metrics_registry():
+    """Registry to expose - aggregated over all processes when PROMETHEUS_MULTIPROC_DIR is set."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def make_metrics_app():
+    """ASGI app serving the API metrics - including the broker queue depths."""
+    registry = metrics_registry()
+    queues = [queue.strip() for queue in os.getenv('METRICS_QUEUES', 'celery').split(',') if queue.strip()]
+    registry.register(QueueDepthCollector(os.getenv('CELERY_BROKER_URL', 'redis://redis:6379/0'), queues))
+    return make_asgi_app(registry=registry)
+
+
+@worker_process_init.connect
+def install_worker_process_hook(**kwargs):
+    # pool processes (prefork) do not inherit the hook installed in the main worker process
+    install_stage_hook()
+
+
+@worker_init.connect
+def start_worker_exporter(**kwargs):
+    install_stage_hook()
+    port = int(os.getenv('METRICS_WORKER_PORT', '9540'))
+    if port:
+        start_http_server(port, registry=metrics_registry())
+        print(f"Worker metrics exporter listening on port {port}")
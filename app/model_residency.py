@@ -0,0 +1,93 @@
+import os
+import threading
+
+from celery.signals import worker_init
+
+# Keeps the Ollama models resident on the hosts so OCR jobs don't pay the model load (seconds to minutes for
+# llama3.2-vision) after an idle period, and the vision and text models don't evict each other on a shared GPU:
+#
+#   - OLLAMA_WARM_MODELS - models loaded on every host of the pool (see ollama_pool.py) when a worker starts,
+#   - OLLAMA_KEEP_ALIVE / OLLAMA_MODEL_KEEP_ALIVE - how long Ollama keeps a model loaded after a request: the
+#     default for all models and per model overrides (`llama3.2-vision=1h,llama3.1=10m`, -1 - forever),
+#   - requests go to a host already holding their model unless it is OLLAMA_MODEL_SWITCH_PENALTY requests busier
+#     than a host that would have to load it. Requests are not held back to batch the pages of the loaded model
+#     before a host switches - a worker (--pool=solo) sends its pages one at a time and doesn't see the requests
+#     queued by the other workers, so the routing is the only lever,
+#   - a response with a load time of OLLAMA_COLD_LOAD_SECONDS or more is a cold load - reported with its cost in
+#     the `cold_loads` of the job metadata, the host stats (/llm/hosts) and the metrics.
+
+OLLAMA_WARM_MODELS = [model.strip() for model in os.getenv('OLLAMA_WARM_MODELS', '').split(',') if model.strip()]
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE') or None  # None - the Ollama server default (5m)
+OLLAMA_MODEL_SWITCH_PENALTY = int(os.getenv('OLLAMA_MODEL_SWITCH_PENALTY', '2'))
+OLLAMA_COLD_LOAD_SECONDS = float(os.getenv('OLLAMA_COLD_LOAD_SECONDS', '1'))
+
+
+def normalize(model):
+    """Model name as Ollama reports it - `llama3.1` is `llama3.1:latest`."""
+    return model if ':' in model else model + ':latest'
+
+
+def parse_keep_alive(value):
+    # Ollama takes durations (`10m`, `1h`) or seconds - plain numbers are sent as numbers (-1 keeps the model forever)
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def parse_policies(value):
+    policies = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            model, keep_alive = item.split('=', 1)
+            policies[normalize(model.strip())] = parse_keep_alive(keep_alive.strip())
+    return policies
+
+
+OLLAMA_MODEL_KEEP_ALIVE = parse_policies(os.getenv('OLLAMA_MODEL_KEEP_ALIVE'))
+
+
+def keep_alive(model):
+    """`keep_alive` to send with the requests for the model (None - the server default)."""
+    if normalize(model) in OLLAMA_MODEL_KEEP_ALIVE:
+        return OLLAMA_MODEL_KEEP_ALIVE[normalize(model)]
+    return parse_keep_alive(OLLAMA_KEEP_ALIVE) if OLLAMA_KEEP_ALIVE else None
+
+
+def cold_load(result, host, model):
+    """The cold load event of a response (a dict with Ollama's `load_duration` in ns) or None."""
+    load_duration = result.get('load_duration') if hasattr(result, 'get') else None
+    if not load_duration or load_duration / 1e9 < OLLAMA_COLD_LOAD_SECONDS:
+        return None
+    return {'model': model, 'host': host, 'seconds': round(load_duration / 1e9, 2)}
+
+
+def warm(pool, models=None):
+    """Load the models on all the hosts of the pool - {host: {model: cold load seconds or error}}."""
+    report = {}
+    for host in pool.hosts:
+        report[host.url] = {}
+        for model in models or OLLAMA_WARM_MODELS:
+            try:
+                # an empty prompt only loads the model
+                response = host.client.generate(model, '', keep_alive=keep_alive(model))
+            except Exception as e:
+                print(f"Failed to warm {model} on {host.url}: {e}")
+                report[host.url][model] = str(e)
+                continue
+            event = pool.record_load(host, model, response)
+            report[host.url][model] = event['seconds'] if event else 0
+            print(f"Warmed {model} on {host.url}" + (f" - loaded in {event['seconds']}s" if event else " - already resident"))
+    return report
+
+
+@worker_init.connect
+def warm_models_at_start(**kwargs):
+    if not OLLAMA_WARM_MODELS:
+        return
+    import ollama_pool
+
+    # in the background - the worker takes tasks meanwhile (the first ones may still pay the load). A pool of
+    # its own - the clients of the shared one must not be opened before the pool processes are forked
+    pool = ollama_pool.OllamaPool(ollama_pool.host_urls())
+    threading.Thread(target=warm, args=(pool,), daemon=True, name='ollama-warm').start()
@@ -0,0 +1,64 @@
+import hashlib
+import re
+
+# Content hashes accepted for the OCR cache. MD5 keys stay bare (as before), other algorithms are prefixed
+# with their name - eg. `sha256:<hex>` - so both can live in the same cache.
+HASH_ALGORITHMS = {'md5': 32, 'sha256': 64}
+
+
+def pdf_hash(pdf_bytes, hash_algorithm='md5'):
+    """Content hash of the PDF in the form used in the cache keys."""
+    if hash_algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unknown hash algorithm '{hash_algorithm}'. Available: {', '.join(HASH_ALGORITHMS)}")
+    digest = hashlib.new(hash_algorithm, pdf_bytes).hexdigest()
+    return digest if hash_algorithm == 'md5' else f"{hash_algorithm}:{digest}"
+
+
+def normalize_hash(hex_digest, hash_algorithm='md5'):
+    """Validate a hash computed by a client (eg. `/ocr/lookup`) and return it in the cache key form."""
+    if hash_algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unknown hash algorithm '{hash_algorithm}'. Available: {', '.join(HASH_ALGORITHMS)}")
+    hex_digest = (hex_digest or '').strip().lower()
+    if hex_digest.startswith(f"{hash_algorithm}:"):
+        hex_digest = hex_digest[len(hash_algorithm) + 1:]
+    if not re.fullmatch(f"[0-9a-f]{{{HASH_ALGORITHMS[hash_algorithm]}}}", hex_digest):
+        raise ValueError(f"Invalid {hash_algorithm} hash - expected {HASH_ALGORITHMS[hash_algorithm]} hex characters.")
+    return hex_digest if hash_algorithm == 'md5' else f"{hash_algorithm}:{hex_digest}"
+
+
+def cache_key(pdf_hash, output_format='text', preprocessing=None):
+    """
+    Redis key of the cached OCR result. Plain text results without extra options keep using the
+    bare PDF hash so the entries cached before output formats were introduced stay valid.
+    """
+    key = pdf_hash
+    if output_format and output_format != 'text':
+        key += f":{output_format}"
+    if preprocessing:
+        key += f":pre={preprocessing}"
+    return key
+
+
+# keys written by `cache_key` - the bare MD5 or `<algorithm>:<hex>`, optionally followed by the options
+CACHE_KEY_PATTERN = re.compile(r'(?:[0-9a-f]{32}|sha256:[0-9a-f]{64})(?::.*)?', re.DOTALL)
+
+
+def is_cache_key(key):
+    """Whether the Redis key holds a cached OCR result - the job and control state in the same DB lives under named prefixes."""
+    if isinstance(key, bytes):
+        key = key.decode('utf-8', errors='replace')
+    return CACHE_KEY_PATTERN.fullmatch(key) is not None
+
+
+def job_key(ocr_cache_key, strategy, prompt=None, model=None, storage_profile=None, storage_filename=None):
+    """
+    Redis key of the job index - the id of the last task enqueued for the document with these options,
+    so `/ocr/lookup` can hand out a running job instead of starting the same work again. A job storing its
+    result elsewhere (or not at all) is other work - the storage options are part of the key.
+    """
+    key = f"ocr_job:{ocr_cache_key}:{strategy}"
+    if prompt:
+        key += ':llm=' + hashlib.md5(f"{model}\n{prompt}".encode('utf-8')).hexdigest()
+    if storage_profile:
+        key += ':storage=' + hashlib.md5(f"{storage_profile}\n{storage_filename}".encode('utf-8')).hexdigest()
+    return key
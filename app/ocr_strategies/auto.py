@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from ocr_strategies.ocr_strategy import OCRStrategy
+from ocr_strategies import rasterizers
+from ocr_strategies import structured_output
+from ocr_strategies.preprocessing import preprocess
+from ocr_strategies.tesseract import RENDER_DPI, RENDER_COLORSPACE
+from ocr_strategies.tesseract_engines import get_engine
+from pdf_utils import select_pages
+from stages import stage
+
+# The `auto` strategy picks the engine page by page, cheapest first:
+#
+#   1. `text_layer` - the page has a usable text layer (AUTO_TEXT_LAYER_MIN_CHARS characters, no broken glyphs)
+#      and images cover at most AUTO_MAX_IMAGE_COVERAGE of it - the text is taken as is, nothing is rendered,
+#   2. `blank` - the rendered page has (almost) no ink,
+#   3. `tesseract` - Tesseract finds AUTO_MIN_WORDS words with a mean confidence of AUTO_MIN_CONFIDENCE,
+#   4. `escalated` - anything else (handwriting, poor scans, complex layouts) goes to AUTO_ESCALATION_STRATEGY
+#      (`llama_vision` or `marker`), one page at a time.
+#
+# Every decision - route and the scores it was made on - is reported in the `routing` list of the result metadata.
+
+AUTO_TEXT_LAYER_MIN_CHARS = int(os.getenv('AUTO_TEXT_LAYER_MIN_CHARS', '100'))
+AUTO_MAX_IMAGE_COVERAGE = float(os.getenv('AUTO_MAX_IMAGE_COVERAGE', '0.3'))
+AUTO_MIN_WORDS = int(os.getenv('AUTO_MIN_WORDS', '5'))
+AUTO_MIN_CONFIDENCE = float(os.getenv('AUTO_MIN_CONFIDENCE', '80'))
+AUTO_ESCALATION_STRATEGY = os.getenv('AUTO_ESCALATION_STRATEGY', 'llama_vision')
+
+# share of dark pixels below which a rendered page counts as blank
+BLANK_INK_RATIO = 0.002
+# share of unmapped glyphs (U+FFFD, control characters) above which the text layer is not trusted
+MAX_BROKEN_GLYPHS = 0.05
+
+
+def probe_pages(pdf_bytes):
+    """Text layer and the share of the page area covered by images, for every page of the document."""
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        probes = []
+        for page in pdf:
+            try:
+                textpage = page.get_textpage()
+                try:
+                    text = textpage.get_text_range().replace('\r\n', '\n')
+                finally:
+                    textpage.close()
+                width, height = page.get_size()
+                image_area = 0
+                for image in page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE]):
+                    left, bottom, right, top = image.get_pos()
+                    image_area += max(0, right - left) * max(0, top - bottom)
+                probes.append({'text': text, 'image_coverage': min(1.0, image_area / (width * height)) if width and height else 0.0})
+            finally:
+                page.close()
+        return probes
+    finally:
+        pdf.close()
+
+
+def text_layer_usable(text, image_coverage):
+    chars = [c for c in text if not c.isspace()]
+    if len(chars) < AUTO_TEXT_LAYER_MIN_CHARS or image_coverage > AUTO_MAX_IMAGE_COVERAGE:
+        return False
+    broken = sum(1 for c in chars if c == '\ufffd' or ord(c) < 32)
+    return broken / len(chars) <= MAX_BROKEN_GLYPHS
+
+
+class AutoOCRStrategy(OCRStrategy):
+    """Per-page routing to the cheapest adequate engine"""
+
+    def __init__(self, strategies):
+        super().__init__()
+        # the strategies hard pages can be escalated to, by name
+        self.strategies = strategies
+
+    def escalation_strategy(self):
+        if AUTO_ESCALATION_STRATEGY not in ('llama_vision', 'marker') or AUTO_ESCALATION_STRATEGY not in self.strategies:
+            raise ValueError(f"Unknown AUTO_ESCALATION_STRATEGY '{AUTO_ESCALATION_STRATEGY}'. Available: llama_vision, marker")
+        return self.strategies[AUTO_ESCALATION_STRATEGY]
+
+    def extract_text_from_pdf(self, pdf_bytes):
+        first_page = self.options.get('first_page', 1)  # set when OCRing a page range of a split document
+        pipeline = self.options.get('preprocessing') or os.getenv('TESSERACT_PREPROCESSING', 'default')
+
+        with stage('probe', strategy='auto', bytes=len(pdf_bytes)) as attributes:
+            probes = probe_pages(pdf_bytes)
+            attributes['pages'] = len(probes)
+
+        texts = [None] * len(probes)
+        routing = []
+        for i, probe in enumerate(probes):
+            routing.append({
+                'page': i + first_page,
+                'text_layer_chars': len(probe['text'].strip()),
+                'image_coverage': round(probe['image_coverage'], 3)
+            })
+            if text_layer_usable(probe['text'], probe['image_coverage']):
+                routing[i]['route'] = 'text_layer'
+                texts[i] = probe['text']
+
+        ocr_pages = [i for i, text in enumerate(texts) if text is None]
+        escalate = []
+        if ocr_pages:
+            with stage('rasterize', strategy='auto', pages=len(ocr_pages), dpi=RENDER_DPI) as attributes:
+                attributes['backend'], images = rasterizers.rasterize(select_pages(pdf_bytes, ocr_pages), RENDER_DPI, RENDER_COLORSPACE)
+            engine = get_engine()
+            for i, image in zip(ocr_pages, images):
+                decision = routing[i]
+                with stage('classify', strategy='auto', page=i + first_page, engine=engine.name) as attributes:
+                    decision['ink'] = round(float((np.asarray(image.convert('L')) < 128).mean()), 4)
+                    if decision['ink'] < BLANK_INK_RATIO:
+                        decision['route'] = 'blank'
+                        texts[i] = ''
+                    else:
+                        page_image, dpi = preprocess(np.array(image), pipeline, RENDER_DPI)
+                        page = structured_output.page_from_tesseract_data(i + first_page, (page_image.shape[1], page_image.shape[0]), engine.image_to_data(page_image, dpi))
+                        confidences = [conf for conf in page['conf'] if conf >= 0]
+                        decision['words'] = len(page['words'])
+                        decision['tesseract_conf'] = round(sum(confidences) / len(confidences), 1) if confidences else None
+                        if decision['words'] >= AUTO_MIN_WORDS and (decision['tesseract_conf'] or 0) >= AUTO_MIN_CONFIDENCE:
+                            decision['route'] = 'tesseract'
+                            texts[i] = page['text']
+                        else:
+                            escalate.append(i)
+                    attributes['route'] = decision.get('route', 'escalated')
+
+        cold_loads = []
+        if escalate:
+            delegate = self.escalation_strategy()
+            delegate.set_update_state_callback(self.update_state_callback or (lambda *args, **kwargs: None))
+            for i in escalate:
+                delegate.set_options({**self.options, 'first_page': i + first_page})
+                with stage('escalate', strategy='auto', page=i + first_page, target=AUTO_ESCALATION_STRATEGY):
+                    texts[i] = delegate.extract_text_from_pdf(select_pages(pdf_bytes, [i]))
+                cold_loads += delegate.metadata.get('cold_loads', [])
+                routing[i]['route'] = 'escalated'
+                routing[i]['strategy'] = AUTO_ESCALATION_STRATEGY
+
+        self.metadata = {'routing': routing}
+        if cold_loads:
+            self.metadata['cold_loads'] = cold_loads
+        return ''.join(f"--- Page {i + first_page} ---\n{text}\n" for i, text in enumerate(texts))
@@ -5,54 +5,87 @@ import ollama
 import io
 import os
 import time
-from pdf2image import convert_from_bytes
+from ocr_strategies import rasterizers
+from stages import stage
+import page_index
+import ollama_pool
+import model_residency
+
+# LLAMA_VISION_RASTER_DPI / LLAMA_VISION_RASTER_COLORSPACE - 200 DPI is pdf2image's default used before
+RENDER_DPI, RENDER_COLORSPACE = rasterizers.settings('llama_vision', default_dpi=200)
 
 class LlamaVisionOCRStrategy(OCRStrategy):
     """Llama 3.2 Vision OCR Strategy"""
 
     def extract_text_from_pdf(self, pdf_bytes):
         # Convert PDF bytes to images
-        images = convert_from_bytes(pdf_bytes)
+        with stage('rasterize', strategy='llama_vision', bytes=len(pdf_bytes), dpi=RENDER_DPI) as attributes:
+            attributes['backend'], images = rasterizers.rasterize(pdf_bytes, RENDER_DPI, RENDER_COLORSPACE)
+            attributes['pages'] = len(images)
         extracted_text = ""
         start_time = time.time()
         ocr_percent_done = 0
         num_pages = len(images)
+        first_page = self.options.get('first_page', 1)  # set when OCRing a page range of a split document
         for i, image in enumerate(images):
-            # Convert image to base64
-            buffered = io.BytesIO()
-            image.save(buffered, format="JPEG")
-            #img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            # Save image to a temporary file and get its path
-            temp_filename = None
-            with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as temp_file:
-                image.save(temp_file, format="JPEG")
-                temp_filename = temp_file.name
-
-            # Generate text using the Llama 3.2 Vision model
-            try:
-                response = ollama.chat(
-                    "llama3.2-vision",
-                    [{
-                        'role': 'user',
-                        'content': os.getenv('LLAMA_VISION_PROMPT', "You are OCR. Convert image to markdown."),
-                        'images': [temp_filename]
-                    }],
-                    stream=True,
-                    options={"num_gpu": 1}  # Enable GPU usage
-                )
-                os.remove(temp_filename)
-                num_chunk = 1
-                for chunk in response:
-                    self.update_state_callback(state='PROGRESS', meta={'progress': str(30 + ocr_percent_done), 'status': 'OCR Processing (page ' + str(i+1) + ' of ' + str(num_pages) +') chunk no: ' + str(num_chunk), 'start_time': start_time, 'elapsed_time': time.time() - start_time})  # Example progress update
-                    num_chunk += 1
-                    extracted_text += chunk['message']['content']
-
-                ocr_percent_done += int(20/num_pages) #20% of work is for OCR - just a stupid assumption from tasks.py
-            except ollama.ResponseError as e:
-                print('Error:', e.error)
-                raise Exception("Failed to generate text with Llama 3.2 Vision model")
-
-            print(response) 
+            def ocr_page():
+                # Convert image to base64
+                buffered = io.BytesIO()
+                image.save(buffered, format="JPEG")
+                #img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
+                # Save image to a temporary file and get its path
+                temp_filename = None
+                with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as temp_file:
+                    image.save(temp_file, format="JPEG")
+                    temp_filename = temp_file.name
+
+                def chat(client):
+                    response = client.chat(
+                        "llama3.2-vision",
+                        [{
+                            'role': 'user',
+                            'content': os.getenv('LLAMA_VISION_PROMPT', "You are OCR. Convert image to markdown."),
+                            'images': [temp_filename]
+                        }],
+                        stream=True,
+                        options={"num_gpu": 1},  # Enable GPU usage
+                        keep_alive=model_residency.keep_alive("llama3.2-vision")
+                    )
+                    page = {'text': ''}  # starts over when the page is retried on another host
+                    num_chunk = 1
+                    for chunk in response:
+                        self.update_state_callback(state='PROGRESS', meta={'progress': str(30 + ocr_percent_done), 'status': 'OCR Processing (page ' + str(i + first_page) + ' of ' + str(num_pages) +') chunk no: ' + str(num_chunk), 'start_time': start_time, 'elapsed_time': time.time() - start_time})  # Example progress update
+                        num_chunk += 1
+                        page['text'] += chunk['message']['content']
+                        if chunk.get('done'):
+                            page['eval_count'] = chunk.get('eval_count')
+                            page['eval_duration'] = chunk.get('eval_duration')
+                            page['load_duration'] = chunk.get('load_duration')
+                    return page
+
+                # Generate text using the Llama 3.2 Vision model - on the least loaded host of the pool (see ollama_pool.py)
+                try:
+                    page = ollama_pool.get_pool().call(chat, operation='chat', model="llama3.2-vision")
+                except ollama.ResponseError as e:
+                    print('Error:', e.error)
+                    raise Exception("Failed to generate text with Llama 3.2 Vision model")
+                finally:
+                    os.remove(temp_filename)
+
+                attributes['eval_count'] = page.get('eval_count')
+                attributes['eval_duration'] = page.get('eval_duration')
+                if page.get('cold_load'):
+                    self.metadata.setdefault('cold_loads', []).append(dict(page['cold_load'], page=first_page + i))
+                return page['text']
+
+            with stage('ocr_page', strategy='llama_vision', page=i + first_page, model='llama3.2-vision') as attributes:
+                if self.options.get('page_index'):
+                    # a page looking the same as one OCRed before reuses its text (see page_index.py)
+                    page_text, attributes['page_index_hit'] = page_index.cached_page(page_index.namespace('llama_vision'), image, ocr_page)
+                else:
+                    page_text = ocr_page()
+            extracted_text += page_text
+            ocr_percent_done += int(20/num_pages) #20% of work is for OCR - just a stupid assumption from tasks.py
             #page_text = response.get("response", "")
             #extracted_text += f"--- Page {i + 1} ---\n{page_text}\n"
 
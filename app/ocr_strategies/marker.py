@@ -1,12 +1,29 @@
+import os
+
 from marker.convert import convert_single_pdf
 from marker.models import load_all_models
 
 from ocr_strategies.ocr_strategy import OCRStrategy
+from stages import stage
+
+# Marker's batch_multiplier - larger layout / OCR / texify batches within a document, raise it with spare VRAM
+MARKER_BATCH_MULTIPLIER = int(os.getenv('MARKER_BATCH_MULTIPLIER', '1'))
+
+# the models are loaded once per process
+_model_lst = None
+
+def load_models():
+    global _model_lst
+    if _model_lst is None:
+        with stage('load_models', strategy='marker'):
+            _model_lst = load_all_models()
+    return _model_lst
 
 class MarkerOCRStrategy(OCRStrategy):
     """Marker OCR Strategy"""
     def extract_text_from_pdf(self, pdf_bytes):
-        model_lst = load_all_models()
-        full_text, images, out_meta = convert_single_pdf(pdf_bytes, model_lst)
+        model_lst = load_models()
+        with stage('convert', strategy='marker', bytes=len(pdf_bytes), batch_multiplier=MARKER_BATCH_MULTIPLIER) as attributes:
+            full_text, images, out_meta = convert_single_pdf(pdf_bytes, model_lst, batch_multiplier=MARKER_BATCH_MULTIPLIER)
+            attributes['pages'] = out_meta.get('pages')
         return full_text
-
@@ -1,16 +1,32 @@
 class OCRStrategy:
+    # set to True by strategies implementing `extract_structured_from_pdf`
+    supports_structured_output = False
 
     def __init__(self):
         print("a")
         self.update_state_callback = None
+        self.options = {}
+        self.metadata = {}
 
     def set_update_state_callback(self, callback):
         self.update_state_callback = callback
 
+    def set_options(self, options):
+        """Per-request strategy options (eg. {'preprocessing': 'scan'}) - set by the task before extracting."""
+        self.options = options or {}
+        self.metadata = {}  # filled by the strategy while extracting - stored with the result (see job_metadata.py)
+
     def update_state(self, state, meta):
         if self.update_state_callback:
             self.update_state_callback(state, meta)
-                
+
     """Base OCR Strategy Interface"""
     def extract_text_from_pdf(self, pdf_bytes):
         raise NotImplementedError("Subclasses must implement this method")
+
+    def extract_structured_from_pdf(self, pdf_bytes):
+        """
+        Return per-page structured OCR output: {"pages": [{"page", "size", "text", "words", "left", "top",
+        "width", "height", "conf", "block", "par", "line"}, ...]} - see `ocr_strategies/structured_output.py`
+        """
+        raise NotImplementedError(f"Structured output is not supported by {type(self).__name__}")
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+
+# Named preprocessing presets - each one is a list of (step name, step kwargs) applied in order.
+# `default` keeps the historical behaviour (channel swap only) so results do not change unless requested.
+PRESETS = {
+    'none': [],
+    'default': [('swap_channels', {})],
+    'grayscale': [('grayscale', {})],
+    'fast': [('grayscale', {}), ('normalize_dpi', {'target_dpi': 150})],
+    'scan': [('grayscale', {}), ('normalize_dpi', {'target_dpi': 300}), ('binarize', {}), ('deskew', {})],
+    'fax': [('grayscale', {}), ('normalize_dpi', {'target_dpi': 300}), ('denoise', {}), ('binarize', {'method': 'adaptive'}), ('deskew', {})],
+}
+
+
+def swap_channels(image, dpi):
+    if image.ndim == 2:  # rendered in grayscale
+        return image, dpi
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), dpi
+
+
+def grayscale(image, dpi):
+    if image.ndim == 2:
+        return image, dpi
+    return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY), dpi
+
+
+def normalize_dpi(image, dpi, target_dpi=300):
+    """Resample the page so Tesseract sees `target_dpi` - it is tuned for ~300 DPI text."""
+    if not dpi or dpi == target_dpi:
+        return image, dpi
+    scale = target_dpi / dpi
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    resized = cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation)
+    return resized, target_dpi
+
+
+def denoise(image, dpi, kernel_size=3):
+    return cv2.medianBlur(image, kernel_size), dpi
+
+
+def binarize(image, dpi, method='otsu', block_size=31, offset=15):
+    image, dpi = grayscale(image, dpi)
+    if method == 'adaptive':
+        # local thresholds cope with the uneven background of faxes and photocopies
+        return cv2.adaptiveThreshold(image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, offset), dpi
+    _, binary = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary, dpi
+
+
+def deskew(image, dpi, max_angle=10.0):
+    """Rotate the page so the text lines are horizontal, based on the min area rectangle of the ink pixels."""
+    gray, _ = grayscale(image, dpi)
+    ink = np.column_stack(np.where(gray < 128))
+    if len(ink) < 100:
+        return image, dpi
+
+    angle = cv2.minAreaRect(ink[:, ::-1].astype(np.float32))[-1]
+    # minAreaRect returns angles in [0, 90) (OpenCV >= 4.5) or [-90, 0) - fold them around 0
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    if abs(angle) < 0.1 or abs(angle) > max_angle:
+        return image, dpi
+
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    rotated = cv2.warpAffine(image, matrix, (width, height), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    return rotated, dpi
+
+
+STEPS = {
+    'swap_channels': swap_channels,
+    'grayscale': grayscale,
+    'normalize_dpi': normalize_dpi,
+    'denoise': denoise,
+    'binarize': binarize,
+    'deskew': deskew,
+}
+
+
+def resolve_pipeline(name):
+    """
+    Return the list of steps for a preset name or for an ad-hoc comma separated list
+    of step names (eg. "grayscale,binarize,deskew"). Raises ValueError for unknown names.
+    """
+    if not name:
+        name = 'default'
+    if name in PRESETS:
+        return PRESETS[name]
+
+    steps = []
+    for step in name.split(','):
+        step = step.strip()
+        if step not in STEPS:
+            raise ValueError(f"Unknown preprocessing preset or step '{step}'. Presets: {', '.join(PRESETS)}; steps: {', '.join(STEPS)}")
+        steps.append((step, {}))
+    return steps
+
+
+def preprocess(image, pipeline, dpi):
+    """
+    Run the page image (NumPy array, RGB as rendered by pdf2image) through the pipeline.
+    Returns the processed image and its resulting DPI.
+    """
+    for step, kwargs in resolve_pipeline(pipeline):
+        image, dpi = STEPS[step](image, dpi, **kwargs)
+    return image, dpi
@@ -0,0 +1,76 @@
+import os
+
+from pdf2image import convert_from_bytes
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # poppler is used instead
+    pdfium = None
+
+# Rendering of the PDF pages to images for the image based strategies (tesseract, llama_vision).
+#
+# RASTERIZER selects the backend: `poppler` (default) runs poppler's `pdftoppm` through pdf2image (a process
+# per document, pages written to temp files and read back), `pdfium` renders in-process with PDFium (pypdfium2)
+# straight into PIL buffers, `auto` - pdfium when pypdfium2 is installed, poppler otherwise. A document PDFium
+# fails to render is rendered with poppler. The backends render slightly differently and the OCR cache key
+# doesn't include the backend - switching it keeps serving the results cached with the previous one.
+#
+# Both return a list of PIL images - RGB or, with the `gray` colorspace, 8-bit grayscale (mode L).
+# DPI and colorspace are set per strategy: <STRATEGY>_RASTER_DPI and <STRATEGY>_RASTER_COLORSPACE (see `settings`).
+
+COLORSPACES = ('rgb', 'gray')
+
+
+def settings(strategy, default_dpi=200, default_colorspace='rgb'):
+    """(dpi, colorspace) of the strategy - eg. TESSERACT_RASTER_DPI=300, LLAMA_VISION_RASTER_COLORSPACE=gray."""
+    prefix = strategy.upper()
+    dpi = int(os.getenv(f'{prefix}_RASTER_DPI', str(default_dpi)))
+    colorspace = os.getenv(f'{prefix}_RASTER_COLORSPACE', default_colorspace)
+    if colorspace not in COLORSPACES:
+        raise ValueError(f"Unknown {prefix}_RASTER_COLORSPACE '{colorspace}'. Available: {', '.join(COLORSPACES)}")
+    return dpi, colorspace
+
+
+def backend_name():
+    backend = os.getenv('RASTERIZER', 'poppler')
+    if backend == 'auto':
+        return 'pdfium' if pdfium is not None else 'poppler'
+    if backend not in ('pdfium', 'poppler'):
+        raise ValueError(f"Unknown RASTERIZER '{backend}'. Available: auto, pdfium, poppler")
+    if backend == 'pdfium' and pdfium is None:
+        print("pypdfium2 is not installed - rendering with poppler")
+        return 'poppler'
+    return backend
+
+
+def render_pdfium(pdf_bytes, dpi, colorspace):
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        images = []
+        for page in pdf:
+            try:
+                # rev_byteorder - RGB instead of PDFium's native BGR, so no channel conversion is needed
+                bitmap = page.render(scale=dpi / 72, grayscale=colorspace == 'gray', rev_byteorder=True)
+                # copy - the PIL image would otherwise share the buffer PDFium frees with the bitmap
+                images.append(bitmap.to_pil().copy())
+            finally:
+                page.close()
+        return images
+    finally:
+        pdf.close()
+
+
+def render_poppler(pdf_bytes, dpi, colorspace):
+    return convert_from_bytes(pdf_bytes, dpi=dpi, grayscale=colorspace == 'gray')
+
+
+def rasterize(pdf_bytes, dpi=200, colorspace='rgb'):
+    """Render all pages of the PDF - returns (backend used, list of PIL images)."""
+    backend = backend_name()
+    if backend == 'pdfium':
+        try:
+            return backend, render_pdfium(pdf_bytes, dpi, colorspace)
+        except pdfium.PdfiumError as e:
+            print(f"PDFium failed to render the document ({e}) - rendering with poppler")
+            backend = 'poppler'
+    return backend, render_poppler(pdf_bytes, dpi, colorspace)
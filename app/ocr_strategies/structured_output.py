@@ -0,0 +1,71 @@
+import json
+
+# Columns kept for every recognized word, in the order they are stored per page.
+# Every column is a plain JSON array of the same length as `words`.
+WORD_COLUMNS = ['words', 'left', 'top', 'width', 'height', 'conf', 'block', 'par', 'line']
+
+
+def page_from_tesseract_data(page_no, image_size, data):
+    """
+    Build a compact columnar page record out of `pytesseract.image_to_data(..., output_type=Output.DICT)`.
+    Only word level (level 5) entries with non-empty text are kept.
+    """
+    page = {'page': page_no, 'size': [int(image_size[0]), int(image_size[1])]}
+    for column in WORD_COLUMNS:
+        page[column] = []
+
+    for i, word in enumerate(data['text']):
+        word = (word or '').strip()
+        if int(data['level'][i]) != 5 or not word:
+            continue
+        page['words'].append(word)
+        page['left'].append(int(data['left'][i]))
+        page['top'].append(int(data['top'][i]))
+        page['width'].append(int(data['width'][i]))
+        page['height'].append(int(data['height'][i]))
+        page['conf'].append(round(float(data['conf'][i]), 2))
+        page['block'].append(int(data['block_num'][i]))
+        page['par'].append(int(data['par_num'][i]))
+        page['line'].append(int(data['line_num'][i]))
+
+    page['text'] = page_text(page)
+    return page
+
+
+def page_text(page):
+    """
+    Rebuild the reading-order text of a page out of its word columns - words on the same line are
+    joined with spaces, lines with newlines and paragraphs/blocks are separated by a blank line.
+    """
+    text = ''
+    previous = None
+    for word, block, par, line in zip(page['words'], page['block'], page['par'], page['line']):
+        if previous is not None:
+            if (block, par) != previous[:2]:
+                text += '\n\n'
+            elif line != previous[2]:
+                text += '\n'
+            else:
+                text += ' '
+        text += word
+        previous = (block, par, line)
+    return text
+
+
+def dumps(structured):
+    """Serialize the structured result as compact JSON (no whitespace between separators)."""
+    return json.dumps(structured, separators=(',', ':'), ensure_ascii=False)
+
+
+def loads(structured_json):
+    return json.loads(structured_json)
+
+
+def to_text(structured):
+    """
+    Convert a structured result (dict or its JSON string) back to the plain text format
+    returned by `extract_text_from_pdf` - with the `--- Page N ---` separators.
+    """
+    if isinstance(structured, str):
+        structured = json.loads(structured)
+    return ''.join(f"--- Page {page['page']} ---\n{page['text']}\n" for page in structured['pages'])
@@ -1,18 +1,59 @@
-import pytesseract
-import cv2
+import os
 import numpy as np
 from ocr_strategies.ocr_strategy import OCRStrategy
-from pdf2image import convert_from_bytes
+from ocr_strategies import structured_output
+from ocr_strategies.preprocessing import preprocess
+from ocr_strategies.tesseract_engines import get_engine
+from stages import stage
+import page_index
+from ocr_strategies import rasterizers
+
+# DPI and colorspace the pages are rendered with (TESSERACT_RASTER_DPI / TESSERACT_RASTER_COLORSPACE) -
+# preprocessing steps resample relative to the DPI
+RENDER_DPI, RENDER_COLORSPACE = rasterizers.settings('tesseract', default_dpi=200)
 
 class TesseractOCRStrategy(OCRStrategy):
     """Tesseract OCR Strategy"""
+    supports_structured_output = True
+
+    def _pipeline(self):
+        return self.options.get('preprocessing') or os.getenv('TESSERACT_PREPROCESSING', 'default')
+
+    def _prepare_pages(self, pdf_bytes):
+        pipeline = self._pipeline()
+        with stage('rasterize', strategy='tesseract', bytes=len(pdf_bytes), dpi=RENDER_DPI) as attributes:
+            attributes['backend'], images = rasterizers.rasterize(pdf_bytes, RENDER_DPI, RENDER_COLORSPACE)
+            attributes['pages'] = len(images)
+        for i, image in enumerate(images):
+            with stage('preprocess', strategy='tesseract', page=i + 1, preset=pipeline):
+                page_image, dpi = preprocess(np.array(image), pipeline, RENDER_DPI)
+            yield page_image, dpi
+
     def extract_text_from_pdf(self, pdf_bytes):
-        images = convert_from_bytes(pdf_bytes)
         extracted_text = ""
+        first_page = self.options.get('first_page', 1)  # set when OCRing a page range of a split document
+        engine = get_engine()
+        space = page_index.namespace('tesseract', self._pipeline())
 
-        for i, image in enumerate(images):
-            rgb_image = cv2.cvtColor(np.array(image), cv2.COLOR_BGR2RGB)
-            page_text = pytesseract.image_to_string(rgb_image)
-            extracted_text += f"--- Page {i + 1} ---\n{page_text}\n"
+        for i, (page_image, dpi) in enumerate(self._prepare_pages(pdf_bytes)):
+            with stage('ocr_page', strategy='tesseract', page=i + first_page, engine=engine.name) as attributes:
+                if self.options.get('page_index'):
+                    # a page looking the same as one OCRed before reuses its text (see page_index.py)
+                    page_text, attributes['page_index_hit'] = page_index.cached_page(space, page_image, lambda: engine.image_to_string(page_image, dpi))
+                else:
+                    page_text = engine.image_to_string(page_image, dpi)
+            extracted_text += f"--- Page {i + first_page} ---\n{page_text}\n"
 
         return extracted_text
+
+    def extract_structured_from_pdf(self, pdf_bytes):
+        pages = []
+        first_page = self.options.get('first_page', 1)
+        engine = get_engine()
+
+        for i, (page_image, dpi) in enumerate(self._prepare_pages(pdf_bytes)):
+            with stage('ocr_page', strategy='tesseract', page=i + first_page, engine=engine.name):
+                data = engine.image_to_data(page_image, dpi)
+            pages.append(structured_output.page_from_tesseract_data(i + first_page, (page_image.shape[1], page_image.shape[0]), data))
+
+        return {"pages": pages}
@@ -0,0 +1,120 @@
+import os
+import threading
+
+import numpy as np
+import pytesseract
+from pytesseract import Output
+
+try:
+    import tesserocr
+except ImportError:  # the pytesseract engine is used instead
+    tesserocr = None
+
+# Engines running Tesseract for `TesseractOCRStrategy`, chosen with TESSERACT_ENGINE:
+#
+#   - `pytesseract` (default) - writes every page image to a temp file and runs the `tesseract` binary, which
+#     loads the language data again for each page,
+#   - `tesserocr` (opt-in - `pip install tesserocr`) - a libtesseract API handle kept resident in the worker
+#     process, the page buffers are passed to it directly - no temp files, no process start, no reloading,
+#   - `auto` - tesserocr when the package is installed, pytesseract otherwise.
+#
+# Both return the same plain text. The tesserocr `image_to_data` dict has the word rows (level 5) only - the
+# ones structured_output.py uses - while pytesseract also emits the page, block, paragraph and line rows.
+
+DATA_COLUMNS = ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num', 'left', 'top', 'width', 'height', 'conf', 'text')
+
+
+class PytesseractEngine:
+    name = 'pytesseract'
+
+    def image_to_string(self, image, dpi):
+        return pytesseract.image_to_string(image, config=f"--dpi {dpi}")
+
+    def image_to_data(self, image, dpi):
+        return pytesseract.image_to_data(image, config=f"--dpi {dpi}", output_type=Output.DICT)
+
+
+class TesserocrEngine:
+    name = 'tesserocr'
+
+    def __init__(self, lang='eng'):
+        self.lang = lang
+        # the handle isn't thread safe - one per thread, each created once and kept for the life of the process
+        self.local = threading.local()
+
+    def api(self):
+        if getattr(self.local, 'api', None) is None:
+            self.local.api = tesserocr.PyTessBaseAPI(lang=self.lang)
+        return self.local.api
+
+    def _set_image(self, image, dpi):
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+        api = self.api()
+        api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+        api.SetSourceResolution(int(dpi))
+        return api
+
+    def image_to_string(self, image, dpi):
+        api = self._set_image(image, dpi)
+        try:
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+
+    def image_to_data(self, image, dpi):
+        """Word level entries in the `pytesseract.image_to_data(..., output_type=Output.DICT)` layout."""
+        api = self._set_image(image, dpi)
+        data = {column: [] for column in DATA_COLUMNS}
+        try:
+            api.Recognize()
+            iterator = api.GetIterator()
+            if iterator is None:  # nothing recognized
+                return data
+            block = par = line = word = 0
+            level = tesserocr.RIL.WORD
+            while True:
+                if iterator.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                    block, par, line, word = block + 1, 0, 0, 0
+                if iterator.IsAtBeginningOf(tesserocr.RIL.PARA):
+                    par, line, word = par + 1, 0, 0
+                if iterator.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line, word = line + 1, 0
+                word += 1
+                box = iterator.BoundingBox(level)
+                if box is not None:
+                    left, top, right, bottom = box
+                    for column, value in zip(DATA_COLUMNS, (5, 1, block, par, line, word, left, top, right - left, bottom - top,
+                                                            iterator.Confidence(level), iterator.GetUTF8Text(level) or '')):
+                        data[column].append(value)
+                if not iterator.Next(level):
+                    break
+        finally:
+            api.Clear()
+        return data
+
+
+_engines = {}
+
+
+def get_engine(name=None):
+    """The engine selected by TESSERACT_ENGINE (or `name`) - created once per process, falls back to pytesseract."""
+    name = name or os.getenv('TESSERACT_ENGINE', 'pytesseract')
+    if name not in ('auto', 'tesserocr', 'pytesseract'):
+        raise ValueError(f"Unknown TESSERACT_ENGINE '{name}'. Available: auto, tesserocr, pytesseract")
+    if name not in _engines:
+        engine = PytesseractEngine()
+        if name != 'pytesseract':
+            if tesserocr is None:
+                if name == 'tesserocr':
+                    print("tesserocr is not installed - using pytesseract")
+            else:
+                try:
+                    engine = TesserocrEngine()
+                    engine.api()  # fail early (eg. missing language data) to fall back
+                except RuntimeError as e:
+                    print(f"Can't initialize tesserocr ({e}) - using pytesseract")
+                    engine = PytesseractEngine()
+        _engines[name] = engine
+    return _engines[name]
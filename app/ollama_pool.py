@@ -0,0 +1,274 @@
+import asyncio
+import os
+import threading
+import time
+
+import httpx
+import ollama
+
+import model_residency
+from stages import stage
+
+# Pool of Ollama hosts used by the llama_vision strategy, the LLM step of the OCR task and the /llm/* endpoints.
+# OLLAMA_HOSTS is a comma separated list of the hosts (OLLAMA_HOST - a single host - when not set). Every request
+# goes to the healthy host with the fewest outstanding requests (ties - the lower recent latency). A host failing
+# a request (connection error, timeout, dropped stream, 5xx) is taken out for OLLAMA_POOL_COOLDOWN seconds and the
+# request - eg. the whole page being OCRed - is retried on another host, up to OLLAMA_POOL_RETRIES times. A host
+# missing the model (404) is skipped for that request only. A background thread checks the hosts every
+# OLLAMA_HEALTH_INTERVAL seconds and brings recovered ones back. `stats()` (GET /llm/hosts) reports the
+# per-host load, latency and throughput of the process; every attempt is also an `ollama_request` stage.
+# Requests naming their model are also routed by the models resident on the hosts - see model_residency.py.
+
+OLLAMA_POOL_COOLDOWN = float(os.getenv('OLLAMA_POOL_COOLDOWN', '30'))
+OLLAMA_POOL_RETRIES = int(os.getenv('OLLAMA_POOL_RETRIES', '2'))
+OLLAMA_HEALTH_INTERVAL = float(os.getenv('OLLAMA_HEALTH_INTERVAL', '10'))
+
+# weight of the last request in the latency moving average
+LATENCY_SMOOTHING = 0.3
+
+
+def host_urls():
+    hosts = os.getenv('OLLAMA_HOSTS') or os.getenv('OLLAMA_HOST') or 'http://localhost:11434'
+    urls = []
+    for host in hosts.split(','):
+        host = host.strip().rstrip('/')
+        if host:
+            urls.append(host if '://' in host else f"http://{host}")
+    return urls
+
+
+class OllamaHost:
+    def __init__(self, url):
+        self.url = url
+        self.client = ollama.Client(host=url)
+        self._async_client = None
+        self.outstanding = 0
+        self.healthy = True
+        self.down_until = 0
+        self.requests = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self.latency = None
+        self.eval_count = 0
+        self.eval_seconds = 0.0
+        self.resident = set()  # models loaded on the host (normalized names)
+        self.cold_loads = 0
+        self.cold_load_seconds = 0.0
+
+    def async_client(self):
+        if self._async_client is None:  # created on first use - in the event loop of the API
+            self._async_client = ollama.AsyncClient(host=self.url)
+        return self._async_client
+
+    def available(self, now):
+        # a host down for longer than the cooldown gets a request again (the health check may not have run yet)
+        return self.healthy or now >= self.down_until
+
+    def mark_down(self):
+        self.healthy = False
+        self.down_until = time.time() + OLLAMA_POOL_COOLDOWN
+
+    def mark_up(self):
+        self.healthy = True
+        self.down_until = 0
+
+
+def classify_error(error):
+    """(retry on another host, mark the host down) for an exception raised by a request."""
+    if isinstance(error, (httpx.TransportError, ConnectionError)):
+        return True, True
+    if isinstance(error, ollama.ResponseError):
+        if error.status_code >= 500:
+            return True, True
+        if error.status_code == 404:  # eg. the model isn't pulled on this host
+            return True, False
+    return False, False
+
+
+class OllamaPool:
+    def __init__(self, urls):
+        self.hosts = [OllamaHost(url) for url in urls]
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self._health_thread = None
+
+    def _acquire(self, tried, model=None):
+        with self.lock:
+            now = time.time()
+            candidates = [host for host in self.hosts if host not in tried]
+            if not candidates:
+                return None
+            healthy = [host for host in candidates if host.available(now)]
+
+            def load(host):
+                # a host that would have to load the model counts as OLLAMA_MODEL_SWITCH_PENALTY requests busier
+                cold = model is not None and model_residency.normalize(model) not in host.resident
+                return host.outstanding + (model_residency.OLLAMA_MODEL_SWITCH_PENALTY if cold else 0), host.latency or 0
+
+            host = min(healthy or candidates, key=load)
+            host.outstanding += 1
+            return host
+
+    def record_load(self, host, model, result):
+        """Note the model resident on the host - returns the cold load event of the response (or None)."""
+        event = model_residency.cold_load(result, host.url, model)
+        with self.lock:
+            host.resident.add(model_residency.normalize(model))
+            if event:
+                host.cold_loads += 1
+                host.cold_load_seconds += event['seconds']
+        return event
+
+    def _release(self, host, seconds, result=None, error=None):
+        with self.lock:
+            host.outstanding -= 1
+            host.requests += 1
+            if error is not None:
+                _, mark_down = classify_error(error)
+                host.failures += 1
+                if mark_down:
+                    host.mark_down()
+                return
+            host.mark_up()
+            host.seconds += seconds
+            host.latency = seconds if host.latency is None else LATENCY_SMOOTHING * seconds + (1 - LATENCY_SMOOTHING) * host.latency
+            if hasattr(result, 'get') and result.get('eval_count') and result.get('eval_duration'):
+                host.eval_count += result['eval_count']
+                host.eval_seconds += result['eval_duration'] / 1e9
+
+    def _retry_or_raise(self, host, error, tried):
+        retry, _ = classify_error(error)
+        if not retry or len(tried) > OLLAMA_POOL_RETRIES or len(tried) >= len(self.hosts):
+            raise error
+        print(f"Ollama host {host.url} failed ({error}) - retrying on another host")
+
+    def _loaded(self, host, model, result, attributes):
+        if model is None or not hasattr(result, 'get'):
+            return
+        event = self.record_load(host, model, result)
+        if event:
+            print(f"Cold load of {model} on {host.url}: {event['seconds']}s")
+            attributes['cold_load_seconds'] = event['seconds']
+            if isinstance(result, dict):
+                result['cold_load'] = event
+
+    def call(self, fn, operation='request', model=None):
+        """
+        Run `fn(client)` with the `ollama.Client` of the least loaded healthy host and return its result - retried
+        on another host when the host fails. `fn` has to consume streamed responses itself, so a retry starts over.
+        A dict result with `eval_count` / `eval_duration` is counted in the host throughput. With the `model` the
+        request is routed by the resident models and a dict result with a `load_duration` of a cold
+        load gets the event as `cold_load`.
+        """
+        self.start_health_checks()
+        tried = []
+        while True:
+            host = self._acquire(tried, model)
+            tried.append(host)
+            start = time.perf_counter()
+            error = None
+            with stage('ollama_request', host=host.url, operation=operation, model=model or '') as attributes:
+                try:
+                    result = fn(host.client)
+                    attributes['outcome'] = 'ok'
+                    self._loaded(host, model, result, attributes)
+                except Exception as e:
+                    error = e
+                    attributes['outcome'] = 'failed'
+            self._release(host, time.perf_counter() - start, None if error else result, error)
+            if error is None:
+                return result
+            self._retry_or_raise(host, error, tried)
+
+    async def acall(self, fn, operation='request', model=None):
+        """
+        `call` for the API - `fn(client)` is a coroutine function getting the host's `ollama.AsyncClient`.
+        """
+        self.start_health_checks()
+        tried = []
+        while True:
+            host = self._acquire(tried, model)
+            tried.append(host)
+            start = time.perf_counter()
+            error = None
+            with stage('ollama_request', host=host.url, operation=operation, model=model or '') as attributes:
+                try:
+                    result = await fn(host.async_client())
+                    attributes['outcome'] = 'ok'
+                    self._loaded(host, model, result, attributes)
+                except Exception as e:
+                    error = e
+                    attributes['outcome'] = 'failed'
+            self._release(host, time.perf_counter() - start, None if error else result, error)
+            if error is None:
+                return result
+            self._retry_or_raise(host, error, tried)
+
+    async def abroadcast(self, fn):
+        """Run the coroutine function `fn(client)` on all the hosts (eg. pull a model) - {url: result or exception}."""
+        results = await asyncio.gather(*(fn(host.async_client()) for host in self.hosts), return_exceptions=True)
+        return {host.url: result for host, result in zip(self.hosts, results)}
+
+    def check_health(self):
+        for host in self.hosts:
+            try:
+                response = httpx.get(host.url + '/api/ps', timeout=2)  # also lists the loaded models
+                response.raise_for_status()
+                resident = {model.get('name') or model.get('model') for model in response.json().get('models', [])}
+            except (httpx.HTTPError, ValueError):
+                with self.lock:
+                    if host.healthy:
+                        print(f"Ollama host {host.url} is down")
+                    host.mark_down()
+                continue
+            with self.lock:
+                if not host.healthy:
+                    print(f"Ollama host {host.url} is back")
+                host.mark_up()
+                host.resident = {model_residency.normalize(model) for model in resident if model}
+
+    def start_health_checks(self):
+        if self._health_thread is not None or OLLAMA_HEALTH_INTERVAL <= 0 or len(self.hosts) < 2:
+            return
+        with self.lock:
+            if self._health_thread is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(OLLAMA_HEALTH_INTERVAL)
+                    self.check_health()
+
+            self._health_thread = threading.Thread(target=run, daemon=True, name='ollama-health')
+            self._health_thread.start()
+
+    def stats(self):
+        uptime = max(1e-9, time.time() - self.started_at)
+        with self.lock:
+            return [{
+                'host': host.url,
+                'healthy': host.healthy,
+                'outstanding': host.outstanding,
+                'requests': host.requests,
+                'failures': host.failures,
+                'mean_seconds': round(host.seconds / (host.requests - host.failures), 3) if host.requests > host.failures else None,
+                'recent_latency_seconds': round(host.latency, 3) if host.latency is not None else None,
+                'requests_per_minute': round(60 * (host.requests - host.failures) / uptime, 2),
+                'tokens_per_second': round(host.eval_count / host.eval_seconds, 1) if host.eval_seconds else None,
+                'resident_models': sorted(host.resident),
+                'cold_loads': host.cold_loads,
+                'cold_load_seconds': round(host.cold_load_seconds, 2)
+            } for host in self.hosts]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The pool of the hosts in OLLAMA_HOSTS - one per process."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OllamaPool(host_urls())
+        return _pool
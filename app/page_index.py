@@ -0,0 +1,263 @@
+import os
+import time
+import uuid
+import zlib
+
+import numpy as np
+import redis
+
+import compression
+from redis_cache import redis_client
+
+# Page fingerprint index - reuses the OCR text of pages that look the same as a page OCRed before, even when the
+# PDFs differ byte-wise (re-generated invoices sharing terms & conditions, cover sheets ...). Every rendered page
+# gets a fingerprint computed with NumPy:
+#
+#   - `phash` - 64 bit perceptual hash, signs of the low frequency DCT coefficients of the 32x32 downsampled page,
+#   - `dhash` - 64 bit difference hash, horizontal gradients of the 9x8 downsampled page,
+#   - `thumbnail` - the page downsampled to PAGE_INDEX_THUMBNAIL^2 gray levels, kept to verify the matches,
+#   - `mask` - the ink of the page (dark pixels) at PAGE_INDEX_MASK_WIDTH pixels wide, kept to verify the details.
+#
+# Candidates are found through locality sensitive buckets - the phash split into PAGE_INDEX_BANDS bands, a page
+# with the same value in any band is a candidate (all pages within PAGE_INDEX_BANDS - 1 bits are always found).
+# A candidate is reused only when both hashes are within PAGE_INDEX_MAX_DISTANCE bits AND - the false-match
+# safeguard - the aspect ratio matches, no thumbnail cell differs by more than PAGE_INDEX_MAX_CELL_DIFF gray
+# levels and at most PAGE_INDEX_MAX_PIXEL_DIFF ink pixels of either mask are further than a pixel from the ink
+# of the other. The thumbnail alone lets a changed digit through (a cell covers ~20x20 pixels of a 300 DPI page),
+# the mask comparison catches another amount, date or name down to a few pixels - changes smaller than that (a
+# comma turned into a period at a low mask resolution) can still be matched, so keep PAGE_INDEX_MAX_PIXEL_DIFF low.
+#
+# The index is scoped by namespace (strategy + preprocessing) - a page is only reused by the same strategy.
+# Enabled with PAGE_INDEX=1 for the requests with `ocr_cache` on; `/ocr/page_index_stats` reports the hit rate.
+
+KEY_PREFIX = 'page_index:'
+STATS_KEY = 'page_index:stats'
+
+PAGE_INDEX = os.getenv('PAGE_INDEX', '0').lower() in ('1', 'true', 'yes')
+PAGE_INDEX_MAX_DISTANCE = int(os.getenv('PAGE_INDEX_MAX_DISTANCE', '6'))
+PAGE_INDEX_BANDS = int(os.getenv('PAGE_INDEX_BANDS', '4'))
+PAGE_INDEX_THUMBNAIL = int(os.getenv('PAGE_INDEX_THUMBNAIL', '128'))
+PAGE_INDEX_MAX_CELL_DIFF = int(os.getenv('PAGE_INDEX_MAX_CELL_DIFF', '16'))
+PAGE_INDEX_MASK_WIDTH = int(os.getenv('PAGE_INDEX_MASK_WIDTH', '1280'))
+PAGE_INDEX_MAX_PIXEL_DIFF = int(os.getenv('PAGE_INDEX_MAX_PIXEL_DIFF', '4'))
+PAGE_INDEX_MAX_CANDIDATES = int(os.getenv('PAGE_INDEX_MAX_CANDIDATES', '64'))
+PAGE_INDEX_TTL = int(os.getenv('PAGE_INDEX_TTL', str(30 * 24 * 3600)))
+
+# pages with less ink are not indexed - blank pages match each other no matter what the engine made of them
+MIN_INK_RATIO = 0.002
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+DCT_32 = _dct_matrix(32)
+
+
+def namespace(strategy, preprocessing=None):
+    return f"{strategy}:{preprocessing}" if preprocessing else strategy
+
+
+def downsample(gray, height, width):
+    """Area average of the 2D array to height x width cells."""
+    rows = np.linspace(0, gray.shape[0], height + 1).astype(int)
+    cols = np.linspace(0, gray.shape[1], width + 1).astype(int)
+    sums = np.add.reduceat(np.add.reduceat(gray.astype(np.float64), rows[:-1], axis=0), cols[:-1], axis=1)
+    return sums / np.outer(np.diff(rows), np.diff(cols))
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.astype(np.uint8).flatten()).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def ink_mask(gray):
+    """Dark pixels of the page at PAGE_INDEX_MASK_WIDTH pixels wide (never upscaled)."""
+    width = min(PAGE_INDEX_MASK_WIDTH, gray.shape[1])
+    height = max(1, round(gray.shape[0] * width / gray.shape[1]))
+    return downsample(gray, height, width) < 128
+
+
+def _dilate(mask):
+    """The mask grown by one pixel in every direction (3x3)."""
+    padded = np.pad(mask, 1)
+    grown = np.zeros_like(mask)
+    for dy in range(3):
+        for dx in range(3):
+            grown |= padded[dy:dy + mask.shape[0], dx:dx + mask.shape[1]]
+    return grown
+
+
+def mask_difference(a, b):
+    """Ink pixels of either mask further than a pixel from the ink of the other - anti-aliasing and one pixel shifts don't count."""
+    return int((a & ~_dilate(b)).sum() + (b & ~_dilate(a)).sum())
+
+
+def fingerprint(image):
+    """Fingerprint of a rendered page (PIL image or NumPy array) - None for (almost) blank pages."""
+    gray = np.asarray(image.convert('L')) if hasattr(image, 'convert') else np.asarray(image)
+    if gray.ndim == 3:
+        gray = gray.mean(axis=2)
+    if (gray < 128).mean() < MIN_INK_RATIO:
+        return None
+    dct = DCT_32 @ downsample(gray, 32, 32) @ DCT_32.T
+    low = dct[:8, :8].flatten()
+    small = downsample(gray, 8, 9)
+    return {
+        'phash': _bits_to_int(low > np.median(low[1:])),
+        'dhash': _bits_to_int(small[:, 1:] > small[:, :-1]),
+        'thumbnail': np.clip(np.rint(downsample(gray, PAGE_INDEX_THUMBNAIL, PAGE_INDEX_THUMBNAIL)), 0, 255).astype(np.uint8),
+        'mask': ink_mask(gray),
+        'aspect': round(gray.shape[1] / gray.shape[0], 3)
+    }
+
+
+def bands(phash):
+    bits = 64 // PAGE_INDEX_BANDS
+    return [(phash >> (i * bits)) & ((1 << bits) - 1) for i in range(PAGE_INDEX_BANDS)]
+
+
+def band_key(space, band_no, value):
+    return f"{KEY_PREFIX}band:{space}:{band_no}:{value:x}"
+
+
+def entry_key(space, entry_id):
+    return f"{KEY_PREFIX}entry:{space}:{entry_id}"
+
+
+def verify(fp, entry):
+    """
+    The false-match safeguard - same aspect ratio, no thumbnail cell off by more than PAGE_INDEX_MAX_CELL_DIFF and
+    at most PAGE_INDEX_MAX_PIXEL_DIFF differing ink mask pixels.
+    """
+    if abs(float(entry[b'aspect']) - fp['aspect']) > 0.01:
+        return False
+    thumbnail = np.frombuffer(zlib.decompress(entry[b'thumbnail']), dtype=np.uint8)
+    if thumbnail.size != fp['thumbnail'].size:
+        return False  # indexed with another PAGE_INDEX_THUMBNAIL
+    if int(np.abs(thumbnail.astype(np.int16) - fp['thumbnail'].flatten().astype(np.int16)).max()) > PAGE_INDEX_MAX_CELL_DIFF:
+        return False
+    if b'mask' not in entry or entry[b'mask_shape'].decode() != '%d,%d' % fp['mask'].shape:
+        return False  # indexed without a mask, with another PAGE_INDEX_MASK_WIDTH or from a smaller render
+    mask = np.unpackbits(np.frombuffer(zlib.decompress(entry[b'mask']), dtype=np.uint8))[:fp['mask'].size]
+    return mask_difference(mask.reshape(fp['mask'].shape).astype(bool), fp['mask']) <= PAGE_INDEX_MAX_PIXEL_DIFF
+
+
+def lookup(space, fp):
+    """
+    Text of an indexed page matching the fingerprint, or None. Returns (text, details) - details are the
+    Hamming distance of the match and the number of candidates rejected by the safeguard.
+    """
+    client = redis_client()
+    candidates = set()
+    for band_no, value in enumerate(bands(fp['phash'])):
+        candidates.update(client.srandmember(band_key(space, band_no, value), PAGE_INDEX_MAX_CANDIDATES) or [])
+        if len(candidates) >= PAGE_INDEX_MAX_CANDIDATES:
+            break
+
+    rejected = 0
+    for entry_id in candidates:
+        entry_id = entry_id.decode()
+        entry = client.hgetall(entry_key(space, entry_id))
+        if not entry:
+            continue  # expired - its band members are dropped when the bands expire
+        distance = max(hamming(fp['phash'], int(entry[b'phash'])), hamming(fp['dhash'], int(entry[b'dhash'])))
+        if distance > PAGE_INDEX_MAX_DISTANCE:
+            continue
+        if not verify(fp, entry):
+            rejected += 1
+            continue
+        client.hincrby(entry_key(space, entry_id), 'hits', 1)
+        return compression.unpack_text(entry[b'text']), {'distance': distance, 'rejected': rejected, 'entry': entry_id}
+    return None, {'rejected': rejected}
+
+
+def store(space, fp, text):
+    client = redis_client()
+    entry_id = uuid.uuid4().hex[:16]
+    pipeline = client.pipeline()
+    pipeline.hset(entry_key(space, entry_id), mapping={
+        'phash': str(fp['phash']),
+        'dhash': str(fp['dhash']),
+        'aspect': str(fp['aspect']),
+        'thumbnail': zlib.compress(fp['thumbnail'].tobytes()),
+        'mask': zlib.compress(np.packbits(fp['mask']).tobytes()),
+        'mask_shape': '%d,%d' % fp['mask'].shape,
+        'text': compression.pack_text(text),
+        'hits': 0,
+        'created_at': time.time()
+    })
+    pipeline.expire(entry_key(space, entry_id), PAGE_INDEX_TTL)
+    for band_no, value in enumerate(bands(fp['phash'])):
+        pipeline.sadd(band_key(space, band_no, value), entry_id)
+        pipeline.expire(band_key(space, band_no, value), PAGE_INDEX_TTL)
+    pipeline.execute()
+
+
+def cached_page(space, image, ocr_page):
+    """
+    OCR text of the page - from the index when a matching page is found, otherwise `ocr_page()` (then indexed).
+    Index failures never fail the OCR. Returns (text, hit).
+    """
+    try:
+        fp = fingerprint(image)
+        if fp is not None:
+            text, details = lookup(space, fp)
+            record_stats(space, 'hits' if text is not None else 'misses', details)
+            if text is not None:
+                return text, True
+    except (redis.RedisError, ValueError, KeyError, zlib.error) as e:
+        print(f"Page index lookup failed: {e}")
+        fp = None
+
+    text = ocr_page()
+    if fp is not None:
+        try:
+            store(space, fp, text)
+        except redis.RedisError as e:
+            print(f"Page index store failed: {e}")
+    return text, False
+
+
+def record_stats(space, outcome, details):
+    pipeline = redis_client().pipeline()
+    pipeline.hincrby(STATS_KEY, f"{space}:{outcome}", 1)
+    if details.get('rejected'):
+        pipeline.hincrby(STATS_KEY, f"{space}:rejected_candidates", details['rejected'])
+    if 'distance' in details:
+        pipeline.hincrby(STATS_KEY, f"{space}:hit_distance_total", details['distance'])
+        if details['distance'] == 0:
+            pipeline.hincrby(STATS_KEY, f"{space}:exact_hits", 1)
+    pipeline.execute()
+
+
+def format_stats(counters):
+    """Hit rate per namespace out of the raw `STATS_KEY` hash."""
+    counters = {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in (counters or {}).items()}
+    stats = {
+        'enabled': PAGE_INDEX,
+        'max_distance': PAGE_INDEX_MAX_DISTANCE,
+        'max_cell_diff': PAGE_INDEX_MAX_CELL_DIFF,
+        'max_pixel_diff': PAGE_INDEX_MAX_PIXEL_DIFF,
+        'namespaces': {}
+    }
+    for name in sorted({k.rsplit(':', 1)[0] for k in counters}):
+        hits = counters.get(f"{name}:hits", 0)
+        misses = counters.get(f"{name}:misses", 0)
+        stats['namespaces'][name] = {
+            'lookups': hits + misses,
+            'hits': hits,
+            'exact_hits': counters.get(f"{name}:exact_hits", 0),
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+            'mean_hit_distance': round(counters.get(f"{name}:hit_distance_total", 0) / hits, 2) if hits else None,
+            # candidates within the hash distance that failed the aspect/thumbnail/mask check - prevented false matches
+            'rejected_candidates': counters.get(f"{name}:rejected_candidates", 0)
+        }
+    return stats
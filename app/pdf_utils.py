@@ -0,0 +1,47 @@
+import io
+import pypdfium2 as pdfium
+
+
+def count_pages(pdf_bytes):
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def split_pdf(pdf_bytes, chunk_pages):
+    """
+    Split the PDF into documents of at most `chunk_pages` pages.
+    Returns a list of (first page number - 1-based, chunk PDF bytes) in page order.
+    """
+    source = pdfium.PdfDocument(pdf_bytes)
+    try:
+        num_pages = len(source)
+        chunks = []
+        for start in range(0, num_pages, chunk_pages):
+            chunk = pdfium.PdfDocument.new()
+            try:
+                chunk.import_pages(source, list(range(start, min(num_pages, start + chunk_pages))))
+                buffer = io.BytesIO()
+                chunk.save(buffer)
+                chunks.append((start + 1, buffer.getvalue()))
+            finally:
+                chunk.close()
+        return chunks
+    finally:
+        source.close()
+
+
+def select_pages(pdf_bytes, pages):
+    """A PDF with only the given pages (0-based indices, in the given order) of the document."""
+    source = pdfium.PdfDocument(pdf_bytes)
+    selected = pdfium.PdfDocument.new()
+    try:
+        selected.import_pages(source, list(pages))
+        buffer = io.BytesIO()
+        selected.save(buffer)
+        return buffer.getvalue()
+    finally:
+        selected.close()
+        source.close()
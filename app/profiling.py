@@ -0,0 +1,205 @@
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from result_store import RESULT_EXPIRES, RESULT_SPOOL_PATH
+from stages import add_stage_hook, remove_stage_hook
+
+# Opt-in profiling of single OCR jobs - for the PDF making a worker run out of memory or run ten times slower
+# than usual. A job sent with `profile=true` (admins only - the PROFILE_ADMIN_HEADER header has to carry the
+# PROFILE_ADMIN_TOKEN; without the token profiling is off) runs every part of the task - `task`, the page ranges
+# (`pages-<first page>`) and the `merge` of a split document - under cProfile and tracemalloc. A stage hook
+# records the wall time, the memory growth and the tracemalloc peak of every stage (rasterize, ocr_page, llm,
+# storage ...). The report of a part - the top functions by cumulative time, the peak and the top allocations,
+# the stages - goes next to the spooled results (PROFILE_PATH) as `<task_id>.<part>.json` plus the raw
+# `<task_id>.<part>.prof` for snakeviz / pstats, served by `/ocr/result/{task_id}/profile` and removed with
+# the results after RESULT_EXPIRES. A profiled job never takes its result from the OCR cache.
+#
+# cProfile and the per-stage memory cover the thread running the task - the stages of other threads are timed only.
+
+PROFILE_ADMIN_TOKEN = os.getenv('PROFILE_ADMIN_TOKEN')
+PROFILE_ADMIN_HEADER = os.getenv('PROFILE_ADMIN_HEADER', 'X-Admin-Token')
+PROFILE_PATH = os.getenv('PROFILE_PATH', os.path.join(RESULT_SPOOL_PATH, 'profiles'))
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', '40'))
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', '10'))
+
+
+def is_admin(token):
+    return bool(PROFILE_ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, PROFILE_ADMIN_TOKEN)
+
+
+def report_path(task_id, part, extension='.json'):
+    return os.path.join(PROFILE_PATH, f"{os.path.basename(task_id)}.{part}{extension}")
+
+
+def _json_safe(attributes):
+    return {name: value for name, value in attributes.items() if isinstance(value, (str, int, float, bool)) or value is None}
+
+
+class StageRecorder:
+    """Stage hook recording the time and the tracemalloc memory of the stages of the profiled thread."""
+
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.stages = []
+        self.stack = []  # the open stages - every frame keeps the highest peak seen while it was open
+
+    def _note_peak(self):
+        # the peak since the last reset belongs to all the open stages, then a new interval starts
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in self.stack:
+            frame['peak_bytes'] = max(frame['peak_bytes'], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def hook(self, name, attributes):
+        start = time.perf_counter()
+        if threading.get_ident() != self.thread:
+            try:
+                yield
+            finally:
+                self.stages.append({'stage': name, 'attributes': _json_safe(attributes), 'seconds': round(time.perf_counter() - start, 4), 'thread': 'other'})
+            return
+
+        self._note_peak()
+        frame = {'stage': name, 'depth': len(self.stack) - 1, 'memory_start_bytes': tracemalloc.get_traced_memory()[0], 'peak_bytes': 0}
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            self._note_peak()
+            self.stack.remove(frame)
+            frame.update({
+                'attributes': _json_safe(attributes),
+                'seconds': round(time.perf_counter() - start, 4),
+                'memory_end_bytes': tracemalloc.get_traced_memory()[0]
+            })
+            frame['memory_growth_bytes'] = frame['memory_end_bytes'] - frame['memory_start_bytes']
+            self.stages.append(frame)
+
+
+def cpu_report(profiler):
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (file_name, line, function), (calls, primitive_calls, total, cumulative, callers) in stats.stats.items():
+        rows.append({
+            'function': function,
+            'file': file_name,
+            'line': line,
+            'calls': calls,
+            'total_seconds': round(total, 4),
+            'cumulative_seconds': round(cumulative, 4)
+        })
+    rows.sort(key=lambda row: row['cumulative_seconds'], reverse=True)
+    return {'total_seconds': round(stats.total_tt, 4), 'top_cumulative': rows[:PROFILE_TOP],
+            'top_total': sorted(rows, key=lambda row: row['total_seconds'], reverse=True)[:PROFILE_TOP]}
+
+
+def memory_report(snapshot, peak_bytes, current_bytes):
+    top = []
+    for statistic in snapshot.statistics('traceback')[:PROFILE_TOP]:
+        top.append({
+            'size_bytes': statistic.size,
+            'count': statistic.count,
+            'traceback': [f"{frame.filename}:{frame.lineno}" for frame in statistic.traceback]
+        })
+    return {'peak_bytes': peak_bytes, 'current_bytes': current_bytes, 'top_allocations': top}
+
+
+def write_report(task_id, part, report, profiler):
+    os.makedirs(PROFILE_PATH, exist_ok=True)
+    path = report_path(task_id, part)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(report, file)
+    os.replace(path + '.tmp', path)
+    profiler.dump_stats(report_path(task_id, part, '.prof'))
+    cleanup_expired()
+
+
+@contextmanager
+def profiled(task_id, part, enabled, **details):
+    """Profile the block when `enabled` - the report of the part is written when the block ends (or fails)."""
+    if not enabled:
+        yield
+        return
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+    tracemalloc.reset_peak()
+    recorder = StageRecorder()
+    recorder.stack.append({'stage': part, 'peak_bytes': 0})  # the whole part
+    add_stage_hook(recorder.hook)
+    profiler = cProfile.Profile()
+    started_at = time.time()
+    start = time.perf_counter()
+    outcome = 'ok'
+    profiler.enable()
+    try:
+        yield
+    except BaseException as e:  # Celery's replace (a split document) ends the part with an exception too
+        outcome = type(e).__name__
+        raise
+    finally:
+        profiler.disable()
+        seconds = time.perf_counter() - start
+        remove_stage_hook(recorder.hook)
+        recorder._note_peak()
+        current_bytes = tracemalloc.get_traced_memory()[0]
+        snapshot = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+        report = {
+            'task_id': task_id,
+            'part': part,
+            'outcome': outcome,
+            'started_at': started_at,
+            'seconds': round(seconds, 4),
+            **details,
+            'cpu': cpu_report(profiler),
+            'memory': memory_report(snapshot, recorder.stack[0]['peak_bytes'], current_bytes),
+            'stages': recorder.stages
+        }
+        try:
+            write_report(task_id, part, report, profiler)
+            print(f"Profile of {task_id} ({part}) written to {report_path(task_id, part)}")
+        except OSError as e:
+            print(f"Failed to write the profile of {task_id} ({part}): {e}")
+
+
+def load_reports(task_id):
+    """The reports of all the parts of the task, in the order they started."""
+    prefix = f"{os.path.basename(task_id)}."
+    reports = []
+    try:
+        entries = [entry for entry in os.scandir(PROFILE_PATH) if entry.name.startswith(prefix) and entry.name.endswith('.json')]
+    except FileNotFoundError:
+        return reports
+    for entry in entries:
+        try:
+            with open(entry.path, 'r') as file:
+                reports.append(json.load(file))
+        except (OSError, ValueError):
+            continue
+    return sorted(reports, key=lambda report: report['started_at'])
+
+
+def cleanup_expired():
+    now = time.time()
+    try:
+        entries = list(os.scandir(PROFILE_PATH))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > RESULT_EXPIRES:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
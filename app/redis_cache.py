@@ -0,0 +1,18 @@
+import os
+
+import redis
+
+# The Redis of the OCR cache and the job state (REDIS_CACHE_URL) - one client per process, shared by the tasks,
+# the page index and the admission control release. Created on first use, so importing
+# a module doesn't need the Redis configuration yet.
+
+REDIS_CACHE_URL = os.getenv('REDIS_CACHE_URL', 'redis://redis:6379/1')
+
+_redis_client = None
+
+
+def redis_client():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.StrictRedis.from_url(REDIS_CACHE_URL)
+    return _redis_client
@@ -0,0 +1,132 @@
+import json
+import os
+import re
+import time
+import zlib
+
+# Large task results are written to a spool directory shared by the workers and the API (RESULT_SPOOL_PATH)
+# instead of the Celery result backend - the backend only keeps a small reference, `/ocr/result/{task_id}`
+# points to `/ocr/result/{task_id}/download` which streams the file (gzip and Range requests supported).
+# Spool files are removed once they are older than RESULT_EXPIRES - the same expiry as the backend results.
+# The spool (like the profiles, the search index and the trace file) is kept outside the storage profile
+# root (/storage) - internal files must not show up in /storage/list or be deleted and reindexed through it.
+
+RESULT_SPOOL_PATH = os.getenv('RESULT_SPOOL_PATH', '/var/lib/pdf-extract-api/results')
+RESULT_SPOOL_MIN_BYTES = int(os.getenv('RESULT_SPOOL_MIN_BYTES', '262144'))  # 0 disables the spool
+RESULT_EXPIRES = int(os.getenv('RESULT_EXPIRES', '86400'))
+
+CONTENT_TYPES = {'.md': 'text/markdown; charset=utf-8', '.json': 'application/json'}
+CHUNK_BYTES = 256 * 1024
+
+# expired spool files are swept at most once per CLEANUP_INTERVAL seconds per process
+CLEANUP_INTERVAL = 3600
+_last_cleanup = 0
+
+
+def should_spool(text):
+    return RESULT_SPOOL_MIN_BYTES > 0 and len(text.encode('utf-8')) >= RESULT_SPOOL_MIN_BYTES
+
+
+def result_extension(text):
+    """
+    '.json' for a structured (`output_format=json`) result, '.md' otherwise - results kept in the backend don't
+    carry their format, a JSON document is recognized by its content.
+    """
+    stripped = text.lstrip()
+    if stripped[:1] in ('{', '['):
+        try:
+            json.loads(stripped)
+            return '.json'
+        except ValueError:
+            pass
+    return '.md'
+
+
+def is_reference(result):
+    return isinstance(result, dict) and 'result_ref' in result
+
+
+def spool_result(task_id, text, extension='.md'):
+    """Write the result to the spool and return the reference stored as the task result."""
+    os.makedirs(RESULT_SPOOL_PATH, exist_ok=True)
+    file_name = f"{task_id}{extension}"
+    path = os.path.join(RESULT_SPOOL_PATH, file_name)
+    data = text.encode('utf-8')
+    with open(path + '.tmp', 'wb') as file:
+        file.write(data)
+    os.replace(path + '.tmp', path)  # readers never see a partially written result
+
+    cleanup_expired()
+    return {'result_ref': file_name, 'bytes': len(data), 'content_type': CONTENT_TYPES.get(extension, 'text/plain; charset=utf-8')}
+
+
+def result_path(reference):
+    file_name = os.path.basename(reference['result_ref'])
+    return os.path.join(RESULT_SPOOL_PATH, file_name)
+
+
+def load_result(reference):
+    with open(result_path(reference), 'rb') as file:
+        return file.read().decode('utf-8')
+
+
+def cleanup_expired(force=False):
+    """Remove the spool files older than RESULT_EXPIRES."""
+    global _last_cleanup
+    now = time.time()
+    if not force and now - _last_cleanup < CLEANUP_INTERVAL:
+        return
+    _last_cleanup = now
+    try:
+        entries = list(os.scandir(RESULT_SPOOL_PATH))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > RESULT_EXPIRES:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def parse_range(range_header, size):
+    """
+    (start, end) - inclusive - of a single `bytes=` range, None when the header is missing or not a byte range.
+    Raises ValueError when the range can't be satisfied.
+    """
+    if not range_header:
+        return None
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', range_header)
+    if not match or (not match.group(1) and not match.group(2)):
+        return None  # unsupported (eg. multiple ranges) - the whole content is sent
+    if match.group(1):
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else:
+        # suffix range - the last N bytes
+        start = max(0, size - int(match.group(2)))
+        end = size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range not satisfiable for {size} bytes")
+    return start, end
+
+
+def iter_file(path, start, end):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 - gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,170 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+# Full-text search over the stored OCR results. `StorageManager.save` adds every written result to a SQLite FTS5
+# index on the local disk (SEARCH_INDEX_PATH, on the volume shared by the API and the workers) and `delete`
+# removes it, so `/storage/search` finds the files containing eg. an invoice number without loading them all.
+# Results stored before the index existed (or written around it) are added with:
+#
+#   python search_index.py reindex --storage_profile default
+#
+# Indexing never fails the save - errors are only logged. SEARCH_INDEX=0 disables it.
+
+SEARCH_INDEX = os.getenv('SEARCH_INDEX', '1').lower() in ('1', 'true', 'yes')
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', '/var/lib/pdf-extract-api/search_index.db')
+
+# extensions of the stored results picked up by `reindex`
+INDEXED_EXTENSIONS = ('.md', '.json', '.txt')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    storage_profile TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    indexed_at REAL NOT NULL,
+    UNIQUE (storage_profile, file_name)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(content, tokenize = 'unicode61');
+"""
+
+_local = threading.local()
+
+
+def connection():
+    """SQLite connection of the current thread - the API calls the index from its thread pool."""
+    if getattr(_local, 'connection', None) is None:
+        os.makedirs(os.path.dirname(os.path.abspath(SEARCH_INDEX_PATH)), exist_ok=True)
+        db = sqlite3.connect(SEARCH_INDEX_PATH, timeout=30)
+        db.execute('PRAGMA journal_mode=WAL')  # searches don't block the writing workers
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.executescript(SCHEMA)
+        _local.connection = db
+    return _local.connection
+
+
+def index(storage_profile, file_name, content):
+    """Add or replace the stored file in the index."""
+    db = connection()
+    with db:
+        row = db.execute('SELECT id FROM documents WHERE storage_profile = ? AND file_name = ?', (storage_profile, file_name)).fetchone()
+        if row:
+            db.execute('DELETE FROM documents_fts WHERE rowid = ?', (row[0],))
+            db.execute('UPDATE documents SET bytes = ?, indexed_at = ? WHERE id = ?', (len(content.encode('utf-8')), time.time(), row[0]))
+            document_id = row[0]
+        else:
+            document_id = db.execute('INSERT INTO documents (storage_profile, file_name, bytes, indexed_at) VALUES (?, ?, ?, ?)',
+                                     (storage_profile, file_name, len(content.encode('utf-8')), time.time())).lastrowid
+        db.execute('INSERT INTO documents_fts (rowid, content) VALUES (?, ?)', (document_id, content))
+
+
+def remove(storage_profile, file_name):
+    db = connection()
+    with db:
+        row = db.execute('SELECT id FROM documents WHERE storage_profile = ? AND file_name = ?', (storage_profile, file_name)).fetchone()
+        if row:
+            db.execute('DELETE FROM documents_fts WHERE rowid = ?', (row[0],))
+            db.execute('DELETE FROM documents WHERE id = ?', (row[0],))
+
+
+def safe_index(storage_profile, file_name, content):
+    if not SEARCH_INDEX or file_name is None:
+        return
+    try:
+        index(storage_profile, file_name, content)
+    except (sqlite3.Error, OSError) as e:  # OSError - the index directory can't be created
+        print(f"Failed to index '{file_name}' for search: {e}")
+
+
+def safe_remove(storage_profile, file_name):
+    if not SEARCH_INDEX:
+        return
+    try:
+        remove(storage_profile, file_name)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Failed to remove '{file_name}' from the search index: {e}")
+
+
+def match_expression(query, raw=False):
+    """
+    FTS5 MATCH expression of the query - every whitespace separated term is searched as a phrase (so
+    `INV-2024-117` matches the number as written) and all of them have to be present. `raw` - FTS5 query syntax.
+    """
+    if raw:
+        return query
+    terms = query.split()
+    if not terms:
+        raise ValueError("Empty search query")
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def search(query, storage_profile=None, limit=20, raw=False):
+    """Best matches first: [{'storage_profile', 'file_name', 'snippet', 'score', 'bytes', 'indexed_at'}, ...]."""
+    sql = ("SELECT d.storage_profile, d.file_name, snippet(documents_fts, 0, '[', ']', '...', 16), bm25(documents_fts), d.bytes, d.indexed_at "
+           "FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid WHERE documents_fts MATCH ?")
+    params = [match_expression(query, raw)]
+    if storage_profile:
+        sql += ' AND d.storage_profile = ?'
+        params.append(storage_profile)
+    sql += ' ORDER BY bm25(documents_fts) LIMIT ?'
+    params.append(limit)
+    try:
+        rows = connection().execute(sql, params).fetchall()
+    except sqlite3.OperationalError as e:  # eg. a syntax error in a raw query
+        raise ValueError(f"Invalid search query: {e}") from e
+    return [{'storage_profile': profile, 'file_name': file_name, 'snippet': snippet, 'score': round(-score, 3), 'bytes': size, 'indexed_at': indexed_at}
+            for profile, file_name, snippet, score, size, indexed_at in rows]
+
+
+def reindex(storage_profile):
+    """Index all the stored results of the profile and drop the entries of files no longer stored."""
+    from storage_manager import StorageManager
+
+    storage_manager = StorageManager(storage_profile)
+    index_path = os.path.abspath(SEARCH_INDEX_PATH)
+    files = [file_name for file_name in storage_manager.list()
+             if file_name.lower().endswith(INDEXED_EXTENSIONS) and not os.path.abspath(file_name).startswith(index_path)]
+    indexed = 0
+    for file_name in files:
+        try:
+            content = storage_manager.load(file_name)
+        except (OSError, UnicodeDecodeError, RuntimeError) as e:
+            print(f"Skipping '{file_name}': {e}")
+            continue
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='replace')
+        index(storage_profile, storage_manager.strategy.stored_name(file_name), content)
+        indexed += 1
+
+    stored = {storage_manager.strategy.stored_name(file_name) for file_name in files}
+    stale = [file_name for (file_name,) in connection().execute('SELECT file_name FROM documents WHERE storage_profile = ?', (storage_profile,))
+             if file_name not in stored]
+    for file_name in stale:
+        remove(storage_profile, file_name)
+    return {'storage_profile': storage_profile, 'indexed': indexed, 'removed': len(stale)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search index of the stored OCR results.")
+    subparsers = parser.add_subparsers(dest='command', help='Sub-command help')
+    reindex_parser = subparsers.add_parser('reindex', help='Index the results already stored with the storage profiles')
+    reindex_parser.add_argument('--storage_profile', type=str, nargs='+', default=['default'], help='Storage profiles to reindex')
+    search_parser = subparsers.add_parser('search', help='Search the index directly (without the API)')
+    search_parser.add_argument('query', type=str, help='Text to search for')
+    search_parser.add_argument('--storage_profile', type=str, default=None, help='Only results of this storage profile')
+    search_parser.add_argument('--limit', type=int, default=20, help='Maximum number of results')
+    args = parser.parse_args()
+
+    if args.command == 'reindex':
+        for profile in args.storage_profile:
+            start = time.time()
+            stats = reindex(profile)
+            print(f"{profile}: indexed {stats['indexed']} files, removed {stats['removed']} stale entries in {time.time() - start:.1f}s")
+    elif args.command == 'search':
+        for result in search(args.query, args.storage_profile, args.limit):
+            print(f"{result['storage_profile']}:{result['file_name']} ({result['score']})\n    {result['snippet']}")
+    else:
+        parser.print_help()
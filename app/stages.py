@@ -0,0 +1,33 @@
+from contextlib import ExitStack, contextmanager
+
+# Processing stages (rasterization, per-page OCR, LLM, storage ...) are wrapped in `stage(...)` blocks.
+# Hooks registered with `add_stage_hook` are called with the stage name and its attributes when the
+# stage starts and must return a context manager wrapping the stage - a timer, a metrics histogram,
+# a tracing span and so on. With no hooks registered a stage costs next to nothing.
+_stage_hooks = []
+
+
+def add_stage_hook(hook):
+    if hook not in _stage_hooks:
+        _stage_hooks.append(hook)
+
+
+def remove_stage_hook(hook):
+    if hook in _stage_hooks:
+        _stage_hooks.remove(hook)
+
+
+@contextmanager
+def stage(name, **attributes):
+    """
+    Wrap a processing stage. Yields the attributes dict - values added to it inside the block
+    (eg. number of pages, output size) are visible to the hooks when the stage ends.
+    """
+    if not _stage_hooks:
+        yield attributes
+        return
+
+    with ExitStack() as stack:
+        for hook in list(_stage_hooks):
+            stack.enter_context(hook(name, attributes))
+        yield attributes
@@ -4,12 +4,14 @@ from storage_strategies.local_filesystem import LocalFilesystemStorageStrategy
 from storage_strategies.google_drive import GoogleDriveStorageStrategy
 from storage_strategies.aws_s3 import AWSS3StorageStrategy
 from pathlib import Path
+import search_index
 
 class StorageManager:
     def __init__(self, profile_name):
         profile_path = os.path.join(os.getenv('STORAGE_PROFILE_PATH', '/storage_profiles'), f'{profile_name}.yaml')
         with open(profile_path, 'r') as file:
             self.profile = yaml.safe_load(file)
+        self.profile_name = profile_name
 
         strategy = self.profile['strategy']
         if strategy == 'local_filesystem':
@@ -22,7 +24,10 @@ class StorageManager:
             raise ValueError(f"Unknown storage strategy '{strategy}'")
 
     def save(self, file_name, dest_file_name, content):
-        self.strategy.save(file_name, dest_file_name, content)
+        stored_name = self.strategy.save(file_name, dest_file_name, content)
+        # the name `load` takes - kept in the search index (see search_index.py)
+        search_index.safe_index(self.profile_name, stored_name, content)
+        return stored_name
 
     def load(self, file_name):
         return self.strategy.load(file_name)
@@ -32,3 +37,4 @@ class StorageManager:
 
     def delete(self, file_name):
         self.strategy.delete(file_name)
+        search_index.safe_remove(self.profile_name, self.strategy.stored_name(file_name))
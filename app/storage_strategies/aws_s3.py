@@ -1,6 +1,7 @@
 import boto3
 from botocore.exceptions import EndpointConnectionError, ClientError
 from storage_strategies.storage_strategy import StorageStrategy
+from storage_strategies.remote_cache import RemoteCache
 
 class AWSS3StorageStrategy(StorageStrategy):
     def __init__(self, context):
@@ -33,33 +34,54 @@ class AWSS3StorageStrategy(StorageStrategy):
                 ) from e
             raise
 
+        # loads are served from the local cache while the object's ETag is unchanged (see remote_cache.py)
+        self.cache = RemoteCache(f"s3:{self.region}:{self.bucket_name}")
+
     def save(self, file_name, dest_file_name, content):
         formatted_file_name = self.format_file_name(file_name, dest_file_name)
 
+        body = content.encode('utf-8')
         try:
-            self.s3_client.put_object(
+            response = self.s3_client.put_object(
                 Bucket=self.bucket_name,
                 Key=formatted_file_name,
-                Body=content.encode('utf-8')
+                Body=body
             )
         except ClientError as e:
             raise RuntimeError(
                 f"{str(e)}\n"
                 f"Error saving file '{file_name}' as '{formatted_file_name}' to bucket '{self.bucket_name}'."
             ) from e
+        self.cache.put(formatted_file_name, response.get('ETag'), body)
+        return formatted_file_name
 
     def load(self, file_name):
+        cached_etag = self.cache.version(file_name)
         try:
-            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=file_name)
-            return response['Body'].read().decode('utf-8')
+            if cached_etag:
+                # conditional GET - answers 304 without the body when the cached copy is current
+                response = self.s3_client.get_object(Bucket=self.bucket_name, Key=file_name, IfNoneMatch=cached_etag)
+            else:
+                response = self.s3_client.get_object(Bucket=self.bucket_name, Key=file_name)
         except ClientError as e:
             error_code = e.response['Error']['Code']
+            if error_code in ('304', 'NotModified'):
+                content = self.cache.get(file_name)
+                if content is not None:
+                    return content.decode('utf-8')
+                self.cache.discard(file_name)  # evicted in the meantime
+                return self.load(file_name)
             if error_code == 'NoSuchKey':
+                self.cache.discard(file_name)
                 return None
             raise RuntimeError(
                 f"{str(e)}\n"
                 f"Error loading file '{file_name}' from bucket '{self.bucket_name}'."
             ) from e
+        self.cache.miss()
+        body = response['Body'].read()
+        self.cache.put(file_name, response.get('ETag'), body)
+        return body.decode('utf-8')
 
     def list(self):
         try:
@@ -73,6 +95,7 @@ class AWSS3StorageStrategy(StorageStrategy):
 
     def delete(self, file_name):
         try:
+            self.cache.discard(file_name)
             self.s3_client.delete_object(Bucket=self.bucket_name, Key=file_name)
         except ClientError as e:
             raise RuntimeError(
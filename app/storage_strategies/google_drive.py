@@ -1,10 +1,15 @@
 import os
-import io
 import pickle
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload
 from google.oauth2.service_account import Credentials
 from storage_strategies.storage_strategy import StorageStrategy
+from storage_strategies.remote_cache import RemoteCache
+
+# name -> Drive file id, per folder - shared by all the strategy instances of the process (a StorageManager is
+# created per request), refreshed by `list` and when a cached id no longer exists
+_file_ids = {}
 
 ## Note - this code is using Service Accounts for authentication which are separate accounts other than
 ## your Google account. You can create a service account and download the JSON key file to use it for
@@ -18,6 +23,36 @@ class GoogleDriveStorageStrategy(StorageStrategy):
         )
         self.service = build('drive', 'v3', credentials=self.credentials)
         self.folder_id = context['settings']['folder_id']
+        # loads are served from the local cache while the file's modifiedTime is unchanged (see remote_cache.py)
+        self.cache = RemoteCache(f"gdrive:{self.folder_id or ''}")
+
+    def _file_id(self, file_name, refresh=False):
+        key = (self.folder_id, file_name)
+        if refresh or key not in _file_ids:
+            query = f"name = '{file_name}'"
+            if self.folder_id:
+                query += f" and '{self.folder_id}' in parents"
+            results = self.service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
+            items = results.get('files', [])
+            if not items:
+                _file_ids.pop(key, None)
+                return None
+            _file_ids[key] = items[0]['id']
+        return _file_ids[key]
+
+    def _metadata(self, file_name):
+        """(file id, version) of the file - re-resolves the id when the cached one is gone. None when not found."""
+        for refresh in (False, True):
+            file_id = self._file_id(file_name, refresh)
+            if file_id is None:
+                return None
+            try:
+                metadata = self.service.files().get(fileId=file_id, fields='id, modifiedTime').execute()
+                return file_id, f"{file_id}:{metadata['modifiedTime']}"
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+        return None
 
     def save(self, file_name, dest_file_name, content):
         # Save content to a temporary file
@@ -32,31 +67,30 @@ class GoogleDriveStorageStrategy(StorageStrategy):
 
         print(file_metadata)
         media = MediaFileUpload(file_name, resumable=True)
-        file = self.service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        file = self.service.files().create(body=file_metadata, media_body=media, fields='id, modifiedTime').execute()
         print(f"File ID: {file.get('id')}")
+        _file_ids[(self.folder_id, file_metadata['name'])] = file['id']
+        self.cache.put(file_metadata['name'], f"{file['id']}:{file.get('modifiedTime')}", content)
         
         # Remove the temporary file
         os.remove(file_name)
+        return file_metadata['name']
 
     def load(self, file_name):
-        query = f"name = '{file_name}'"
-        if self.folder_id:
-            query += f" and '{self.folder_id}' in parents"
-        results = self.service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
-        items = results.get('files', [])
-        if not items:
+        metadata = self._metadata(file_name)
+        if metadata is None:
             print('No files found.')
+            self.cache.discard(file_name)
             return None
-        file_id = items[0]['id']
-        request = self.service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-            print(f"Download {int(status.progress() * 100)}%.")
-        fh.seek(0)
-        return fh.read()
+        file_id, version = metadata
+        if self.cache.version(file_name) == version:
+            content = self.cache.get(file_name)
+            if content is not None:
+                return content
+        self.cache.miss()
+        content = self.service.files().get_media(fileId=file_id).execute()
+        self.cache.put(file_name, version, content)
+        return content
 
     def list(self):
         query = "" #"mimeType='application/vnd.google-apps.file'"
@@ -64,17 +98,22 @@ class GoogleDriveStorageStrategy(StorageStrategy):
             query = f"'{self.folder_id}' in parents"
         results = self.service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
         items = results.get('files', [])
+        for item in reversed(items):  # the first of the same named files wins, as in the name queries
+            _file_ids[(self.folder_id, item['name'])] = item['id']
         return [item['name'] for item in items]
 
     def delete(self, file_name):
-        query = f"name = '{file_name}'"
-        if self.folder_id:
-            query += f" and '{self.folder_id}' in parents"
-        results = self.service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
-        items = results.get('files', [])
-        if not items:
-            print('No files found.')
-            return
-        file_id = items[0]['id']
-        self.service.files().delete(fileId=file_id).execute()
-        print(f"File {file_name} deleted.")
\ No newline at end of file
+        self.cache.discard(file_name)
+        for refresh in (False, True):
+            file_id = self._file_id(file_name, refresh)
+            if file_id is None:
+                print('No files found.')
+                return
+            try:
+                self.service.files().delete(fileId=file_id).execute()
+                break
+            except HttpError as e:
+                if e.resp.status != 404:  # the cached id is gone - resolve the name again
+                    raise
+        _file_ids.pop((self.folder_id, file_name), None)
+        print(f"File {file_name} deleted.")
@@ -27,14 +27,18 @@ class LocalFilesystemStorageStrategy(StorageStrategy):
         subfolder_path = self.format_file_name(file_name, self.subfolder_names_format)
         return os.path.join(self.base_directory, subfolder_path)
 
+    def stored_name(self, file_name):
+        # the absolute path - `load` and `delete` take it as well as the name relative to the subfolder
+        return os.path.join(self._get_subfolder_path(file_name), file_name)
+
     def save(self, file_name, dest_file_name, content):
         file_name = self.format_file_name(file_name, dest_file_name)
-        subfolder_path = self._get_subfolder_path(file_name)
-        full_path = os.path.join(subfolder_path, file_name)
+        full_path = self.stored_name(file_name)
         full_directory = os.path.dirname(full_path)
         os.makedirs(full_directory, exist_ok=True)
         with open(full_path, 'w') as file:
             file.write(content)
+        return full_path
 
     def load(self, file_name):
         subfolder_path = self._get_subfolder_path(file_name)
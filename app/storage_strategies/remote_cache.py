@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+# Bounded on-disk read-through cache of the files loaded from the remote storage strategies (S3, Google Drive).
+# Every entry keeps the version the remote reported when it was fetched - the S3 ETag, the Drive modifiedTime -
+# and is only served after the remote confirmed the version is still current (a conditional GET / a metadata
+# call), so a hot result costs no transfer of its content. Entries are files under STORAGE_CACHE_PATH (local
+# to the container - not the shared /storage volume) with a JSON sidecar; the least recently used ones are
+# evicted once the cache exceeds STORAGE_CACHE_MAX_BYTES. Files larger than STORAGE_CACHE_MAX_OBJECT_BYTES
+# are never cached. STORAGE_CACHE_MAX_BYTES=0 disables the cache.
+
+STORAGE_CACHE_PATH = os.getenv('STORAGE_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'pdf-extract-storage-cache'))
+STORAGE_CACHE_MAX_BYTES = int(os.getenv('STORAGE_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+STORAGE_CACHE_MAX_OBJECT_BYTES = int(os.getenv('STORAGE_CACHE_MAX_OBJECT_BYTES', str(16 * 1024 * 1024)))
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+
+class RemoteCache:
+    def __init__(self, namespace):
+        """`namespace` - eg. `s3:<bucket>` - entries of different buckets/folders never mix."""
+        self.directory = os.path.join(STORAGE_CACHE_PATH, hashlib.sha256(namespace.encode('utf-8')).hexdigest()[:16])
+        self.enabled = STORAGE_CACHE_MAX_BYTES > 0
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, hashlib.sha256(name.encode('utf-8')).hexdigest())
+
+    def version(self, name):
+        """Version of the cached entry (to send to the remote for validation) or None."""
+        if not self.enabled:
+            return None
+        try:
+            with open(self._path(name) + '.json', 'r') as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return meta.get('version') if meta.get('name') == name else None
+
+    def get(self, name):
+        """Content of the entry the remote confirmed current - marks it as recently used."""
+        path = self._path(name)
+        try:
+            with open(path, 'rb') as file:
+                content = file.read()
+            os.utime(path)  # the mtime orders the LRU eviction
+        except OSError:
+            return None
+        _count('hits')
+        return content
+
+    def put(self, name, version, content):
+        if not self.enabled or version is None:
+            return
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        if len(content) > STORAGE_CACHE_MAX_OBJECT_BYTES:
+            return
+        path = self._path(name)
+        try:
+            # written to temp files and renamed - readers never see a partial entry
+            for target, data in ((path, content), (path + '.json', json.dumps({'name': name, 'version': version}).encode('utf-8'))):
+                fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(data)
+                os.replace(temp_path, target)
+        except OSError as e:
+            print(f"Failed to cache '{name}': {e}")
+            return
+        _count('stores')
+        evict()
+
+    def discard(self, name):
+        for path in (self._path(name), self._path(name) + '.json'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def miss(self):
+        _count('misses')
+
+
+def _count(name, value=1):
+    with _lock:
+        _stats[name] += value
+
+
+def evict():
+    """Remove the least recently used entries (of all namespaces) until the cache fits in STORAGE_CACHE_MAX_BYTES."""
+    entries = []
+    total = 0
+    for root, dirs, files in os.walk(STORAGE_CACHE_PATH):
+        for file_name in files:
+            if file_name.endswith('.json') or file_name.startswith('.tmp'):
+                continue
+            path = os.path.join(root, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= STORAGE_CACHE_MAX_BYTES:
+        return
+    evicted = 0
+    for mtime, size, path in sorted(entries):
+        for target in (path, path + '.json'):
+            try:
+                os.remove(target)
+            except OSError:
+                pass
+        total -= size
+        evicted += 1
+        if total <= STORAGE_CACHE_MAX_BYTES:
+            break
+    _count('evictions', evicted)
+
+
+def stats():
+    with _lock:
+        return dict(_stats)
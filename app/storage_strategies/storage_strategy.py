@@ -9,6 +9,7 @@ class StorageStrategy:
         self.context = context
 
     def save(self, file_name, dest_file_name, content):
+        """Store the content - returns the name of the stored file as accepted by `load` and `delete`."""
         raise NotImplementedError("Subclasses must implement this method")
 
     def load(self, file_name):
@@ -20,6 +21,10 @@ class StorageStrategy:
     def delete(self, file_name):
         raise NotImplementedError("Subclasses must implement this method")
 
+    def stored_name(self, file_name):
+        """Canonical name of a stored file - `save` returns it and the search index keys the file by it."""
+        return file_name
+
     def format_file_name(self, file_name, format_string):
         return format_string.format(file_fullname=file_name,  # file_name with path
                                      file_name=Path(file_name).stem,  # file_name without path
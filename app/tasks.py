@@ -1,76 +1,229 @@
 import time
+from celery import chord
 from celery_config import celery
 from ocr_strategies.marker import MarkerOCRStrategy
 from ocr_strategies.tesseract import TesseractOCRStrategy
 from ocr_strategies.llama_vision import LlamaVisionOCRStrategy
-import redis
+from ocr_strategies.auto import AutoOCRStrategy
+import redis_cache
 import os
-import ollama
+import ollama_pool
+import model_residency
 from storage_manager import StorageManager
+from ocr_cache import cache_key
+import compression
+import result_store
+import job_metadata
+import page_index
+import search_index
+from ocr_strategies import structured_output
+from stages import stage
+import metrics
+import profiling
+import tracing
+import admission  # releases the admission control slots of finished tasks
+from pdf_utils import count_pages, split_pdf
 
 OCR_STRATEGIES = {
     'marker': MarkerOCRStrategy(),
     'tesseract': TesseractOCRStrategy(),
     'llama_vision': LlamaVisionOCRStrategy()
 }
+# routes every page to the cheapest adequate engine of the above (see ocr_strategies/auto.py)
+OCR_STRATEGIES['auto'] = AutoOCRStrategy(OCR_STRATEGIES)
+
+# text - plain text/markdown, json - per-page words, boxes and confidences (see ocr_strategies/structured_output.py)
+OUTPUT_FORMATS = ['text', 'json']
+
+# Documents with more pages than OCR_SPLIT_PAGE_THRESHOLD are split into chunks of OCR_SPLIT_CHUNK_PAGES pages,
+# OCRed in parallel by `ocr_pages_task` on all available workers and merged by `ocr_merge_task` (0 disables it)
+OCR_SPLIT_PAGE_THRESHOLD = int(os.getenv('OCR_SPLIT_PAGE_THRESHOLD', '0'))
+OCR_SPLIT_CHUNK_PAGES = int(os.getenv('OCR_SPLIT_CHUNK_PAGES', '20'))
 
 # Connect to Redis
-redis_url = os.getenv('REDIS_CACHE_URL', 'redis://redis:6379/1')
-redis_client = redis.StrictRedis.from_url(redis_url)
+redis_client = redis_cache.redis_client()
+
+def extract(ocr_strategy, strategy_name, pdf_bytes, output_format):
+    with stage('ocr', strategy=strategy_name, bytes=len(pdf_bytes), output_format=output_format):
+        if output_format == 'json':
+            return structured_output.dumps(ocr_strategy.extract_structured_from_pdf(pdf_bytes))
+        return ocr_strategy.extract_text_from_pdf(pdf_bytes)
+
+def split_progress_key(task_id):
+    return f"ocr_split:{task_id}:pages_done"
 
 @celery.task(bind=True)
-def ocr_task(self, pdf_bytes, strategy_name, pdf_filename, pdf_hash, ocr_cache, prompt, model, storage_profile, storage_filename=None):
+def ocr_task(self, pdf_bytes, strategy_name, pdf_filename, pdf_hash, ocr_cache, prompt, model, storage_profile, storage_filename=None, output_format='text', preprocessing=None, profile=False):
     """
     Celery task to perform OCR processing on a PDF file.
     """
+    # profile - admins only, checked by the API (see profiling.py)
+    with profiling.profiled(self.request.id, 'task', profile, strategy=strategy_name, output_format=output_format):
+        return _run_ocr_task(self, pdf_bytes, strategy_name, pdf_filename, pdf_hash, ocr_cache, prompt, model, storage_profile, storage_filename, output_format, preprocessing, profile)
+
+def _run_ocr_task(self, pdf_bytes, strategy_name, pdf_filename, pdf_hash, ocr_cache, prompt, model, storage_profile, storage_filename, output_format, preprocessing, profile):
     start_time = time.time()
     if strategy_name not in OCR_STRATEGIES:
-        raise ValueError(f"Unknown strategy '{strategy_name}'. Available: marker, tesseract, llama_vision")
+        raise ValueError(f"Unknown strategy '{strategy_name}'. Available: {', '.join(OCR_STRATEGIES)}")
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}'. Available: {', '.join(OUTPUT_FORMATS)}")
+
+    metrics.record_queue_wait(strategy_name, self.request.get('enqueued_at'))
 
     ocr_strategy = OCR_STRATEGIES[strategy_name]
     ocr_strategy.set_update_state_callback(self.update_state)
+    # page_index - reuse the text of pages looking the same as pages OCRed before (see page_index.py)
+    ocr_strategy.set_options({'preprocessing': preprocessing, 'page_index': bool(ocr_cache) and page_index.PAGE_INDEX})
 
     self.update_state(state='PROGRESS', status="File uploaded successfully", meta={'progress': 10})  # Example progress update
     
     extracted_text = None
-    if ocr_cache:
-        cached_result = redis_client.get(pdf_hash)
+    ocr_cache_key = cache_key(pdf_hash, output_format, preprocessing)
+    if ocr_cache and not profile:  # a profiled job always runs the OCR
+        with stage('cache_lookup', strategy=strategy_name) as attributes:
+            cached_result = redis_client.get(ocr_cache_key)
+            attributes['hit'] = bool(cached_result)
         if cached_result:
             # Return cached result if available
-            extracted_text = cached_result.decode('utf-8')
+            extracted_text = compression.unpack_text(cached_result)
 
     if extracted_text is None:
+        if pdf_bytes is None:
+            # enqueued by /ocr/lookup for a cached result that has expired since
+            raise ValueError("The cached OCR result is no longer available - upload the file again.")
+        num_pages = count_pages(pdf_bytes) if OCR_SPLIT_PAGE_THRESHOLD else 0
+        if num_pages > OCR_SPLIT_PAGE_THRESHOLD:
+            print(f"Splitting {num_pages} pages into chunks of {OCR_SPLIT_CHUNK_PAGES} pages...")
+            self.update_state(state='PROGRESS', meta={'progress': 30, 'status': f'Extracting text from PDF (0 of {num_pages} pages)', 'pages_done': 0, 'pages_total': num_pages, 'start_time': start_time, 'elapsed_time': time.time() - start_time})
+            chunks = split_pdf(pdf_bytes, OCR_SPLIT_CHUNK_PAGES)
+            header = [ocr_pages_task.s(chunk_bytes, strategy_name, first_page, output_format, preprocessing, self.request.id, num_pages, start_time, bool(ocr_cache) and page_index.PAGE_INDEX, profile).set(headers=tracing.inject_headers())
+                      for first_page, chunk_bytes in chunks]
+            body = ocr_merge_task.s(strategy_name, pdf_filename, ocr_cache_key, ocr_cache, prompt, model, storage_profile, storage_filename, output_format, start_time, profile)
+            # the merge task takes over this task id - /ocr/result/{task_id} reports the aggregate progress and the merged result
+            return self.replace(chord(header, body))
+
         print("Extracting text from PDF...")
-        elapsed_time = time.time() - start_time
         self.update_state(state='PROGRESS', meta={'progress': 30, 'status': 'Extracting text from PDF', 'start_time': start_time, 'elapsed_time': time.time() - start_time})  # Example progress update
-        extracted_text = ocr_strategy.extract_text_from_pdf(pdf_bytes)
+        extracted_text = extract(ocr_strategy, strategy_name, pdf_bytes, output_format)
+        job_metadata.save(redis_client, self.request.id, 1, ocr_strategy.metadata)
     else:
         print("Using cached result...")
 
+    return finish_ocr(self, extracted_text, strategy_name, pdf_filename, ocr_cache_key, ocr_cache, prompt, model, storage_profile, storage_filename, output_format, start_time)
+
+@celery.task(bind=True)
+def ocr_pages_task(self, pdf_bytes, strategy_name, first_page, output_format, preprocessing, parent_task_id, pages_total, start_time, use_page_index=False, profile=False):
+    """
+    Celery task OCRing one page range of a split document. Reports the aggregate progress on the parent task.
+    """
+    ocr_strategy = OCR_STRATEGIES[strategy_name]
+    ocr_strategy.set_update_state_callback(lambda *args, **kwargs: None)  # progress is reported for the whole document below
+    ocr_strategy.set_options({'preprocessing': preprocessing, 'first_page': first_page, 'page_index': use_page_index})
+
+    with profiling.profiled(parent_task_id, f'pages-{first_page}', profile, strategy=strategy_name, output_format=output_format):
+        extracted_text = extract(ocr_strategy, strategy_name, pdf_bytes, output_format)
+    job_metadata.save(redis_client, parent_task_id, first_page, ocr_strategy.metadata)
+
+    pages_done = redis_client.incrby(split_progress_key(parent_task_id), count_pages(pdf_bytes))
+    redis_client.expire(split_progress_key(parent_task_id), 24 * 3600)
+    self.backend.store_result(parent_task_id, {
+        'progress': 30 + int(20 * pages_done / pages_total),
+        'status': f'Extracting text from PDF ({pages_done} of {pages_total} pages)',
+        'pages_done': pages_done,
+        'pages_total': pages_total,
+        'start_time': start_time,
+        'elapsed_time': time.time() - start_time
+    }, 'PROGRESS')
+
+    return pack_result(extracted_text, 'page_result')  # the merged result is counted as the `result`
+
+@celery.task(bind=True)
+def ocr_merge_task(self, results, strategy_name, pdf_filename, ocr_cache_key, ocr_cache, prompt, model, storage_profile, storage_filename, output_format, start_time, profile=False):
+    """
+    Chord callback merging the page range results (in page order) of a split document and finishing the job.
+    """
+    redis_client.delete(split_progress_key(self.request.id))
+    results = [compression.unpack_result(result) for result in results]
+    if output_format == 'json':
+        extracted_text = structured_output.dumps({'pages': [page for result in results for page in structured_output.loads(result)['pages']]})
+    else:
+        extracted_text = ''.join(results)
+
+    with profiling.profiled(self.request.id, 'merge', profile, strategy=strategy_name, output_format=output_format):
+        return finish_ocr(self, extracted_text, strategy_name, pdf_filename, ocr_cache_key, ocr_cache, prompt, model, storage_profile, storage_filename, output_format, start_time)
+
+@celery.task(bind=True)
+def reindex_storage_task(self, storage_profile):
+    """
+    Celery task adding the files already stored with the storage profile to the search index (see search_index.py).
+    """
+    with stage('reindex', storage_profile=storage_profile) as attributes:
+        result = search_index.reindex(storage_profile)
+        attributes['files'] = result['indexed']
+    return result
+
+def finish_ocr(task, extracted_text, strategy_name, pdf_filename, ocr_cache_key, ocr_cache, prompt, model, storage_profile, storage_filename, output_format, start_time):
+    """
+    Steps following the OCR - caching, the optional LLM transformation and storing the result.
+    """
     print("Extracted text: " + extracted_text)
-    self.update_state(state='PROGRESS', meta={'progress': 50, 'status': 'Text extracted', 'extracted_text': extracted_text, 'start_time': start_time, 'elapsed_time': time.time() - start_time})  # Example progress update
+    packed_text = compression.pack_result(extracted_text)
+    task.update_state(state='PROGRESS', meta={'progress': 50, 'status': 'Text extracted', 'extracted_text': packed_text, 'start_time': start_time, 'elapsed_time': time.time() - start_time})  # Example progress update
 
     if ocr_cache:
-        redis_client.set(pdf_hash, extracted_text)
+        cache_value = compression.pack_text(extracted_text)
+        redis_client.set(ocr_cache_key, cache_value)
+        compression.record_stats(redis_client, 'cache', len(extracted_text.encode('utf-8')), len(cache_value))
 
     if prompt:
         print("Transforming text using LLM (prompt={prompt}, model={model}) ...")
-        self.update_state(state='PROGRESS', meta={'progress': 75, 'status': 'Processing LLM', 'start_time': start_time, 'elapsed_time': time.time() - start_time})  # Example progress update
-        llm_resp = ollama.generate(model, prompt + extracted_text, stream=True)
-        num_chunk = 1
-        extracted_text = '' # will be filled with chunks from llm
-        for chunk in llm_resp:
-            self.update_state(state='PROGRESS', meta={'progress': num_chunk , 'status': 'LLM Processing chunk no: ' + str(num_chunk), 'start_time': start_time, 'elapsed_time': time.time() - start_time})  # Example progress update
-            num_chunk += 1
-            extracted_text += chunk['response']
+        task.update_state(state='PROGRESS', meta={'progress': 75, 'status': 'Processing LLM', 'start_time': start_time, 'elapsed_time': time.time() - start_time})  # Example progress update
+        if output_format == 'json':
+            # the LLM gets the page text rebuilt from the structured output, not the word/box arrays
+            extracted_text = structured_output.to_text(extracted_text)
+        with stage('llm', strategy=strategy_name, model=model) as attributes:
+            def generate(client):
+                llm_resp = client.generate(model, prompt + extracted_text, stream=True, keep_alive=model_residency.keep_alive(model))
+                response = {'text': ''}  # will be filled with chunks from llm - starts over when retried on another host
+                num_chunk = 1
+                for chunk in llm_resp:
+                    task.update_state(state='PROGRESS', meta={'progress': num_chunk , 'status': 'LLM Processing chunk no: ' + str(num_chunk), 'start_time': start_time, 'elapsed_time': time.time() - start_time})  # Example progress update
+                    num_chunk += 1
+                    response['text'] += chunk['response']
+                    if chunk.get('done'):
+                        response['eval_count'] = chunk.get('eval_count')
+                        response['eval_duration'] = chunk.get('eval_duration')
+                        response['load_duration'] = chunk.get('load_duration')
+                return response
+
+            llm_resp = ollama_pool.get_pool().call(generate, operation='generate', model=model)
+            extracted_text = llm_resp['text']
+            attributes['eval_count'] = llm_resp.get('eval_count')
+            attributes['eval_duration'] = llm_resp.get('eval_duration')
+            if llm_resp.get('cold_load'):
+                job_metadata.save(redis_client, task.request.id, job_metadata.LLM_FIELD, {'cold_loads': [dict(llm_resp['cold_load'], stage='llm')]})
 
     if storage_profile:
         if not storage_filename:
-            storage_filename = pdf_filename.replace('.pdf', '.md')
+            storage_filename = pdf_filename.replace('.pdf', '.json' if output_format == 'json' and not prompt else '.md')
 
-        storage_manager = StorageManager(storage_profile)
-        storage_manager.save(pdf_filename, storage_filename, extracted_text)
+        with stage('storage', strategy=strategy_name, storage_profile=storage_profile, bytes=len(extracted_text.encode('utf-8'))):
+            storage_manager = StorageManager(storage_profile)
+            storage_manager.save(pdf_filename, storage_filename, extracted_text)
 
-    self.update_state(state='DONE', meta={'progress': 100, 'status': 'Processing done!', 'start_time': start_time, 'elapsed_time': time.time() - start_time})
+    task.update_state(state='DONE', meta={'progress': 100, 'status': 'Processing done!', 'start_time': start_time, 'elapsed_time': time.time() - start_time})
+
+    if result_store.should_spool(extracted_text):
+        # only a reference goes to the result backend - see /ocr/result/{task_id}/download
+        return result_store.spool_result(task.request.id, extracted_text, '.json' if output_format == 'json' and not prompt else '.md')
+    if prompt:
+        return pack_result(extracted_text)
+    compression.record_stats(redis_client, 'result', len(extracted_text.encode('utf-8')), compression.stored_size(packed_text))
+    return packed_text
 
-    return extracted_text
+def pack_result(text, kind='result'):
+    """Task result of `text` - compressed when large (see compression.py), counted in the compression stats as `kind`."""
+    packed = compression.pack_result(text)
+    compression.record_stats(redis_client, kind, len(text.encode('utf-8')), compression.stored_size(packed))
+    return packed
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from celery.signals import task_failure, task_postrun, task_prerun
+from opentelemetry import context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SpanExporter, SpanExportResult
+
+from stages import add_stage_hook
+
+# Distributed tracing: a span per HTTP request (see the middleware in main.py), propagated through the
+# Celery message headers into the worker, where `ocr_task` gets its own span and every processing stage
+# (page rendering, per-page OCR / Ollama calls, LLM, storage ...) a child span.
+#
+# Configured with OTEL_TRACES_EXPORTER: `none` (default - tracing off), `console`, `file` (JSON lines
+# written to OTEL_TRACES_FILE) or `otlp` (standard OTEL_EXPORTER_OTLP_* variables).
+
+tracer = trace.get_tracer("pdf-extract-api")
+
+# propagation headers copied from the Celery message
+PROPAGATION_HEADERS = ('traceparent', 'tracestate')
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """Appends finished spans as JSON lines to a local file - for offline use, no collector needed."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(file_path))
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(json.loads(span.to_json()), separators=(',', ':')) + '\n' for span in spans)
+        with self.lock, open(self.file_path, 'a') as file:
+            file.write(lines)
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+def make_exporter(exporter_name):
+    if exporter_name == 'console':
+        return ConsoleSpanExporter()
+    if exporter_name == 'file':
+        return JsonLinesSpanExporter(os.getenv('OTEL_TRACES_FILE', '/var/lib/pdf-extract-api/traces.jsonl'))
+    if exporter_name == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    raise ValueError(f"Unknown OTEL_TRACES_EXPORTER '{exporter_name}'. Available: none, console, file, otlp")
+
+
+def tracing_enabled():
+    return os.getenv('OTEL_TRACES_EXPORTER', 'none') != 'none'
+
+
+def setup_tracing(default_service_name='pdf-extract-api'):
+    """Install the tracer provider and the stage hook - does nothing unless OTEL_TRACES_EXPORTER is set."""
+    if not tracing_enabled():
+        return
+
+    resource = Resource.create({'service.name': os.getenv('OTEL_SERVICE_NAME', default_service_name)})
+    provider = TracerProvider(resource=resource)
+    provider.add_span_processor(BatchSpanProcessor(make_exporter(os.getenv('OTEL_TRACES_EXPORTER'))))
+    trace.set_tracer_provider(provider)
+    add_stage_hook(tracing_stage_hook)
+
+
+def span_attributes(attributes):
+    """Stage attributes as span attributes - only the types OpenTelemetry accepts, namespaced."""
+    return {f"pdf_extract.{key}": value for key, value in attributes.items()
+            if isinstance(value, (str, bool, int, float))}
+
+
+@contextmanager
+def tracing_stage_hook(name, attributes):
+    """Stage hook (see stages.py) wrapping the stage in a child span of the current one."""
+    with tracer.start_as_current_span(name) as span:
+        try:
+            yield
+        finally:
+            span.set_attributes(span_attributes(attributes))
+
+
+@contextmanager
+def http_server_span(method, path, headers):
+    """Server span of an API request - continues the trace of the caller when it sends a traceparent header."""
+    with tracer.start_as_current_span(f"{method} {path}", context=propagate.extract(dict(headers)), kind=trace.SpanKind.SERVER) as span:
+        span.set_attribute('http.request.method', method)
+        span.set_attribute('url.path', path)
+        yield span
+
+
+def set_attributes(**attributes):
+    """Add attributes to the current span (no-op when tracing is off)."""
+    trace.get_current_span().set_attributes(span_attributes(attributes))
+
+
+def inject_headers():
+    """Trace context of the current span as Celery message headers (empty when tracing is off)."""
+    carrier = {}
+    if tracing_enabled():
+        propagate.inject(carrier)
+    return carrier
+
+
+# task_id -> (span, context token) of the tasks running in this process
+_task_spans = {}
+
+
+@task_prerun.connect
+def start_task_span(task_id=None, task=None, **kwargs):
+    if not tracing_enabled():
+        return
+    carrier = {header: task.request.get(header) for header in PROPAGATION_HEADERS if task.request.get(header)}
+    span = tracer.start_span(f"celery.task {task.name}", context=propagate.extract(carrier), kind=trace.SpanKind.CONSUMER)
+    span.set_attribute('celery.task_id', task_id)
+    token = context.attach(trace.set_span_in_context(span))
+    _task_spans[task_id] = (span, token)
+
+
+@task_failure.connect
+def record_task_failure(task_id=None, exception=None, **kwargs):
+    if task_id in _task_spans and exception is not None:
+        span = _task_spans[task_id][0]
+        span.record_exception(exception)
+        span.set_status(trace.Status(trace.StatusCode.ERROR, str(exception)))
+
+
+@task_postrun.connect
+def end_task_span(task_id=None, state=None, **kwargs):
+    if task_id not in _task_spans:
+        return
+    span, token = _task_spans.pop(task_id)
+    if state:
+        span.set_attribute('celery.state', state)
+    context.detach(token)
+    span.end()
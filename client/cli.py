@@ -1,19 +1,77 @@
 import argparse
 import base64
+import hashlib
 import requests
 import time
 import os
 
-def ocr_upload(file_path, ocr_cache, prompt, prompt_file=None, model='llama3.1', strategy='llama_vision', storage_profile='default', storage_filename=None):
+def file_hash(file_path, hash_algorithm='md5'):
+    digest = hashlib.new(hash_algorithm)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def ocr_lookup(file_path, prompt, model, strategy, storage_profile, storage_filename, output_format, preprocessing, hash_algorithm='md5'):
+    """
+    Ask the server for a cached result / known job of the file by its content hash.
+    Returns None on a miss - then the file has to be uploaded.
+    """
+    lookup_url = os.getenv('OCR_LOOKUP_URL', 'http://localhost:8000/ocr/lookup')
+    data = {
+        'hash': file_hash(file_path, hash_algorithm),
+        'hash_algorithm': hash_algorithm,
+        'model': model,
+        'strategy': strategy,
+        'storage_profile': storage_profile,
+        'output_format': output_format,
+        'file_name': os.path.basename(file_path)
+    }
+
+    if storage_filename:
+        data['storage_filename'] = storage_filename
+
+    if preprocessing:
+        data['preprocessing'] = preprocessing
+
+    if prompt:
+        data['prompt'] = prompt
+
+    response = requests.post(lookup_url, json=data)
+    if response.status_code != 200:
+        print(f"Cache lookup failed, uploading the file: {response.text}")
+        return None
+
+    respObject = response.json()
+    if respObject.get('status') == 'miss':
+        return None
+
+    print(f"Found on the server ({respObject.get('status')}), skipping the upload.")
+    if respObject.get('task_id'):
+        return {
+            "task_id": respObject.get('task_id')
+        }
+    return {
+        "text": respObject.get('text')
+    }
+
+def admin_headers():
+    # profiling is restricted to admins - see PROFILE_ADMIN_TOKEN in the API docs
+    token = os.getenv('PROFILE_ADMIN_TOKEN')
+    return {os.getenv('PROFILE_ADMIN_HEADER', 'X-Admin-Token'): token} if token else {}
+
+def ocr_upload(file_path, ocr_cache, prompt, prompt_file=None, model='llama3.1', strategy='llama_vision', storage_profile='default', storage_filename=None, output_format='text', preprocessing=None, hash_algorithm='md5', profile=False):
     ocr_url = os.getenv('OCR_UPLOAD_URL', 'http://localhost:8000/ocr/upload')
-    files = {'file': open(file_path, 'rb')}
     if not ocr_cache:
         print("OCR cache disabled.")
 
-    data = {'ocr_cache': ocr_cache, 'model': model, 'strategy': strategy, 'storage_profile': storage_profile}
+    data = {'ocr_cache': ocr_cache, 'model': model, 'strategy': strategy, 'storage_profile': storage_profile, 'output_format': output_format, 'hash_algorithm': hash_algorithm}
 
     if storage_filename:
         data['storage_filename'] = storage_filename
+
+    if preprocessing:
+        data['preprocessing'] = preprocessing
     
     try:
         if prompt_file:
@@ -25,7 +83,15 @@ def ocr_upload(file_path, ocr_cache, prompt, prompt_file=None, model='llama3.1',
     if prompt:
         data['prompt'] = prompt
 
-    response = requests.post(ocr_url, files=files, data=data)
+    if profile:
+        data['profile'] = True  # a profiled job always runs the OCR - no cache lookup
+    elif ocr_cache:
+        cached = ocr_lookup(file_path, prompt, model, strategy, storage_profile, storage_filename, output_format, preprocessing, hash_algorithm)
+        if cached:
+            return cached
+
+    files = {'file': open(file_path, 'rb')}
+    response = requests.post(ocr_url, files=files, data=data, headers=admin_headers() if profile else None)
     if response.status_code == 200:
         respObject = response.json()
         if respObject.get('task_id'):
@@ -40,21 +106,22 @@ def ocr_upload(file_path, ocr_cache, prompt, prompt_file=None, model='llama3.1',
         print(f"Failed to upload file: {response.text}")
         return None
 
-def ocr_request(file_path, ocr_cache, prompt, prompt_file=None, model='llama3.1', strategy='llama_vision', storage_profile='default', storage_filename=None):
+def ocr_request(file_path, ocr_cache, prompt, prompt_file=None, model='llama3.1', strategy='llama_vision', storage_profile='default', storage_filename=None, output_format='text', preprocessing=None, hash_algorithm='md5', profile=False):
     ocr_url = os.getenv('OCR_REQUEST_URL', 'http://localhost:8000/ocr/request')
-    with open(file_path, 'rb') as f:
-        file_content = base64.b64encode(f.read()).decode('utf-8')
-    
     data = {
         'ocr_cache': ocr_cache,
         'model': model,
         'strategy': strategy,
         'storage_profile': storage_profile,
-        'file': file_content
+        'output_format': output_format,
+        'hash_algorithm': hash_algorithm
     }
 
     if storage_filename:
         data['storage_filename'] = storage_filename
+
+    if preprocessing:
+        data['preprocessing'] = preprocessing
     
     if prompt_file:
         try:
@@ -65,8 +132,18 @@ def ocr_request(file_path, ocr_cache, prompt, prompt_file=None, model='llama3.1'
     
     if prompt:
         data['prompt'] = prompt
-    
-    response = requests.post(ocr_url, json=data)
+
+    if profile:
+        data['profile'] = True  # a profiled job always runs the OCR - no cache lookup
+    elif ocr_cache:
+        cached = ocr_lookup(file_path, prompt, model, strategy, storage_profile, storage_filename, output_format, preprocessing, hash_algorithm)
+        if cached:
+            return cached
+
+    with open(file_path, 'rb') as f:
+        data['file'] = base64.b64encode(f.read()).decode('utf-8')
+
+    response = requests.post(ocr_url, json=data, headers=admin_headers() if profile else None)
     if response.status_code == 200:
         respObject = response.json()
         if respObject.get('task_id'):
@@ -100,12 +177,23 @@ def get_result(task_id, print_progress = False):
             print(result)
         if response.status_code == 200:
             if result['state'] == 'SUCCESS':
+                if result.get('result') is None and result.get('result_url'):
+                    return download_result(task_id)
                 return result['result']
             elif result['state'] == 'FAILURE':
                 print("OCR task failed.")
                 return None
         time.sleep(2)  # Wait for 2 seconds before checking again
 
+def download_result(task_id):
+    """Download a large result (kept out of the result backend) - streamed and gzip compressed on the wire."""
+    result_url = os.getenv('RESULT_URL', f'http://localhost:8000/ocr/result/')
+    response = requests.get(result_url + task_id + '/download', headers={'Accept-Encoding': 'gzip'}, stream=True)
+    if response.status_code != 200:
+        print(f"Failed to download the result: {response.text}")
+        return None
+    return b''.join(response.iter_content(chunk_size=256 * 1024)).decode('utf-8')
+
 def clear_cache():
     clear_cache_url = os.getenv('CLEAR_CACHE_URL', 'http://localhost:8000/ocr/clear_cache')
     response = requests.post(clear_cache_url)
@@ -157,6 +245,49 @@ def delete_file(file_name, storage_profile):
     else:
         print(f"Failed to delete file: {response.text}")
 
+def search_files(query, storage_profile=None, limit=20):
+    search_url = os.getenv('SEARCH_FILES_URL', 'http://localhost:8000/storage/search')
+    params = {'query': query, 'limit': limit}
+    if storage_profile:
+        params['storage_profile'] = storage_profile
+    response = requests.get(search_url, params=params)
+    if response.status_code == 200:
+        result = response.json()
+        for match in result.get('results', []):
+            print(f"{match['storage_profile']}: {match['file_name']}")
+            print(f"    {match['snippet']}")
+        print(f"{len(result.get('results', []))} files found in {result.get('took_ms')} ms")
+    else:
+        print(f"Failed to search files: {response.text}")
+
+def get_profile(task_id, part=None):
+    profile_url = os.getenv('PROFILE_URL', 'http://localhost:8000/ocr/result/{task_id}/profile').format(task_id=task_id)
+    response = requests.get(profile_url, params={'part': part} if part else None, headers=admin_headers())
+    if response.status_code != 200:
+        print(f"Failed to get the profile: {response.text}")
+        return
+    for report in response.json().get('parts', []):
+        print(f"{report['part']}: {report['seconds']:.2f}s, peak memory {report['memory']['peak_bytes'] / 1024 ** 2:.1f} MB ({report['outcome']})")
+        for stage in report['stages']:
+            print(f"    {'  ' * stage.get('depth', 0)}{stage['stage']}: {stage['seconds']:.3f}s" +
+                  (f", peak {stage['peak_bytes'] / 1024 ** 2:.1f} MB, growth {stage['memory_growth_bytes'] / 1024 ** 2:+.1f} MB" if 'peak_bytes' in stage else ''))
+        print("    top functions (cumulative):")
+        for row in report['cpu']['top_cumulative'][:15]:
+            print(f"      {row['cumulative_seconds']:8.3f}s {row['calls']:8} {row['function']} ({row['file']}:{row['line']})")
+        print("    top allocations:")
+        for allocation in report['memory']['top_allocations'][:10]:
+            print(f"      {allocation['size_bytes'] / 1024 ** 2:8.1f} MB {allocation['traceback'][-1] if allocation['traceback'] else ''}")
+
+def reindex_files(storage_profile):
+    reindex_url = os.getenv('REINDEX_FILES_URL', 'http://localhost:8000/storage/reindex')
+    response = requests.post(reindex_url, params={'storage_profile': storage_profile})
+    if response.status_code == 200:
+        task_id = response.json().get('task_id')
+        print(f"Reindexing {storage_profile}. Task Id: {task_id} Waiting for the result...")
+        print(get_result(task_id))
+    else:
+        print(f"Failed to reindex files: {response.text}")
+
 def main():
     parser = argparse.ArgumentParser(description="CLI for OCR and Ollama operations.")
     subparsers = parser.add_subparsers(dest='command', help='Sub-command help')
@@ -173,6 +304,10 @@ def main():
     ocr_parser.add_argument('--print_progress', default=True, action='store_true', help='Print the progress of the OCR task')
     ocr_parser.add_argument('--storage_profile', type=str, default='default', help='Storage profile to use for the file')
     ocr_parser.add_argument('--storage_filename', type=str, default=None, help='Storage filename to use for the file. You may use some formatting - see the docs')
+    ocr_parser.add_argument('--output_format', type=str, default='text', help='Output format: text or json (per-page words, boxes and confidences - tesseract only)')
+    ocr_parser.add_argument('--preprocessing', type=str, default=None, help='Tesseract image preprocessing preset: none, default, grayscale, fast, scan, fax or comma separated steps')
+    ocr_parser.add_argument('--hash_algorithm', type=str, default='md5', help='Content hash used to look the file up in the OCR cache before uploading: md5 (default, same as the server and the web client) or sha256')
+    ocr_parser.add_argument('--profile', default=False, action='store_true', help='Capture a CPU and memory profile of the job (admins only - set PROFILE_ADMIN_TOKEN)')
     #ocr_parser.add_argument('--async_mode', action='store_true', help='Enable async mode for the OCR task')
 
     # Sub-command for uploading a file via file upload - @deprecated - it's a backward compatibility gimmick
@@ -187,6 +322,10 @@ def main():
     ocr_parser.add_argument('--print_progress', default=True, action='store_true', help='Print the progress of the OCR task')
     ocr_parser.add_argument('--storage_profile', type=str, default='default', help='Storage profile to use for the file')
     ocr_parser.add_argument('--storage_filename', type=str, default=None, help='Storage filename to use for the file. You may use some formatting - see the docs')
+    ocr_parser.add_argument('--output_format', type=str, default='text', help='Output format: text or json (per-page words, boxes and confidences - tesseract only)')
+    ocr_parser.add_argument('--preprocessing', type=str, default=None, help='Tesseract image preprocessing preset: none, default, grayscale, fast, scan, fax or comma separated steps')
+    ocr_parser.add_argument('--hash_algorithm', type=str, default='md5', help='Content hash used to look the file up in the OCR cache before uploading: md5 (default, same as the server and the web client) or sha256')
+    ocr_parser.add_argument('--profile', default=False, action='store_true', help='Capture a CPU and memory profile of the job (admins only - set PROFILE_ADMIN_TOKEN)')
     #ocr_parser.add_argument('--async_mode', action='store_true', help='Enable async mode for the OCR task')
 
 
@@ -202,12 +341,21 @@ def main():
     ocr_request_parser.add_argument('--print_progress', default=True, action='store_true', help='Print the progress of the OCR task')
     ocr_request_parser.add_argument('--storage_profile', type=str, default='default', help='Storage profile to use. You may use some formatting - see the docs')
     ocr_request_parser.add_argument('--storage_filename', type=str, default=None, help='Storage filename to use')
+    ocr_request_parser.add_argument('--output_format', type=str, default='text', help='Output format: text or json (per-page words, boxes and confidences - tesseract only)')
+    ocr_request_parser.add_argument('--preprocessing', type=str, default=None, help='Tesseract image preprocessing preset: none, default, grayscale, fast, scan, fax or comma separated steps')
+    ocr_request_parser.add_argument('--hash_algorithm', type=str, default='md5', help='Content hash used to look the file up in the OCR cache before uploading: md5 (default, same as the server and the web client) or sha256')
+    ocr_request_parser.add_argument('--profile', default=False, action='store_true', help='Capture a CPU and memory profile of the job (admins only - set PROFILE_ADMIN_TOKEN)')
 
     # Sub-command for getting the result
     result_parser = subparsers.add_parser('result', help='Get the OCR result by specified task id.')
     result_parser.add_argument('--task_id', type=str, help='Task Id returned by the upload command')
     result_parser.add_argument('--print_progress', default=True, action='store_true', help='Print the progress of the OCR task')
 
+    # Sub-command for getting the profile of a job sent with --profile
+    profile_parser = subparsers.add_parser('profile', help='Print the CPU and memory profile of a task sent with --profile')
+    profile_parser.add_argument('--task_id', type=str, required=True, help='Task Id returned by the upload command')
+    profile_parser.add_argument('--part', type=str, default=None, help='Only this part: task, pages-<first page> or merge')
+
     # Sub-command for clearing the cache
     clear_cache_parser = subparsers.add_parser('clear_cache', help='Clear the OCR result cache')
 
@@ -233,11 +381,21 @@ def main():
     delete_file_parser.add_argument('--file_name', type=str, required=True, help='Name of the file to delete')
     delete_file_parser.add_argument('--storage_profile', type=str, default='default', help='Storage profile to use')
 
+    # Sub-command for searching the stored files
+    search_files_parser = subparsers.add_parser('search_files', help='Search the stored results for a text (eg. an invoice number)')
+    search_files_parser.add_argument('--query', type=str, required=True, help='Text to search for')
+    search_files_parser.add_argument('--storage_profile', type=str, default=None, help='Only results of this storage profile')
+    search_files_parser.add_argument('--limit', type=int, default=20, help='Maximum number of files')
+
+    # Sub-command for reindexing the stored files
+    reindex_files_parser = subparsers.add_parser('reindex_files', help='Add the files already stored with the storage profile to the search index')
+    reindex_files_parser.add_argument('--storage_profile', type=str, default='default', help='Storage profile to reindex')
+
     args = parser.parse_args()
 
     if args.command == 'ocr' or args.command == 'ocr_upload':
         print(args)
-        result = ocr_upload(args.file, False if args.disable_ocr_cache else args.ocr_cache, args.prompt, args.prompt_file, args.model, args.strategy, args.storage_profile, args.storage_filename)
+        result = ocr_upload(args.file, False if args.disable_ocr_cache else args.ocr_cache, args.prompt, args.prompt_file, args.model, args.strategy, args.storage_profile, args.storage_filename, args.output_format, args.preprocessing, args.hash_algorithm, args.profile)
         if result is None:
             print("Error uploading file.")
             return
@@ -249,7 +407,7 @@ def main():
             if text_result:
                 print(text_result)
     elif args.command == 'ocr_request':
-        result = ocr_request(args.file, False if args.disable_ocr_cache else args.ocr_cache, args.prompt, args.prompt_file, args.model, args.strategy, args.storage_profile, args.storage_filename)
+        result = ocr_request(args.file, False if args.disable_ocr_cache else args.ocr_cache, args.prompt, args.prompt_file, args.model, args.strategy, args.storage_profile, args.storage_filename, args.output_format, args.preprocessing, args.hash_algorithm, args.profile)
         if result is None:
             print("Error uploading file.")
             return
@@ -264,6 +422,8 @@ def main():
         text_result = get_result(args.task_id, args.print_progress)
         if text_result:
             print(text_result)
+    elif args.command == 'profile':
+        get_profile(args.task_id, args.part)
     elif args.command == 'clear_cache':
         clear_cache()
     elif args.command == 'llm_generate':
@@ -275,7 +435,11 @@ def main():
     elif args.command == 'load_file':
         load_file(args.file_name, args.storage_profile)
     elif args.command == 'delete_file':
-        delete_file(args.file_name, args.storage_profile)           
+        delete_file(args.file_name, args.storage_profile)
+    elif args.command == 'search_files':
+        search_files(args.query, args.storage_profile, args.limit)
+    elif args.command == 'reindex_files':
+        reindex_files(args.storage_profile)           
     else:
         parser.print_help()
 
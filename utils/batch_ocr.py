@@ -0,0 +1,185 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+sys.path.insert(0, APP_DIR)
+
+# Offline batch OCR of a directory (or a list of files) - for backfills of archived PDFs. The strategies of
+# `tasks.OCR_STRATEGIES` run in-process in a pool of worker processes (models - eg. Marker's - are loaded once
+# per process), no API, broker or Celery involved. The results are written through a storage profile like the
+# `ocr_task` writes them (and added to the search index), without the OCR cache and the LLM step.
+#
+# Every processed file is appended to a JSON lines manifest (--manifest) - path, size, mtime, pages, seconds,
+# the stored name or the error. A re-run skips the files recorded as done (unless their size or mtime changed),
+# so an interrupted backfill just continues; --retry_failed also re-runs the failed ones.
+#
+# Run it from the repository root with the app requirements installed:
+#   python utils/batch_ocr.py /archive/2019 --strategy tesseract --storage_profile default --workers 8
+#   python utils/batch_ocr.py files.txt --strategy auto --manifest backfill.jsonl   # one path per line
+
+PROGRESS_EVERY = 50  # files between the progress lines
+
+
+def list_files(source):
+    """PDFs under the directory (recursively, sorted) or the paths listed in the file (relative to it)."""
+    if os.path.isdir(source):
+        files = []
+        for root, dirs, names in os.walk(source):
+            dirs.sort()
+            files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith('.pdf'))
+        return files
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r') as file:
+        return [os.path.join(base, line.strip()) for line in file if line.strip() and not line.startswith('#')]
+
+
+def file_key(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def read_manifest(manifest_path):
+    """Last record of every path in the manifest - {path: record}."""
+    records = {}
+    if not os.path.exists(manifest_path):
+        return records
+    with open(manifest_path, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            records[record['path']] = record
+    return records
+
+
+def pending_files(files, records, retry_failed):
+    pending = []
+    skipped = 0
+    for path in files:
+        try:
+            key = file_key(path)
+        except OSError as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        record = records.get(key['path'])
+        unchanged = record and record['size'] == key['size'] and record['mtime'] == key['mtime']
+        if unchanged and (record['status'] == 'done' or not retry_failed):
+            skipped += 1
+            continue
+        pending.append(key)
+    return pending, skipped
+
+
+def storage_filename(path, source, output_format, template=None):
+    """The name to store the result of the file under - its path relative to the source with the result extension."""
+    if template:
+        return template
+    root = source if os.path.isdir(source) else os.path.dirname(os.path.abspath(source))
+    relative = os.path.relpath(path, root)
+    name = os.path.splitext(relative)[0] + ('.json' if output_format == 'json' else '.md')
+    return name.replace('{', '{{').replace('}', '}}')  # the storage strategies format the name
+
+
+_worker = {}
+
+
+def init_worker(strategy_name, options, storage_profile):
+    """Pool process initializer - imports the app and loads the strategy models once per process."""
+    import tasks
+    from storage_manager import StorageManager
+
+    strategy = tasks.OCR_STRATEGIES[strategy_name]
+    strategy.set_update_state_callback(lambda *args, **kwargs: None)
+    if strategy_name == 'marker':
+        from ocr_strategies.marker import load_models
+        load_models()
+    _worker.update({
+        'tasks': tasks,
+        'strategy': strategy,
+        'strategy_name': strategy_name,
+        'options': options,
+        'storage': StorageManager(storage_profile) if storage_profile else None
+    })
+
+
+def process_file(job):
+    """OCR one file in the pool process - returns its manifest record."""
+    from pdf_utils import count_pages
+
+    record = dict(job['key'])
+    start = time.perf_counter()
+    try:
+        with open(job['key']['path'], 'rb') as file:
+            pdf_bytes = file.read()
+        record['pages'] = count_pages(pdf_bytes)
+        strategy = _worker['strategy']
+        strategy.set_options(dict(_worker['options']))
+        text = _worker['tasks'].extract(strategy, _worker['strategy_name'], pdf_bytes, job['output_format'])
+        if _worker['storage']:
+            record['stored'] = _worker['storage'].save(os.path.basename(job['key']['path']), job['storage_filename'], text)
+        record['chars'] = len(text)
+        record['status'] = 'done'
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = f"{type(e).__name__}: {e}"
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR a directory of PDFs in-process, without the API and the broker.")
+    parser.add_argument("source", type=str, help="Directory of PDFs (walked recursively) or a file listing the PDF paths")
+    parser.add_argument("--strategy", type=str, default='tesseract', help="OCR strategy - tesseract, marker, llama_vision or auto")
+    parser.add_argument("--output_format", type=str, default='text', help="text or json")
+    parser.add_argument("--preprocessing", type=str, default=None, help="Tesseract preprocessing preset or steps")
+    parser.add_argument("--storage_profile", type=str, default='default', help="Storage profile to write the results with ('' - don't store)")
+    parser.add_argument("--storage_filename", type=str, default=None, help="Storage file name format (default: the relative path with .md/.json)")
+    parser.add_argument("--manifest", type=str, default='batch_ocr_manifest.jsonl', help="Resumable manifest of the processed files")
+    parser.add_argument("--retry_failed", default=False, action='store_true', help="Also re-run the files that failed before")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--limit", type=int, default=0, help="Process at most this many files (0 - all)")
+    args = parser.parse_args()
+
+    records = read_manifest(args.manifest)
+    pending, skipped = pending_files(list_files(args.source), records, args.retry_failed)
+    if args.limit:
+        pending = pending[:args.limit]
+    print(f"{len(pending)} files to process, {skipped} already done (manifest: {args.manifest})")
+    if not pending:
+        return
+
+    jobs = [{'key': key, 'output_format': args.output_format,
+             'storage_filename': storage_filename(key['path'], args.source, args.output_format, args.storage_filename)} for key in pending]
+    options = {'preprocessing': args.preprocessing}
+
+    done = failed = pages = 0
+    start = time.time()
+    # spawn - the pool processes must not inherit model or client state of this one
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.workers, initializer=init_worker, initargs=(args.strategy, options, args.storage_profile or None)) as pool, \
+            open(args.manifest, 'a') as manifest:
+        for record in pool.imap_unordered(process_file, jobs):
+            manifest.write(json.dumps(record) + '\n')
+            manifest.flush()  # a killed run loses no finished file
+            if record['status'] == 'done':
+                done += 1
+                pages += record.get('pages', 0)
+            else:
+                failed += 1
+                print(f"Failed {record['path']}: {record['error']}")
+            if (done + failed) % PROGRESS_EVERY == 0:
+                elapsed = time.time() - start
+                print(f"{done + failed}/{len(jobs)} files, {pages} pages, {pages / elapsed:.2f} pages/sec")
+
+    elapsed = time.time() - start
+    print(f"Done: {done} files ({pages} pages), {failed} failed in {elapsed:.1f}s - "
+          f"{pages / elapsed:.2f} pages/sec, {done / elapsed:.2f} files/sec with {args.workers} workers")
+
+
+if __name__ == "__main__":
+    main()
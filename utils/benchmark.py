@@ -0,0 +1,396 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import queue as queue_module
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stats import percentile
+from stub_ollama import start_stub_server
+
+# Reproducible, offline benchmark of the OCR strategies and the end-to-end `ocr_task` pipeline.
+#
+# Every strategy runs in its own spawned process (so peak RSS is per strategy) over a corpus made of
+# the `examples/*.pdf` files plus synthetic multi-page PDFs. The Ollama calls (llama_vision and the
+# LLM prompt stage) go to a local stub server, the Celery task runs eagerly with an in-memory result
+# backend and the OCR cache is an in-memory dict unless --redis_url is given - so no network, GPU
+# model or broker is needed. Results are printed and written as JSON for regression tracking:
+#
+#   python utils/benchmark.py --strategies tesseract,llama_vision --synthetic_pages 5,20 --json bench.json
+#   python utils/benchmark.py --strategies tesseract --baseline bench.json --max_regression 0.15
+
+SYNTHETIC_WORDS = ("invoice total amount due date payment account number customer address order "
+                   "quantity price description tax net gross reference patient study report findings").split()
+
+
+def generate_synthetic_pdf(path, pages, seed=0, dpi=200):
+    """Render `pages` A4 pages of deterministic pseudo-random text lines into a PDF (image only, like a scan)."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    rng = random.Random(seed)
+    try:
+        font = ImageFont.load_default(size=28)
+    except TypeError:  # Pillow < 10.1 has only the fixed size bitmap font
+        font = ImageFont.load_default()
+
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    images = []
+    for page_no in range(pages):
+        image = Image.new('RGB', (width, height), 'white')
+        draw = ImageDraw.Draw(image)
+        draw.text((100, 80), f"Synthetic document {seed} - page {page_no + 1}", fill='black', font=font)
+        for line_no in range(40):
+            line = ' '.join(rng.choice(SYNTHETIC_WORDS) for _ in range(rng.randint(4, 10)))
+            draw.text((100, 160 + line_no * 50), line, fill='black', font=font)
+        images.append(image)
+    images[0].save(path, 'PDF', resolution=dpi, save_all=True, append_images=images[1:])
+    return path
+
+
+def build_corpus(files, synthetic_pages, work_dir):
+    corpus = []
+    for path in files:
+        corpus.append({'name': os.path.basename(path), 'path': path, 'synthetic': False})
+    for i, pages in enumerate(synthetic_pages):
+        path = generate_synthetic_pdf(os.path.join(work_dir, f"synthetic-{pages}p.pdf"), pages, seed=i)
+        corpus.append({'name': os.path.basename(path), 'path': path, 'synthetic': True})
+    return corpus
+
+
+class MemoryCache:
+    """
+    In-memory replacement of the Redis client of the tasks for offline runs - the commands the tasks use (OCR
+    cache, job metadata, split progress, compression stats), expiry ignored.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, *args, **kwargs):
+        self.data[key] = value.encode('utf-8') if isinstance(value, str) else value
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def incrby(self, key, amount=1):
+        self.data[key] = int(self.data.get(key, 0)) + amount
+        return self.data[key]
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        fields = self.data.setdefault(key, {})
+        if field is not None:
+            fields[field] = value
+        fields.update(mapping or {})
+
+    def hincrby(self, key, field, amount=1):
+        fields = self.data.setdefault(key, {})
+        fields[field] = int(fields.get(field, 0)) + amount
+        return fields[field]
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def pipeline(self):
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+    """Commands queued on the MemoryCache - run by `execute`."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.cache, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        results = [command(*args, **kwargs) for command, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+def run_strategy(strategy_name, corpus, repeat, options, result_queue):
+    """Child process entry point - benchmarks a single strategy and puts its result dict on the queue."""
+    result = {'strategy': strategy_name, 'documents': [], 'errors': []}
+    try:
+        from contextlib import contextmanager
+        from pdf2image import pdfinfo_from_bytes
+        from stages import add_stage_hook
+        import tasks
+
+        stage_times = {}
+
+        @contextmanager
+        def timing_hook(name, attributes):
+            start = time.perf_counter()
+            yield
+            stage_times.setdefault(name, []).append(time.perf_counter() - start)
+
+        add_stage_hook(timing_hook)
+
+        strategy = tasks.OCR_STRATEGIES[strategy_name]
+        strategy.set_update_state_callback(lambda *args, **kwargs: None)
+        strategy.set_options({})
+
+        page_latencies = []
+        total_pages = 0
+        total_seconds = 0.0
+        for doc in corpus:
+            pdf_bytes = open(doc['path'], 'rb').read()
+            pages = int(pdfinfo_from_bytes(pdf_bytes)['Pages'])
+            for _ in range(repeat):
+                recorded_pages = len(stage_times.get('ocr_page', []))
+                start = time.perf_counter()
+                text = strategy.extract_text_from_pdf(pdf_bytes)
+                seconds = time.perf_counter() - start
+                # strategies without per-page stages (marker) get the document time spread evenly
+                page_latencies.extend(stage_times.get('ocr_page', [])[recorded_pages:] or [seconds / pages] * pages)
+                total_pages += pages
+                total_seconds += seconds
+            result['documents'].append({'name': doc['name'], 'pages': pages, 'seconds_per_run': seconds, 'output_chars': len(text)})
+
+        result.update({
+            'pages': total_pages,
+            'seconds': total_seconds,
+            'pages_per_sec': total_pages / total_seconds if total_seconds else None,
+            'page_latency_p50': percentile(page_latencies, 50),
+            'page_latency_p95': percentile(page_latencies, 95),
+        })
+
+        if options.get('e2e') and corpus:
+            # run the whole Celery task twice with the OCR cache on - the second run is a cache hit
+            if not options.get('redis_url'):
+                tasks.redis_client = MemoryCache()
+            doc = corpus[0]
+            pdf_bytes = open(doc['path'], 'rb').read()
+            pdf_hash = f"benchmark-{strategy_name}-{doc['name']}-{time.time()}"
+            runs = []
+            for _ in range(2):
+                start = time.perf_counter()
+                tasks.ocr_task.apply(args=[pdf_bytes, strategy_name, doc['name'], pdf_hash, True, options.get('llm_prompt'), options.get('llm_model'), None, None]).get()
+                runs.append(time.perf_counter() - start)
+            result['cache'] = {
+                'document': doc['name'],
+                'cold_seconds': runs[0],
+                'warm_seconds': runs[1],
+                'speedup': runs[0] / runs[1] if runs[1] else None,
+            }
+
+        result['stages'] = {name: {'count': len(times), 'total_seconds': sum(times), 'mean_seconds': sum(times) / len(times)}
+                            for name, times in stage_times.items()}
+    except Exception as e:
+        result['errors'].append(f"{type(e).__name__}: {e}")
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_rss_mb'] = max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    result_queue.put(result)
+
+
+def run_marker_batch(corpus, batch_multiplier, result_queue):
+    """Child process entry point - Marker throughput with batch multiplier 1 vs `batch_multiplier` (see app/ocr_strategies/marker.py)."""
+    result = {'strategy': 'marker_batch', 'batch_multiplier': batch_multiplier, 'errors': []}
+    try:
+        from marker.convert import convert_single_pdf
+        from ocr_strategies.marker import load_models
+        from pdf_utils import count_pages
+
+        model_lst = load_models()
+        documents = [open(doc['path'], 'rb').read() for doc in corpus]
+        pages = sum(count_pages(pdf_bytes) for pdf_bytes in documents)
+        convert_single_pdf(documents[0], model_lst)  # warm-up, so neither run pays for the first inference
+
+        start = time.perf_counter()
+        for pdf_bytes in documents:
+            convert_single_pdf(pdf_bytes, model_lst)
+        per_document_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for pdf_bytes in documents:
+            convert_single_pdf(pdf_bytes, model_lst, batch_multiplier=batch_multiplier)
+        batched_seconds = time.perf_counter() - start
+
+        result.update({
+            'documents': len(documents),
+            'pages': pages,
+            'per_document': {'seconds': per_document_seconds, 'pages_per_sec': pages / per_document_seconds},
+            'batched': {'seconds': batched_seconds, 'pages_per_sec': pages / batched_seconds},
+            'speedup': per_document_seconds / batched_seconds if batched_seconds else None,
+        })
+    except Exception as e:
+        result['errors'].append(f"{type(e).__name__}: {e}")
+    result_queue.put(result)
+
+
+def wait_for_result(process, result_queue, strategy_name):
+    """Wait for the child's result - without hanging when the child dies without reporting (eg. OOM kill)."""
+    while True:
+        try:
+            return result_queue.get(timeout=1)
+        except queue_module.Empty:
+            if not process.is_alive():
+                return {'strategy': strategy_name, 'documents': [], 'errors': [f"benchmark process exited with code {process.exitcode}"]}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=APP_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare_with_baseline(results, baseline_path, max_regression):
+    """Return the list of strategies whose pages/sec dropped more than `max_regression` (fraction) vs the baseline."""
+    baseline = {r['strategy']: r for r in json.load(open(baseline_path))['results']}
+    regressions = []
+    for r in results:
+        before = baseline.get(r['strategy'], {}).get('pages_per_sec')
+        after = r.get('pages_per_sec')
+        if before and after and after < before * (1 - max_regression):
+            regressions.append(f"{r['strategy']}: {before:.3f} -> {after:.3f} pages/sec")
+    return regressions
+
+
+def print_summary(results):
+    def fmt(value, pattern):
+        return pattern.format(value) if value is not None else f"{'n/a':>8}"
+
+    print(f"{'strategy':<14} {'pages':>6} {'pages/s':>8} {'p50 s':>8} {'p95 s':>8} {'peak MB':>8} {'cold s':>8} {'warm s':>8}")
+    for r in results:
+        cache = r.get('cache', {})
+        print(f"{r['strategy']:<14} {r.get('pages', 0):>6} {fmt(r.get('pages_per_sec'), '{:8.3f}')} {fmt(r.get('page_latency_p50'), '{:8.3f}')} "
+              f"{fmt(r.get('page_latency_p95'), '{:8.3f}')} {fmt(r.get('peak_rss_mb'), '{:8.1f}')} "
+              f"{fmt(cache.get('cold_seconds'), '{:8.3f}')} {fmt(cache.get('warm_seconds'), '{:8.3f}')}")
+        for error in r['errors']:
+            print(f"  error: {error}")
+
+
+def print_marker_batch(result):
+    print(f"Marker batch multiplier {result['batch_multiplier']}:")
+    if result.get('per_document'):
+        print(f"  multiplier 1: {result['per_document']['pages_per_sec']:8.3f} pages/s ({result['per_document']['seconds']:.2f}s for {result['documents']} documents, {result['pages']} pages)")
+        print(f"  multiplier {result['batch_multiplier']}: {result['batched']['pages_per_sec']:8.3f} pages/s ({result['batched']['seconds']:.2f}s)")
+        print(f"  speedup:      {result['speedup']:8.2f}x")
+    for error in result['errors']:
+        print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the OCR strategies and the ocr_task pipeline.")
+    parser.add_argument("--strategies", type=str, default='tesseract,marker,llama_vision', help="Comma separated strategies to benchmark")
+    parser.add_argument("--files", type=str, nargs='*', default=None, help="PDF files of the corpus (default: examples/*.pdf)")
+    parser.add_argument("--synthetic_pages", type=str, default='5,20', help="Page counts of the generated synthetic PDFs, comma separated ('' for none)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per document")
+    parser.add_argument("--no_e2e", default=False, action='store_true', help="Skip the end-to-end ocr_task cold/warm cache run")
+    parser.add_argument("--llm_prompt", type=str, default='Convert the document to JSON: ', help="Prompt for the LLM stage of the end-to-end run ('' to skip)")
+    parser.add_argument("--llm_model", type=str, default='llama3.1', help="Model for the LLM stage of the end-to-end run")
+    parser.add_argument("--ollama_host", type=str, default=None, help="Use this Ollama instead of the built-in stub")
+    parser.add_argument("--stub_latency", type=float, default=0.05, help="Seconds each stub Ollama response takes")
+    parser.add_argument("--redis_url", type=str, default=None, help="Use this Redis for the OCR cache instead of an in-memory dict")
+    parser.add_argument("--marker_batch_multiplier", type=int, default=0, help="Also compare Marker throughput with batch multiplier 1 vs this one (0 - skip)")
+    parser.add_argument("--json", type=str, default=None, help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", type=str, default=None, help="Results JSON of a previous run to compare pages/sec with")
+    parser.add_argument("--max_regression", type=float, default=0.1, help="Allowed pages/sec drop vs the baseline (fraction) before failing")
+    args = parser.parse_args()
+
+    stub = None
+    ollama_host = args.ollama_host
+    if not ollama_host:
+        stub = start_stub_server(latency=args.stub_latency)
+        ollama_host = f"http://127.0.0.1:{stub.server_port}"
+
+    # the child processes import the app modules - configure them before they are spawned
+    os.environ['OLLAMA_HOST'] = ollama_host
+    os.environ.pop('OLLAMA_HOSTS', None)  # a configured pool would take precedence over the stub
+    os.environ['CELERY_BROKER_URL'] = 'memory://'
+    os.environ['CELERY_RESULT_BACKEND'] = 'cache+memory://'
+    if args.redis_url:
+        os.environ['REDIS_CACHE_URL'] = args.redis_url
+
+    files = args.files if args.files is not None else sorted(glob.glob(os.path.join(EXAMPLES_DIR, '*.pdf')))
+    synthetic_pages = [int(pages) for pages in args.synthetic_pages.split(',') if pages.strip()]
+    options = {'e2e': not args.no_e2e, 'llm_prompt': args.llm_prompt or None, 'llm_model': args.llm_model, 'redis_url': args.redis_url}
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        corpus = build_corpus(files, synthetic_pages, work_dir)
+        for strategy_name in [s.strip() for s in args.strategies.split(',') if s.strip()]:
+            print(f"Benchmarking {strategy_name} on {len(corpus)} documents ...")
+            result_queue = context.Queue()
+            process = context.Process(target=run_strategy, args=(strategy_name, corpus, args.repeat, options, result_queue))
+            process.start()
+            results.append(wait_for_result(process, result_queue, strategy_name))
+            process.join()
+
+        marker_batch = None
+        if args.marker_batch_multiplier > 0 and corpus:
+            print(f"Benchmarking the Marker batch multiplier on {len(corpus)} documents ...")
+            result_queue = context.Queue()
+            process = context.Process(target=run_marker_batch, args=(corpus, args.marker_batch_multiplier, result_queue))
+            process.start()
+            marker_batch = wait_for_result(process, result_queue, 'marker_batch')
+            marker_batch.setdefault('batch_multiplier', args.marker_batch_multiplier)
+            process.join()
+
+    print_summary(results)
+    if marker_batch:
+        print_marker_batch(marker_batch)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'ollama': 'stub' if stub else ollama_host,
+            'corpus': [doc['name'] for doc in corpus],
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if marker_batch:
+        report['marker_batch'] = marker_batch
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if stub:
+        stub.shutdown()
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
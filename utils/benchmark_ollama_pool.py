@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from stub_ollama import start_stub_server
+
+# Exercises the Ollama host pool (app/ollama_pool.py) against local stub servers - no GPU needed:
+# starts --hosts stubs, makes the last one fail --fail_rate of its requests, optionally stops it completely
+# half way through (--kill_half_way), and sends --requests streamed generate calls with --concurrency
+# threads through the pool. Prints the pool stats per host - requests, failures, latency, throughput - and
+# the number of calls that failed despite the failover (should be 0 while at least one host is up).
+#
+# Run it from the repository root with the app requirements installed:
+#   python utils/benchmark_ollama_pool.py --hosts 3 --fail_rate 0.5 --requests 200 --concurrency 12
+
+
+def generate(client):
+    response = {'text': ''}
+    for chunk in client.generate('llama3.1', 'benchmark prompt', stream=True):
+        response['text'] += chunk['response']
+        if chunk.get('done'):
+            response['eval_count'] = chunk.get('eval_count')
+            response['eval_duration'] = chunk.get('eval_duration')
+    return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Ollama host pool against local stub servers.")
+    parser.add_argument("--hosts", type=int, default=3, help="Number of stub hosts")
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds each stub response takes")
+    parser.add_argument("--fail_rate", type=float, default=0.5, help="Share of the requests failing on the last host")
+    parser.add_argument("--kill_half_way", default=False, action='store_true', help="Stop the last host after half of the requests")
+    parser.add_argument("--requests", type=int, default=100, help="Number of generate calls")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent calls")
+    parser.add_argument("--json", type=str, default=None, help="Write the stats to this JSON file")
+    args = parser.parse_args()
+
+    servers = [start_stub_server(latency=args.latency) for _ in range(args.hosts)]
+    servers[-1].fail_rate = args.fail_rate
+    os.environ['OLLAMA_HOSTS'] = ','.join(f"http://127.0.0.1:{server.server_port}" for server in servers)
+    os.environ.setdefault('OLLAMA_POOL_COOLDOWN', '2')
+    os.environ.setdefault('OLLAMA_HEALTH_INTERVAL', '1')
+
+    import ollama_pool  # reads the environment on import
+
+    pool = ollama_pool.get_pool()
+    failed = 0
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(pool.call, generate, 'generate') for _ in range(args.requests)]
+        for i, future in enumerate(futures):
+            if args.kill_half_way and i == args.requests // 2:
+                print(f"Stopping host {pool.hosts[-1].url}")
+                servers[-1].shutdown()
+                servers[-1].server_close()
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Call failed: {e}")
+    elapsed = time.time() - start
+
+    stats = pool.stats()
+    print(f"{args.requests} calls in {elapsed:.1f}s ({args.requests / elapsed:.1f}/s), {failed} failed")
+    print(f"{'host':<28} {'requests':>8} {'failures':>8} {'mean s':>8} {'tok/s':>8}")
+    for host in stats:
+        print(f"{host['host']:<28} {host['requests']:>8} {host['failures']:>8} {host['mean_seconds'] or 0:>8.3f} {host['tokens_per_second'] or 0:>8.1f}")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'calls': args.requests, 'failed': failed, 'seconds': elapsed, 'hosts': stats}, file, indent=2)
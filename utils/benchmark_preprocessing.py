@@ -0,0 +1,109 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import numpy as np
+import pytesseract
+from ocr_strategies.rasterizers import rasterize
+from ocr_strategies.preprocessing import PRESETS, preprocess
+from ocr_strategies.tesseract import RENDER_DPI, RENDER_COLORSPACE
+
+# Compares the Tesseract preprocessing presets on a set of PDFs: per-page preprocessing and OCR time
+# plus word accuracy against a reference transcription.
+#
+# The reference for `foo.pdf` is looked up as `foo-result.md` or `foo.txt` next to the PDF (or given
+# explicitly with --reference foo.pdf=path/to/reference.txt). Word accuracy is the share of reference
+# words (case insensitive, punctuation stripped) found in the OCR output, counted with multiplicity.
+#
+# Run it from the repository root with the app requirements installed:
+#   python utils/benchmark_preprocessing.py --presets default,grayscale,scan,fax --json bench_preprocessing.json
+
+
+def words(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def word_accuracy(reference, hypothesis):
+    reference_words = Counter(words(reference))
+    if not reference_words:
+        return None
+    hypothesis_words = Counter(words(hypothesis))
+    matched = sum(min(count, hypothesis_words[word]) for word, count in reference_words.items())
+    return matched / sum(reference_words.values())
+
+
+def find_reference(pdf_path, explicit):
+    if pdf_path in explicit:
+        return explicit[pdf_path]
+    stem = os.path.splitext(pdf_path)[0]
+    for candidate in (f"{stem}-result.md", f"{stem}.txt"):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def benchmark_file(pdf_path, presets, reference_text):
+    pages = [np.array(image) for image in rasterize(open(pdf_path, 'rb').read(), RENDER_DPI, RENDER_COLORSPACE)[1]]
+    results = []
+    for preset in presets:
+        preprocess_times = []
+        ocr_times = []
+        text = ''
+        for page in pages:
+            start = time.perf_counter()
+            page_image, dpi = preprocess(page, preset, RENDER_DPI)
+            preprocess_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            text += pytesseract.image_to_string(page_image, config=f"--dpi {dpi}") + '\n'
+            ocr_times.append(time.perf_counter() - start)
+
+        results.append({
+            'file': pdf_path,
+            'preset': preset,
+            'pages': len(pages),
+            'preprocess_seconds_per_page': sum(preprocess_times) / len(pages),
+            'ocr_seconds_per_page': sum(ocr_times) / len(pages),
+            'total_seconds_per_page': (sum(preprocess_times) + sum(ocr_times)) / len(pages),
+            'word_accuracy': word_accuracy(reference_text, text) if reference_text else None,
+        })
+    return results
+
+
+def print_table(results):
+    print(f"{'file':<40} {'preset':<12} {'pages':>5} {'prep s/p':>9} {'ocr s/p':>9} {'total s/p':>10} {'word acc':>9}")
+    for r in results:
+        accuracy = f"{r['word_accuracy'] * 100:.1f}%" if r['word_accuracy'] is not None else 'n/a'
+        print(f"{os.path.basename(r['file']):<40} {r['preset']:<12} {r['pages']:>5} {r['preprocess_seconds_per_page']:>9.3f} "
+              f"{r['ocr_seconds_per_page']:>9.3f} {r['total_seconds_per_page']:>10.3f} {accuracy:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Tesseract preprocessing presets: per-page time and word accuracy.")
+    parser.add_argument("files", type=str, nargs='*', help="PDF files to benchmark (default: examples/*.pdf)")
+    parser.add_argument("--presets", type=str, default=','.join(PRESETS), help="Comma separated presets to compare")
+    parser.add_argument("--reference", type=str, action='append', default=[], help="Reference transcription as file.pdf=reference.txt (repeatable)")
+    parser.add_argument("--json", type=str, default=None, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', '*.pdf')))
+    presets = [preset.strip() for preset in args.presets.split(',') if preset.strip()]
+    explicit_references = dict(ref.split('=', 1) for ref in args.reference)
+
+    all_results = []
+    for pdf_path in files:
+        reference_path = find_reference(pdf_path, explicit_references)
+        reference_text = open(reference_path, 'r').read() if reference_path else None
+        all_results.extend(benchmark_file(pdf_path, presets, reference_text))
+
+    print_table(all_results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(all_results, f, indent=2)
@@ -0,0 +1,107 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import cv2
+import numpy as np
+from ocr_strategies.rasterizers import rasterize
+from ocr_strategies.preprocessing import preprocess
+from ocr_strategies.tesseract import RENDER_DPI, RENDER_COLORSPACE
+from ocr_strategies.tesseract_engines import PytesseractEngine, TesserocrEngine, tesserocr
+from stats import percentile
+
+# Per-page overhead of the Tesseract engines (see app/ocr_strategies/tesseract_engines.py): the pytesseract
+# subprocess per page vs the resident tesserocr API handle. Pages are the rendered `examples/*.pdf` (or --files)
+# plus two synthetic pages - blank and a single line of text - where the fixed per-call cost dominates.
+#
+#   python utils/benchmark_tesseract_engines.py --repeat 3 --json bench_engines.json
+
+
+def synthetic_pages():
+    width, height = int(8.27 * RENDER_DPI), int(11.69 * RENDER_DPI)
+    blank = np.full((height, width, 3), 255, dtype=np.uint8)
+    sparse = blank.copy()
+    cv2.putText(sparse, "Invoice 2024-117 total amount due", (120, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (0, 0, 0), 3)
+    return [('synthetic-blank', blank), ('synthetic-one-line', sparse)]
+
+
+def word_agreement(reference, hypothesis):
+    reference_words = Counter(reference.split())
+    if not reference_words:
+        return None
+    hypothesis_words = Counter(hypothesis.split())
+    return sum(min(count, hypothesis_words[word]) for word, count in reference_words.items()) / sum(reference_words.values())
+
+
+def benchmark_engine(engine, pages, repeat):
+    times = {}
+    texts = {}
+    for name, image in pages:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            texts[name] = engine.image_to_string(image, RENDER_DPI)
+            times.setdefault(name, []).append(time.perf_counter() - start)
+    all_times = [t for page_times in times.values() for t in page_times]
+    return {
+        'engine': engine.name,
+        'pages': len(pages),
+        'calls': len(all_times),
+        'mean_seconds': sum(all_times) / len(all_times),
+        'p50_seconds': percentile(all_times, 50),
+        'p95_seconds': percentile(all_times, 95),
+        'per_page': {name: sum(page_times) / len(page_times) for name, page_times in times.items()},
+    }, texts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the per-page cost of the Tesseract engines.")
+    parser.add_argument("--files", type=str, nargs='*', default=None, help="PDF files (default: examples/*.pdf)")
+    parser.add_argument("--preprocessing", type=str, default='default', help="Preprocessing preset applied to the pages")
+    parser.add_argument("--repeat", type=int, default=3, help="OCR runs per page and engine")
+    parser.add_argument("--json", type=str, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    if tesserocr is None:
+        print("tesserocr is not installed (pip install tesserocr) - nothing to compare with")
+        sys.exit(1)
+
+    files = args.files if args.files is not None else sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', '*.pdf')))
+    pages = []
+    for path in files:
+        for i, image in enumerate(rasterize(open(path, 'rb').read(), RENDER_DPI, RENDER_COLORSPACE)[1]):
+            pages.append((f"{os.path.basename(path)}#{i + 1}", preprocess(np.array(image), args.preprocessing, RENDER_DPI)[0]))
+    pages.extend((name, preprocess(image, args.preprocessing, RENDER_DPI)[0]) for name, image in synthetic_pages())
+
+    tesserocr_engine = TesserocrEngine()
+    start = time.perf_counter()
+    tesserocr_engine.api()
+    init_seconds = time.perf_counter() - start  # paid once per worker process
+
+    results = []
+    outputs = {}
+    for engine in (PytesseractEngine(), tesserocr_engine):
+        print(f"Benchmarking {engine.name} on {len(pages)} pages ...")
+        result, outputs[engine.name] = benchmark_engine(engine, pages, args.repeat)
+        results.append(result)
+    results[1]['init_seconds'] = init_seconds
+    agreement = [word_agreement(outputs['pytesseract'][name], outputs['tesserocr'][name]) for name, _ in pages]
+    agreement = [a for a in agreement if a is not None]
+
+    print(f"{'page':<32} {'pytesseract s':>14} {'tesserocr s':>12}")
+    for name, _ in pages:
+        print(f"{name[:32]:<32} {results[0]['per_page'][name]:>14.3f} {results[1]['per_page'][name]:>12.3f}")
+    for result in results:
+        print(f"{result['engine']:<12} mean {result['mean_seconds']:.3f}s  p50 {result['p50_seconds']:.3f}s  p95 {result['p95_seconds']:.3f}s")
+    print(f"tesserocr init (once per process): {init_seconds:.3f}s, speedup {results[0]['mean_seconds'] / results[1]['mean_seconds']:.2f}x")
+    if agreement:
+        print(f"word agreement tesserocr vs pytesseract: {sum(agreement) / len(agreement):.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'results': results, 'word_agreement': sum(agreement) / len(agreement) if agreement else None}, file, indent=2)
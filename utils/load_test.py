@@ -0,0 +1,130 @@
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from stats import percentile
+
+# Concurrent-request latency of the API while slow Ollama calls are in flight.
+#
+# Keeps --slow_concurrency `/llm/generate` requests running (against a slow model - e.g. the stub server
+# started with a high --latency) and meanwhile measures the latency of cheap probe requests
+# (`/ocr/result/{random id}` and `/llm/models`). With blocking calls in the `async def` handlers one slow
+# generation stalls the whole uvicorn worker and the probe latency climbs to the generation time; with the
+# non-blocking handlers it stays in the milliseconds. Run it against both versions to compare:
+#
+#   python utils/stub_ollama.py --port 11435 --latency 3
+#   OLLAMA_HOST=http://localhost:11435 uvicorn main:app --port 8000      # in app/
+#   python utils/load_test.py --url http://localhost:8000 --duration 20 --json after.json
+#   python utils/load_test.py --url http://localhost:8000 --baseline before.json
+
+
+def summarize(latencies, errors):
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        'max_ms': round(max(latencies) * 1000, 1) if latencies else None,
+    }
+
+
+def run_slow_requests(url, model, stop, results, lock):
+    session = requests.Session()
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            ok = session.post(f"{url}/llm/generate", json={'model': model, 'prompt': 'Load test prompt'}, timeout=300).ok
+        except requests.RequestException:
+            ok = False
+        with lock:
+            results['latencies' if ok else 'errors'].append(time.perf_counter() - started)
+
+
+def run_probes(url, endpoint, interval, stop, results, lock):
+    session = requests.Session()
+    while not stop.is_set():
+        path = endpoint.replace('{task_id}', str(uuid.uuid4()))
+        started = time.perf_counter()
+        try:
+            ok = session.get(f"{url}{path}", timeout=300).status_code < 500
+        except requests.RequestException:
+            ok = False
+        with lock:
+            results['latencies' if ok else 'errors'].append(time.perf_counter() - started)
+        time.sleep(interval)
+
+
+def load_test(url, model, duration, slow_concurrency, probe_concurrency, probe_interval, endpoints):
+    stop = threading.Event()
+    lock = threading.Lock()
+    slow = {'latencies': [], 'errors': []}
+    probes = {endpoint: {'latencies': [], 'errors': []} for endpoint in endpoints}
+
+    workers = slow_concurrency + probe_concurrency * len(endpoints)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(slow_concurrency):
+            executor.submit(run_slow_requests, url, model, stop, slow, lock)
+        time.sleep(0.5)  # let the slow requests reach the server first
+        for endpoint in endpoints:
+            for _ in range(probe_concurrency):
+                executor.submit(run_probes, url, endpoint, probe_interval, stop, probes[endpoint], lock)
+        time.sleep(duration)
+        stop.set()
+
+    return {
+        'url': url,
+        'duration': duration,
+        'slow_concurrency': slow_concurrency,
+        'probe_concurrency': probe_concurrency,
+        'slow': summarize(slow['latencies'], len(slow['errors'])),
+        'probes': {endpoint: summarize(result['latencies'], len(result['errors'])) for endpoint, result in probes.items()},
+    }
+
+
+def print_report(report, baseline=None):
+    def fmt(value):
+        return 'n/a' if value is None else f"{value:.1f}"
+
+    print(f"{'endpoint':<26} {'requests':>8} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = [('/llm/generate (slow)', report['slow'])] + list(report['probes'].items())
+    for endpoint, stats in rows:
+        print(f"{endpoint:<26} {stats['requests']:>8} {stats['errors']:>6} {fmt(stats['p50_ms']):>9} {fmt(stats['p95_ms']):>9} {fmt(stats['p99_ms']):>9} {fmt(stats['max_ms']):>9}")
+        if baseline and endpoint in baseline.get('probes', {}):
+            before = baseline['probes'][endpoint]
+            print(f"{'  baseline':<26} {before['requests']:>8} {before['errors']:>6} {fmt(before['p50_ms']):>9} {fmt(before['p95_ms']):>9} {fmt(before['p99_ms']):>9} {fmt(before['max_ms']):>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure API latency under concurrent slow Ollama requests.")
+    parser.add_argument("--url", type=str, default='http://localhost:8000', help="URL of the running API")
+    parser.add_argument("--model", type=str, default='llama3.1', help="Model used for the slow /llm/generate requests")
+    parser.add_argument("--duration", type=float, default=15, help="Seconds to run the load")
+    parser.add_argument("--slow_concurrency", type=int, default=4, help="Number of /llm/generate requests kept in flight")
+    parser.add_argument("--probe_concurrency", type=int, default=2, help="Number of concurrent probe clients per endpoint")
+    parser.add_argument("--probe_interval", type=float, default=0.05, help="Pause between probe requests of one client")
+    parser.add_argument("--endpoints", type=str, default='/ocr/result/{task_id},/llm/models', help="Comma separated probe endpoints")
+    parser.add_argument("--json", type=str, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=str, help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+
+    report = load_test(args.url, args.model, args.duration, args.slow_concurrency, args.probe_concurrency,
+                       args.probe_interval, [endpoint for endpoint in args.endpoints.split(',') if endpoint])
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if not any(stats['requests'] for stats in report['probes'].values()):
+        print("No probe request completed.", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,11 @@
+import math
+
+# Summary statistics shared by the benchmark and load test scripts.
+
+
+def percentile(values, p):
+    """Nearest-rank `p`th percentile (0-100) of `values`, None when there are none."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))]
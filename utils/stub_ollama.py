@@ -0,0 +1,246 @@
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Minimal stand-in for the Ollama HTTP API used by the benchmarks and for local testing without
+# a GPU or downloaded models. Implements the endpoints pdf-extract-api calls: /api/generate,
+# /api/chat (streaming and not), /api/pull, /api/tags, /api/ps and /api/show.
+#
+# Every response takes `latency` seconds and is streamed as `chunks` pieces. `fail_rate` of the generate/chat
+# requests fail with a 503 (an overloaded or broken host) - `server.fail_rate` can be changed while it runs.
+# With `load_latency` a model not loaded (or past its `keep_alive`) takes that long to load first - reported as
+# `load_duration` like Ollama does - and only `max_loaded` models stay loaded (a shared GPU).
+# Run it standalone (`--count 3` starts three stubs on consecutive ports - a local pool of hosts):
+#   python utils/stub_ollama.py --port 11435 --latency 0.2
+#   OLLAMA_HOST=http://localhost:11435 celery -A main.celery worker ...
+#   OLLAMA_HOSTS=http://localhost:11435,http://localhost:11436 ...
+
+STUB_MODELS = ['llama3.1', 'llama3.2-vision']
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def model_entry(name):
+    return {
+        'name': f"{name}:latest",
+        'model': f"{name}:latest",
+        'modified_at': now(),
+        'size': 1024,
+        'digest': 'stub',
+        'details': {
+            'format': 'gguf',
+            'family': 'llama',
+            'families': ['llama'],
+            'parameter_size': '0B',
+            'quantization_level': 'stub',
+        },
+    }
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        return json.loads(body) if body else {}
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, chunks):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in chunks:
+            data = (json.dumps(chunk) + '\n').encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _load(self, request):
+        """Load the model of the request when it isn't loaded - returns the load time in ns."""
+        server = self.server
+        model = request.get('model', '')
+        keep_alive = keep_alive_seconds(request.get('keep_alive'))
+        with server.lock:
+            now_ = time.time()
+            cold = server.loaded.get(model, 0) < now_
+            if cold:
+                # the least recently used models are evicted to make room
+                for other in sorted(server.loaded, key=server.loaded.get)[:max(0, len(server.loaded) + 1 - server.max_loaded)]:
+                    if other != model:
+                        del server.loaded[other]
+            server.loaded[model] = now_ + (keep_alive if keep_alive >= 0 else 10 ** 9)
+        if cold and server.load_latency:
+            time.sleep(server.load_latency)
+            return int(server.load_latency * 1e9)
+        return 0
+
+    def _completion(self, request, build_chunk):
+        """Yield `chunks` partial responses followed by the final one carrying the timing counters."""
+        server = self.server
+        model = request.get('model', '')
+        load_duration = self._load(request)
+        words = [f"stub-{i}" for i in range(server.chunks)]
+        delay = server.latency / max(1, server.chunks)
+        started = time.perf_counter_ns()
+        for word in words:
+            time.sleep(delay)
+            yield build_chunk(model, word + ' ', False)
+        final = build_chunk(model, '', True)
+        elapsed = time.perf_counter_ns() - started
+        final.update({
+            'done_reason': 'stop',
+            'total_duration': elapsed,
+            'load_duration': load_duration,
+            'prompt_eval_count': len(str(request.get('prompt') or request.get('messages') or '')) // 4,
+            'prompt_eval_duration': 0,
+            'eval_count': len(words),
+            'eval_duration': elapsed,
+        })
+        yield final
+
+    def _respond(self, request, build_chunk, merge_key):
+        if self.server.fail_rate and random.random() < self.server.fail_rate:
+            with self.server.lock:
+                self.server.failures += 1
+            self._send_json({'error': 'stub failure'}, status=503)
+            return
+        chunks = self._completion(request, build_chunk)
+        if request.get('stream', True):
+            self._send_stream(chunks)
+            return
+        chunks = list(chunks)
+        final = chunks[-1]
+        merge_key(final, chunks)
+        self._send_json(final)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        if self.path in ('/', ''):
+            body = b'Ollama is running'
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/api/tags':
+            self._send_json({'models': [model_entry(name) for name in STUB_MODELS]})
+        elif self.path == '/api/ps':
+            with self.server.lock:
+                loaded = [name for name, expires_at in self.server.loaded.items() if expires_at >= time.time()]
+            self._send_json({'models': [dict(model_entry(name), expires_at=now(), size_vram=0) for name in loaded]})
+        elif self.path == '/api/version':
+            self._send_json({'version': '0.0.0-stub'})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        with self.server.lock:
+            self.server.requests += 1
+        request = self._read_json()
+        if self.path == '/api/generate':
+            def build(model, text, done):
+                return {'model': model, 'created_at': now(), 'response': text, 'done': done}
+
+            def merge(final, chunks):
+                final['response'] = ''.join(chunk['response'] for chunk in chunks)
+
+            self._respond(request, build, merge)
+        elif self.path == '/api/chat':
+            def build(model, text, done):
+                return {'model': model, 'created_at': now(), 'message': {'role': 'assistant', 'content': text}, 'done': done}
+
+            def merge(final, chunks):
+                final['message']['content'] = ''.join(chunk['message']['content'] for chunk in chunks)
+
+            self._respond(request, build, merge)
+        elif self.path == '/api/pull':
+            if request.get('stream', True):
+                self._send_stream([{'status': 'pulling manifest'}, {'status': 'success'}])
+            else:
+                self._send_json({'status': 'success'})
+        elif self.path == '/api/show':
+            self._send_json({'modelfile': '', 'parameters': '', 'template': '', 'details': model_entry(request.get('model', ''))['details']})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+
+def keep_alive_seconds(value):
+    """Seconds of an Ollama `keep_alive` (`10m`, `1h`, `30s`, a number; -1 - forever), 5 minutes by default."""
+    if value is None or value == '':
+        return 300
+    if isinstance(value, (int, float)):
+        return value
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    if value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def start_stub_server(host='127.0.0.1', port=0, latency=0.05, chunks=8, verbose=False, fail_rate=0.0, load_latency=0.0, max_loaded=2):
+    """Start the stub in a daemon thread; returns the server - its URL is `f"http://{host}:{server.server_port}"`."""
+    server = ThreadingHTTPServer((host, port), StubOllamaHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.chunks = chunks
+    server.verbose = verbose
+    server.fail_rate = fail_rate
+    server.load_latency = load_latency
+    server.max_loaded = max_loaded
+    server.loaded = {}  # model: expires at
+    server.requests = 0
+    server.failures = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub Ollama API server.")
+    parser.add_argument("--host", type=str, default='127.0.0.1', help="Interface to bind")
+    parser.add_argument("--port", type=int, default=11435, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds each generate/chat response takes")
+    parser.add_argument("--chunks", type=int, default=8, help="Number of streamed chunks per response")
+    parser.add_argument("--fail_rate", type=float, default=0.0, help="Share of generate/chat requests failing with a 503")
+    parser.add_argument("--load_latency", type=float, default=0.0, help="Seconds loading a model not loaded takes")
+    parser.add_argument("--max_loaded", type=int, default=2, help="Models loaded at the same time")
+    parser.add_argument("--count", type=int, default=1, help="Number of stubs to start on consecutive ports")
+    parser.add_argument("--verbose", default=False, action='store_true', help="Log every request")
+    args = parser.parse_args()
+
+    servers = [start_stub_server(args.host, args.port + i if args.port else 0, args.latency, args.chunks, args.verbose, args.fail_rate, args.load_latency, args.max_loaded)
+               for i in range(args.count)]
+    for server in servers:
+        print(f"Stub Ollama listening on http://{args.host}:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()